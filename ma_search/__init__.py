@@ -82,11 +82,13 @@ CONFIG = Config()
 def apiMain():
     """This is the main entry point for the api process.
     """
-    from ma_search.api import app
+    from ma_search.api import app, startWarmUp
 
     if not CONFIG.readConfig(configFile=os.environ.get("MA_SEARCH_CONFIG", None)):
         sys.exit(1)
 
+    startWarmUp()
+
     sys.exit(app.run())
 
 # END apiMain
@@ -95,11 +97,12 @@ def apiMain():
 def maintenance(sysArgs):
     """The maintenance script entry point.
     """
-    from ma_search.utils import ingestCap
+    from ma_search.utils import ingestCap, rebuildIndex
     if len(sysArgs) < 2:
         print(
             "Available commands:\n"
             "  ingest_cap      Ingest CAP file(s)\n"
+            "  rebuild_index   Rebuild the alert and/or map index\n"
             "\n"
             "For help please run:\n"
             "  ./maintenance.py [command] --help"
@@ -110,3 +113,5 @@ def maintenance(sysArgs):
 
     if cmd == "ingest_cap":
         ingestCap(sysArgs[2:])
+    elif cmd == "rebuild_index":
+        rebuildIndex(sysArgs[2:])
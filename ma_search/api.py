@@ -17,23 +17,146 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-from flask import Flask, request, jsonify
+import json
+import time
+import logging
+import functools
+import threading
 
-from ma_search.data import Data, Shape
+from flask import Flask, Response, request, jsonify, stream_with_context
+
+from ma_search.data import Data
+from ma_search.common import parseDateString, textTokens
+from ma_search.data.data import (
+    DEFAULT_PRECISION, INDEX_FIELDS, MAP_FIELDS, MAP_POINT_FIELDS, POINT_FIELDS, RECORD_FIELDS
+)
+from ma_search.metrics import METRICS
+
+logger = logging.getLogger(__name__)
 
 app = Flask(__name__)
 data = Data()
 
+# Cleared while the warm-up is running
+_ready = threading.Event()
+_ready.set()
+
+MIME_NDJSON = "application/x-ndjson"
+MIME_PROMETHEUS = "text/plain; version=0.0.4"
+
 MSG_GEOJSON = (
     "Payload must contain an object named 'polygon' cotaining a "
     "valid geoJson Polygon or MultiPolygon\n"
 )
+MSG_BATCH = (
+    "Payload must contain a list named 'polygons' of objects with a unique 'name' "
+    "and a 'polygon' or 'region'\n"
+)
+MSG_POINT = (
+    "Payload must contain either a 'point' or a list of 'points', each a list of a longitude "
+    "in the range [-180, 180] and a latitude in the range [-90, 90]\n"
+)
+MSG_GEOCODE = (
+    "The 'geocode' search parameter must be an object of value names, each with a string or "
+    "a list of strings\n"
+)
+MSG_GEOCODE_MAP = "The 'geocode' search parameter is only available for alerts\n"
+MSG_GEOCODE_SHAPE = (
+    "The 'geocode' search parameter can't be combined with a 'polygon' or a 'region'\n"
+)
+MSG_PRECISION = "The 'precision' search parameter must be a number in the interval [0.0, 1.0)\n"
 MSG_VERTICAL = "The 'vertical' search parameter must be a list of 2 integers or floats\n"
 MSG_CUTOFF = "The 'cutoff' search parameter must be a float in the interval (0.0, 1.0] \n"
+MSG_CUTOFF_ON = "The 'cutoff_on' search parameter must be either 'query' or 'record'\n"
+MSG_MODE = "The 'mode' search parameter must be one of 'exact', 'approx' or 'bbox'\n"
+MSG_APPROX = "The 'approx' search mode is not enabled on this server\n"
+MSG_APPROX_MAP = "The 'approx' search mode is only available for alerts\n"
+MSG_APPROX_INDEX = "The 'approx' search mode is not available until the index is rebuilt\n"
 MSG_MAXRES = "The 'maxres' search parameter must be an integer larger than 0\n"
+MSG_TIMEOUT = "The 'timeout_ms' search parameter must be an integer larger than 0\n"
+MSG_SORT = "The 'sort' search parameter must be either 'overlap' or 'sent'\n"
+MSG_TIME = (
+    "The 'time' search parameter must be an ISO 8601 date string, or a list of a start "
+    "and an end date string in order, either of which may be null\n"
+)
+MSG_FILTER = "The '%s' search parameter must be a list of one or more %s\n"
+MSG_FILTER_MAP = "The 'time' and CAP field search parameters are only available for alerts\n"
+MSG_TEXT = "The 'text' search parameter must be a string with one or more words\n"
+MSG_TEXT_MAP = "The 'text' search parameter is only available for alerts\n"
+MSG_FIELDS = (
+    "The 'fields' search parameter must be a list of one or more of: %s\n"
+) % ", ".join(RECORD_FIELDS)
+MSG_MAP_FIELDS = (
+    "The 'fields' search parameter must be a list of one or more of: %s\n"
+) % ", ".join(MAP_FIELDS)
+MSG_APPROX_FIELDS = (
+    "The 'fields' search parameter must be a list of one or more of: %s\n"
+) % ", ".join(INDEX_FIELDS)
+MSG_POINT_FIELDS = (
+    "The 'fields' search parameter must be a list of one or more of: %s\n"
+) % ", ".join(POINT_FIELDS)
+MSG_MAP_POINT_FIELDS = (
+    "The 'fields' search parameter must be a list of one or more of: %s\n"
+) % ", ".join(MAP_POINT_FIELDS)
+
+
+def startWarmUp():
+    """Rebuild the data object from the current config, and run the
+    warm-up in a background thread if it is enabled. The ready endpoint
+    reports that the service is unavailable until it has finished.
+
+    Returns
+    -------
+    :obj:`threading.Thread` or None
+        The warm-up thread, or None if warm-up is disabled.
+    """
+    global data
+    data = Data()
+    if not data.conf.warmupEnabled:
+        _ready.set()
+        return None
+
+    _ready.clear()
+    thread = threading.Thread(target=_warmUp, name="WarmUp", daemon=True)
+    thread.start()
+
+    return thread
+
+
+def _timedRequest(func):
+    """Decorator measuring the latency of each request. A streamed
+    response is timed until its body has been sent, and not just until
+    the generator producing it has been returned.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            METRICS.observe("request", time.perf_counter() - start)
+            raise
+        response = result[0] if isinstance(result, tuple) else result
+        if isinstance(response, Response) and response.is_streamed:
+            response.call_on_close(
+                lambda: METRICS.observe("request", time.perf_counter() - start)
+            )
+        else:
+            METRICS.observe("request", time.perf_counter() - start)
+        return result
+    return wrapper
+
+
+@app.route("/v1/ready", methods=["GET"])
+def apiV1Ready():
+    """Report whether the service is ready to take traffic."""
+    if not _ready.is_set():
+        return "Warming up\n", 503
+    return "Ready\n", 200
 
 
 @app.route("/v1/search/<target>", methods=["POST"])
+@_timedRequest
 def apiV1Search(target):
     """The main search entry point.
     """
@@ -49,42 +172,488 @@ def apiV1Search(target):
     if not isinstance(payload, dict):
         return "Could not parse JSON payload\n", 400
 
-    # Payload must contain a geojson
-    geoJson = payload.get("polygon", None)
-    shape = Shape.polygonFromGeoJson(geoJson)
+    # Geocode lookups don't need a polygon
+    if "geocode" in payload:
+        return _searchGeocode(payload, target)
+
+    # Payload must contain a stored region or a geojson
+    precision, error = _precisionParam(payload)
+    if error is not None:
+        return error, 400
+
+    shape, tolerance, error = _searchShape(payload, precision)
+    if error is not None:
+        return error
+
+    params, error = _searchParams(payload, target)
+    if error is not None:
+        return error, 400
+
+    # Stream the records as newline delimited JSON if requested
+    mimeType = request.accept_mimetypes.best_match(["application/json", MIME_NDJSON])
+    if mimeType == MIME_NDJSON:
+        status = {}
+        records = data.iterOverlap(target, shape, status=status, **params)
+        if records is None:
+            return "Internal Server Error\n", 500
+        response = Response(
+            stream_with_context(_streamRecords(records, status, {"tolerance": tolerance})),
+            mimetype=MIME_NDJSON
+        )
+        response.headers["X-Estimate"] = "true" if params["mode"] != "exact" else "false"
+        return response
+
+    # Run the search
+    result = data.findOverlap(target, shape, **params)
+    if result is None:
+        return "Internal Server Error\n", 500
+
+    result["tolerance"] = tolerance
+
+    with METRICS.timer("serialise"):
+        response = jsonify(result)
+
+    return response, 200
+
+
+@app.route("/v1/search/<target>/batch", methods=["POST"])
+@_timedRequest
+def apiV1SearchBatch(target):
+    """Search for several named polygons in one request. The search
+    parameters are shared by all the polygons.
+    """
+    if target not in ("map", "alert"):
+        return f"No such search target '{target}'\n", 404
+
+    # Decode payload
+    payload = request.get_json(force=False, silent=True, cache=False)
+    if not isinstance(payload, dict):
+        return "Could not parse JSON payload\n", 400
+
+    # Payload must contain a list of named geojsons
+    polygons = payload.get("polygons", None)
+    if not (isinstance(polygons, list) and polygons):
+        return MSG_BATCH, 400
+
+    precision, error = _precisionParam(payload)
+    if error is not None:
+        return error, 400
+
+    shapes = {}
+    tolerances = {}
+    for entry in polygons:
+        if not isinstance(entry, dict):
+            return MSG_BATCH, 400
+        name = entry.get("name", None)
+        if not (isinstance(name, str) and name) or name in shapes:
+            return MSG_BATCH, 400
+        shape, tolerance, error = _searchShape(entry, precision)
+        if error is not None:
+            if error[0] == MSG_GEOJSON:
+                return f"Polygon '{name}' is not a valid geoJson Polygon or MultiPolygon\n", 400
+            return error
+        shapes[name] = shape
+        tolerances[name] = tolerance
+
+    params, error = _searchParams(payload, target)
+    if error is not None:
+        return error, 400
+
+    # Run the search
+    result = data.findOverlapBatch(target, shapes, **params)
+    if result is None:
+        return "Internal Server Error\n", 500
+
+    for name, tolerance in tolerances.items():
+        result["results"][name]["tolerance"] = tolerance
+
+    return jsonify(result), 200
+
+
+@app.route("/v1/point/<target>", methods=["POST"])
+@_timedRequest
+def apiV1Point(target):
+    """Find the records with a polygon containing a point, or each
+    of a list of points.
+    """
+    if target not in ("map", "alert"):
+        return f"No such search target '{target}'\n", 404
+
+    # Decode payload
+    payload = request.get_json(force=False, silent=True, cache=False)
+    if not isinstance(payload, dict):
+        return "Could not parse JSON payload\n", 400
+
+    # Payload must contain a point or a list of points
+    isBulk = "points" in payload
+    points = payload.get("points", None) if isBulk else [payload.get("point", None)]
+    if not (isinstance(points, list) and points):
+        return MSG_POINT, 400
+    for point in points:
+        if not (isinstance(point, list) and len(point) == 2):
+            return MSG_POINT, 400
+        lon, lat = point
+        if not (isinstance(lon, (int, float)) and isinstance(lat, (int, float))):
+            return MSG_POINT, 400
+        if not (-180.0 <= lon <= 180.0 and -90.0 <= lat <= 90.0):
+            return MSG_POINT, 400
+
+    vertical, error = _verticalParam(payload)
+    if error is not None:
+        return error, 400
+
+    # Fields parameter
+    if target == "map":
+        known, msgFields = MAP_POINT_FIELDS, MSG_MAP_POINT_FIELDS
+    else:
+        known, msgFields = POINT_FIELDS, MSG_POINT_FIELDS
+    fields = payload.get("fields", None)
+    if fields is not None:
+        if not (isinstance(fields, list) and fields):
+            return msgFields, 400
+        if not all(field in known for field in fields):
+            return msgFields, 400
+
+    # Run the search
+    results = data.findPoints(target, points, vertical, fields)
+    if results is None:
+        return "Internal Server Error\n", 500
+
+    if isBulk:
+        return jsonify({"results": results}), 200
+
+    return jsonify(results[0]), 200
+
+
+def _searchGeocode(payload, target):
+    """Find the alerts with any of a set of geocodes. Only the index is
+    searched, and no polygons are used.
+    """
+    if target != "alert":
+        return MSG_GEOCODE_MAP, 400
+    if "polygon" in payload or "region" in payload:
+        return MSG_GEOCODE_SHAPE, 400
+
+    geocodes = payload.get("geocode", None)
+    if not (isinstance(geocodes, dict) and geocodes):
+        return MSG_GEOCODE, 400
+    for values in geocodes.values():
+        values = values if isinstance(values, list) else [values]
+        if not (values and all(isinstance(value, str) for value in values)):
+            return MSG_GEOCODE, 400
+
+    vertical, error = _verticalParam(payload)
+    if error is not None:
+        return error, 400
+
+    maxres = payload.get("maxres", 1000)
+    if not (isinstance(maxres, int) and maxres > 0):
+        return MSG_MAXRES, 400
+
+    fields = payload.get("fields", None)
+    if fields is not None:
+        if not (isinstance(fields, list) and fields):
+            return MSG_POINT_FIELDS, 400
+        if not all(field in POINT_FIELDS for field in fields):
+            return MSG_POINT_FIELDS, 400
+
+    period, error = _periodParam(payload, target)
+    if error is not None:
+        return error, 400
+
+    filters, error = _filterParams(payload, target)
+    if error is not None:
+        return error, 400
+
+    text, error = _textParam(payload, target)
+    if error is not None:
+        return error, 400
+
+    # Run the search
+    result = data.findGeocodes(
+        target, geocodes, vertical, maxres, fields, period, filters, text
+    )
+    if result is None:
+        return "Internal Server Error\n", 500
+
+    # Stream the records as newline delimited JSON if requested
+    mimeType = request.accept_mimetypes.best_match(["application/json", MIME_NDJSON])
+    if mimeType == MIME_NDJSON:
+        return Response(
+            _streamRecords(result["results"], {}, {"maxres": maxres}), mimetype=MIME_NDJSON
+        )
+
+    return jsonify(result), 200
+
+
+def _searchShape(payload, precision):
+    """Read the search polygon from a stored region or a geoJson. The
+    geoJson is normalised before use. Returns a tuple of the polygon,
+    the simplification tolerance, and an error response, which is None
+    if successful.
+    """
+    region = payload.get("region", None)
+    if region is not None:
+        shape = data.getRegion(region)
+        if shape is None:
+            return None, 0.0, (f"No such region '{region}'\n", 404)
+        return shape, 0.0, None
+
+    shape, tolerance = data.normaliseQuery(payload.get("polygon", None), precision)
     if shape is None:
-        return MSG_GEOJSON, 400
+        return None, 0.0, (MSG_GEOJSON, 400)
 
-    # Vertical range must be a list of two ints or floats
+    return shape, tolerance, None
+
+
+def _precisionParam(payload):
+    """Read and check the precision parameter. Returns a tuple of the
+    precision and an error message, one of which is None.
+    """
+    precision = payload.get("precision", DEFAULT_PRECISION)
+    if not isinstance(precision, (int, float)):
+        return None, MSG_PRECISION
+    if not (0.0 <= precision < 1.0):
+        return None, MSG_PRECISION
+
+    return float(precision), None
+
+
+def _verticalParam(payload):
+    """Read and check the vertical range parameter. Returns a tuple of
+    the range and an error message, one of which is None.
+    """
     vertical = payload.get("vertical", None)
-    if vertical is not None:
-        if not isinstance(vertical, list):
-            return MSG_VERTICAL, 400
-        if len(vertical) != 2:
-            return MSG_VERTICAL, 400
-        altitude = vertical[0]
-        ceiling = vertical[1]
-        if not (isinstance(altitude, (int, float)) and isinstance(ceiling, (int, float))):
-            return MSG_VERTICAL, 400
-        vertical = (altitude, ceiling)
+    if vertical is None:
+        return None, None
+    if not isinstance(vertical, list):
+        return None, MSG_VERTICAL
+    if len(vertical) != 2:
+        return None, MSG_VERTICAL
+    altitude = vertical[0]
+    ceiling = vertical[1]
+    if not (isinstance(altitude, (int, float)) and isinstance(ceiling, (int, float))):
+        return None, MSG_VERTICAL
+
+    return (altitude, ceiling), None
+
+
+def _periodParam(payload, target):
+    """Read and check the time parameter. Either a single date, or a
+    list of a start and an end date. Returns a tuple of the (start, end)
+    period and an error message, one of which is None.
+    """
+    period = payload.get("time", None)
+    if period is None:
+        return None, None
+    if target == "map":
+        return None, MSG_FILTER_MAP
+    if isinstance(period, str):
+        period = [period, period]
+    if not (isinstance(period, list) and len(period) == 2):
+        return None, MSG_TIME
+
+    dates = []
+    for value in period:
+        date = None if value is None else parseDateString(value)
+        if value is not None and date is None:
+            return None, MSG_TIME
+        dates.append(date)
+
+    start, end = dates
+    if start is not None and end is not None:
+        try:
+            if end < start:
+                return None, MSG_TIME
+        except TypeError:
+            # Mixing dates with and without a time zone
+            return None, MSG_TIME
+
+    return (start, end), None
+
+
+def _filterParams(payload, target):
+    """Read and check the CAP field filter parameters. Returns a tuple
+    of the filters dictionary and an error message, one of which is
+    None.
+    """
+    filters = {}
+    for name, key, valueType, typeName in (
+        ("event", "event", str, "strings"),
+        ("urgency", "urgency", str, "strings"),
+        ("severity", "severity", str, "strings"),
+        ("certainty", "certainty", str, "strings"),
+        ("awareness_level", "awarenessLevel", int, "integers"),
+    ):
+        values = payload.get(name, None)
+        if values is None:
+            continue
+        if target == "map":
+            return None, MSG_FILTER_MAP
+        if not (isinstance(values, list) and values):
+            return None, MSG_FILTER % (name, typeName)
+        if not all(isinstance(v, valueType) and not isinstance(v, bool) for v in values):
+            return None, MSG_FILTER % (name, typeName)
+        filters[key] = values
+
+    return filters or None, None
+
+
+def _textParam(payload, target):
+    """Read and check the text parameter, which is matched against the
+    area descriptions of alerts. Returns a tuple of the text and an
+    error message, one of which is None.
+    """
+    text = payload.get("text", None)
+    if text is None:
+        return None, None
+    if target == "map":
+        return None, MSG_TEXT_MAP
+    if not (isinstance(text, str) and textTokens(text)):
+        return None, MSG_TEXT
+
+    return text, None
+
+
+def _searchParams(payload, target):
+    """Read and check the search parameters shared by the search
+    endpoints. Returns a dictionary of the parameters, by their
+    keyword in the search functions, and an error message, one of
+    which is None.
+    """
+    # Vertical range must be a list of two ints or floats
+    vertical, error = _verticalParam(payload)
+    if error is not None:
+        return None, error
 
     # Area cutoff parameter
     cutoff = payload.get("cutoff", 0.01)
     if not isinstance(cutoff, float):
-        return MSG_CUTOFF, 400
+        return None, MSG_CUTOFF
     if not (cutoff > 0.0 and cutoff <= 1.0):
-        return MSG_CUTOFF, 400
+        return None, MSG_CUTOFF
+
+    # Area cutoff ratio parameter
+    cutoffOn = payload.get("cutoff_on", "query")
+    if cutoffOn not in ("query", "record"):
+        return None, MSG_CUTOFF_ON
 
     # Max results parameter
     maxres = payload.get("maxres", 1000)
     if not isinstance(maxres, int):
-        return MSG_MAXRES, 400
+        return None, MSG_MAXRES
     if not maxres > 0:
-        return MSG_MAXRES, 400
+        return None, MSG_MAXRES
 
-    # Run the search
-    result = data.findOverlap(target, shape, vertical, cutoff, maxres)
-    if result is None:
-        return "Internal Server Error\n", 500
+    # Sort parameter
+    sort = payload.get("sort", "overlap")
+    if sort not in ("overlap", "sent"):
+        return None, MSG_SORT
 
-    return jsonify(result), 200
+    # Fields parameter
+    fields = payload.get("fields", None)
+    if fields is not None:
+        known, msgFields = RECORD_FIELDS, MSG_FIELDS
+        if target == "map":
+            known, msgFields = MAP_FIELDS, MSG_MAP_FIELDS
+        if not (isinstance(fields, list) and fields):
+            return None, msgFields
+        if not all(field in known for field in fields):
+            return None, msgFields
+
+    # Timeout parameter
+    timeout = payload.get("timeout_ms", data.conf.searchTimeout)
+    if timeout is not None:
+        if not isinstance(timeout, int):
+            return None, MSG_TIMEOUT
+        if not timeout > 0:
+            return None, MSG_TIMEOUT
+
+    # Mode parameter
+    mode = payload.get("mode", "exact")
+    if mode not in ("exact", "approx", "bbox"):
+        return None, MSG_MODE
+    if mode == "approx":
+        if target == "map":
+            return None, MSG_APPROX_MAP
+        if data.conf.searchGridLevel is None:
+            return None, MSG_APPROX
+        if not data.hasGridCells():
+            return None, MSG_APPROX_INDEX
+    if mode != "exact" and target == "alert":
+        if fields is not None and not all(field in INDEX_FIELDS for field in fields):
+            return None, MSG_APPROX_FIELDS
+
+    # Validity period and CAP field filters
+    period, error = _periodParam(payload, target)
+    if error is not None:
+        return None, error
+
+    filters, error = _filterParams(payload, target)
+    if error is not None:
+        return None, error
+
+    # Area description text
+    text, error = _textParam(payload, target)
+    if error is not None:
+        return None, error
+
+    params = {
+        "vertical": vertical,
+        "cutoff": cutoff,
+        "maxres": maxres,
+        "sort": sort,
+        "fields": fields,
+        "timeout": timeout,
+        "cutoffOn": cutoffOn,
+        "mode": mode,
+        "period": period,
+        "filters": filters,
+        "text": text,
+    }
+    return params, None
+
+
+@app.route("/metrics", methods=["GET"])
+def apiMetrics():
+    """The search latencies and record counts in the Prometheus text
+    format.
+    """
+    return Response(METRICS.exposition(), mimetype=MIME_PROMETHEUS)
+
+
+def _warmUp():
+    """Run the warm-up, and flag the service as ready when done. The
+    warm-up has its own data object, as an SQLite connection can only
+    be used by the thread that opened it. The loaded alerts and map
+    regions are kept in the process-wide caches.
+    """
+    try:
+        logger.info("Warming up")
+        warmData = Data()
+        if not warmData.warmUp(warmData.conf.warmupAlertDays, warmData.conf.warmupMaps):
+            logger.error("Warm-up failed")
+        else:
+            logger.info("Warm-up completed")
+    finally:
+        _ready.set()
+    return
+
+
+def _streamRecords(records, status, extra):
+    """Serialise each record to a line of JSON as it is produced, and
+    end the stream with a trailer holding the record count, whether the
+    search ran out of time, and the extra keys of the regular response,
+    like the tolerance of the search polygon.
+    """
+    count = 0
+    for record in records:
+        with METRICS.timer("serialise"):
+            line = json.dumps(record, ensure_ascii=False) + "\n"
+        count += 1
+        yield line
+    yield json.dumps({
+        "records": count,
+        "partial": status.get("partial", False),
+        **extra,
+    }) + "\n"
@@ -18,11 +18,13 @@ limitations under the License.
 """
 
 import os
+import re
 import sys
 import json
 import uuid
 import logging
 import datetime
+import unicodedata
 
 logger = logging.getLogger(__name__)
 
@@ -37,6 +39,16 @@ def checkFloat(value, default, allowNone=False):
         return default
 
 
+def checkInt(value, default, allowNone=False):
+    """Check if a variable is an integer or a none."""
+    if allowNone and (value is None or value == "None"):
+        return None
+    try:
+        return int(value)
+    except Exception:
+        return default
+
+
 def preparePath(baseDir, prefix, fUUID):
     """Assemble a path from a base directory and a UUID and make sure
     the folders are created. The base directory must already exist.
@@ -261,3 +273,30 @@ def parseDateString(value, default=None):
         return default
 
     return parsed
+
+
+def dateToTimestamp(value):
+    """Convert a datetime object to seconds since the Unix epoch. Dates
+    without a time zone are taken to be UTC. None is returned as None.
+    """
+    if value is None:
+        return None
+
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=datetime.timezone.utc)
+
+    return value.timestamp()
+
+
+def textTokens(value):
+    """Split a text into lower case words without diacritics, like the
+    SQLite FTS5 unicode61 tokenizer does. Returns an empty list if the
+    value is not a string.
+    """
+    if not isinstance(value, str):
+        return []
+
+    value = unicodedata.normalize("NFKD", value.lower())
+    value = "".join(char for char in value if not unicodedata.combining(char))
+
+    return re.findall(r"[^\W_]+", value)
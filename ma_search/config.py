@@ -47,6 +47,18 @@ class Config():
         # SQLite Settings
         self.sqlitePath = None
 
+        # Memory Settings
+        self.memoryPath = None
+
+        # Search Settings
+        self.searchTimeout = None
+        self.searchGridLevel = None
+
+        # Warm-up Settings
+        self.warmupEnabled = False
+        self.warmupAlertDays = None
+        self.warmupMaps = False
+
         return
 
     def readConfig(self, configFile=None):
@@ -82,6 +94,9 @@ class Config():
         # Read Values
         self._readCoreSettings()
         self._readSQLiteSettings()
+        self._readMemorySettings()
+        self._readSearchSettings()
+        self._readWarmupSettings()
 
         valid = self._validateConfig()
 
@@ -108,6 +123,33 @@ class Config():
 
         return
 
+    def _readMemorySettings(self):
+        """Read config values under 'memory'."""
+        conf = self._rawConf.get("memory", {})
+
+        self.memoryPath = conf.get("memoryPath", self.memoryPath)
+
+        return
+
+    def _readSearchSettings(self):
+        """Read config values under 'search'."""
+        conf = self._rawConf.get("search", {})
+
+        self.searchTimeout = conf.get("timeoutMS", self.searchTimeout)
+        self.searchGridLevel = conf.get("gridLevel", self.searchGridLevel)
+
+        return
+
+    def _readWarmupSettings(self):
+        """Read config values under 'warmup'."""
+        conf = self._rawConf.get("warmup", {})
+
+        self.warmupEnabled = conf.get("enabled", self.warmupEnabled)
+        self.warmupAlertDays = conf.get("alertDays", self.warmupAlertDays)
+        self.warmupMaps = conf.get("maps", self.warmupMaps)
+
+        return
+
     def _validateConfig(self):
         """Check config variable dependencies.
 
@@ -130,6 +172,39 @@ class Config():
                 self.sqlitePath = None
                 valid = False
 
+        if self.dbProvider == "memory":
+            if not self._checkFolderExists(self.memoryPath, "memoryPath"):
+                self.memoryPath = None
+                valid = False
+
+        if self.searchTimeout is not None:
+            if not (isinstance(self.searchTimeout, int) and self.searchTimeout > 0):
+                logger.error("Setting 'timeoutMS' must be an integer larger than 0 or null")
+                self.searchTimeout = None
+                valid = False
+
+        if self.searchGridLevel is not None:
+            if not (isinstance(self.searchGridLevel, int) and 1 <= self.searchGridLevel <= 12):
+                logger.error("Setting 'gridLevel' must be an integer from 1 to 12 or null")
+                self.searchGridLevel = None
+                valid = False
+
+        if not isinstance(self.warmupEnabled, bool):
+            logger.error("Setting 'enabled' under 'warmup' must be a boolean")
+            self.warmupEnabled = False
+            valid = False
+
+        if self.warmupAlertDays is not None:
+            if not (isinstance(self.warmupAlertDays, int) and self.warmupAlertDays >= 0):
+                logger.error("Setting 'alertDays' must be an integer of 0 or larger, or null")
+                self.warmupAlertDays = None
+                valid = False
+
+        if not isinstance(self.warmupMaps, bool):
+            logger.error("Setting 'maps' under 'warmup' must be a boolean")
+            self.warmupMaps = False
+            valid = False
+
         return valid
 
     def _checkFolderExists(self, path, name):
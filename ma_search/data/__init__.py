@@ -18,9 +18,10 @@ limitations under the License.
 """
 
 from ma_search.data.data import Data
-from ma_search.data.shape import Shape
+from ma_search.data.shape import SearchShape, Shape
 
 __all__ = [
     "Data",
+    "SearchShape",
     "Shape",
 ]
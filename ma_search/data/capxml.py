@@ -19,7 +19,7 @@ limitations under the License.
 
 from lxml import etree
 
-from ma_search.common import checkFloat
+from ma_search.common import checkFloat, checkInt
 
 
 class CapXML():
@@ -96,10 +96,40 @@ class CapXML():
         geocodes = []
         altitude = None
         ceiling = None
+        onset = None
+        expires = None
+        event = None
+        urgency = None
+        severity = None
+        certainty = None
+        awarenessLevel = None
 
         for infoElem in info:
             if self._localname(infoElem) == "language":
                 infoLang = infoElem.text
+            elif self._localname(infoElem) == "onset":
+                onset = infoElem.text
+            elif self._localname(infoElem) == "expires":
+                expires = infoElem.text
+            elif self._localname(infoElem) == "event":
+                event = infoElem.text
+            elif self._localname(infoElem) == "urgency":
+                urgency = infoElem.text
+            elif self._localname(infoElem) == "severity":
+                severity = infoElem.text
+            elif self._localname(infoElem) == "certainty":
+                certainty = infoElem.text
+            elif self._localname(infoElem) == "parameter":
+                valueName = ""
+                value = ""
+                for elem in infoElem:
+                    if self._localname(elem) == "valueName":
+                        valueName = elem.text
+                    elif self._localname(elem) == "value":
+                        value = elem.text or ""
+                if valueName == "awareness_level":
+                    # The value is formatted as "2; yellow; Moderate"
+                    awarenessLevel = checkInt(value.split(";")[0], None)
             elif self._localname(infoElem) == "area":
                 for areaElem in infoElem:
                     if self._localname(areaElem) == "areaDesc":
@@ -145,6 +175,13 @@ class CapXML():
         self._info["geocode"] = geocodes if geocodes else None
         self._info["altitude"] = altitude
         self._info["ceiling"] = ceiling
+        self._info["onset"] = onset
+        self._info["expires"] = expires
+        self._info["event"] = event
+        self._info["urgency"] = urgency
+        self._info["severity"] = severity
+        self._info["certainty"] = certainty
+        self._info["awarenessLevel"] = awarenessLevel
 
         return
 
@@ -17,17 +17,27 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
-import json
 import os
+import json
+import time
 import uuid
+import bisect
+import hashlib
 import logging
+import threading
 import ma_search
 
-from shapely.geometry import Polygon, MultiPolygon
+from collections import OrderedDict
+
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.geometry import Point, Polygon, MultiPolygon, box, mapping
 
-from ma_search.db import SQLiteDB
+from ma_search.db import MemoryDB, SQLiteDB
+from ma_search.db.dbsuper import ALERT_FILTERS
+from ma_search.metrics import METRICS
 from ma_search.data.capxml import CapXML
-from ma_search.data.shape import Shape
+from ma_search.data.shape import SearchShape, Shape
 from ma_search.common import (
     logException, parseDateString, preparePath, safeLoadJson, safeWriteJson, checkUUID
 )
@@ -35,6 +45,48 @@ from ma_search.common import (
 logger = logging.getLogger(__name__)
 
 UUID_NS = uuid.uuid5(uuid.NAMESPACE_URL, "metalert.met.no")
+SORT_KEYS = ("overlap", "sent")
+CUTOFF_KEYS = ("query", "record")
+MODE_KEYS = ("exact", "approx", "bbox")
+OVERLAP_FIELDS = ("overlap", "overlap_query", "overlap_record", "intersection")
+CAP_FIELDS = tuple(ALERT_FILTERS)
+RECORD_FIELDS = (
+    "uuid", "identifier", "source", "sent", "onset", "expires", "areaDesc", "polygon",
+    "circle", "geocode", "altitude", "ceiling", "area", "bounds", "valid",
+) + CAP_FIELDS + OVERLAP_FIELDS
+INDEX_FIELDS = (
+    "uuid", "identifier", "source", "sent", "altitude", "ceiling", "area", "bounds", "valid",
+) + CAP_FIELDS + OVERLAP_FIELDS
+
+POINT_FIELDS = tuple(field for field in RECORD_FIELDS if field not in OVERLAP_FIELDS)
+MAP_FIELDS = (
+    "uuid", "label", "source", "admName", "admID", "validFrom", "validTo", "area", "bounds",
+) + OVERLAP_FIELDS
+MAP_POINT_FIELDS = tuple(field for field in MAP_FIELDS if field not in OVERLAP_FIELDS)
+
+# Parsed map regions and normalised search polygons shared by all Data
+# instances and request threads, guarded by the lock
+REGION_CACHE_SIZE = 1024
+QUERY_CACHE_SIZE = 256
+_regionCache = OrderedDict()
+_queryCache = OrderedDict()
+_cacheLock = threading.Lock()
+
+# Alerts preloaded by Data.warmUp
+_alertCache = {}
+
+# Search polygons with fewer points than this are not simplified
+DEFAULT_PRECISION = 0.001
+SIMPLIFY_MIN_POINTS = 1000
+
+# Margin on the area of a bounds rectangle when used as an upper bound
+# of the overlap, as the straight edges of a projected polygon can reach
+# slightly outside the curved edges of the projected rectangle
+BOX_AREA_SLACK = 1.01
+
+# Alerts are looked up by grid cell instead of by bounds when the bounds
+# of the search polygon are this many times larger than its area
+CELL_SEARCH_RATIO = 4.0
 
 
 class Data():
@@ -46,6 +98,8 @@ class Data():
         self._db = None
         if self.conf.dbProvider == "sqlite":
             self._db = SQLiteDB()
+        elif self.conf.dbProvider == "memory":
+            self._db = MemoryDB()
 
         return
 
@@ -53,84 +107,566 @@ class Data():
     #  Methods
     ##
 
-    def findOverlap(self, target, shape, vertical=None, cutoff=0.01, maxres=1000):
-        """Parse a search dictionary and get values.
+    def findOverlap(
+        self, target, shape, vertical=None, cutoff=0.01, maxres=1000, sort="overlap",
+        fields=None, timeout=None, cutoffOn="query", mode="exact", period=None, filters=None,
+        text=None
+    ):
+        """Search the index for records overlapping a polygon and rank
+        them. See iterOverlap for a description of the parameters.
+
+        Returns
+        -------
+        dict or None
+            The search result, or None if the search could not be run.
         """
-        if self._db is None:
-            logger.error("No database specified or available")
+        status = {}
+        records = self.iterOverlap(
+            target, shape, vertical, cutoff, maxres, sort, fields, timeout, cutoffOn, mode,
+            period, filters, text, status=status
+        )
+        if records is None:
             return None
 
-        if not isinstance(shape, (Polygon, MultiPolygon)):
-            logger.error("Parameter 'shape' must be a shapely polygon")
+        with METRICS.timer("search"):
+            results = list(records)
+        result = {
+            "records": len(results),
+            "maxres": maxres,
+            "partial": status["partial"],
+            "estimate": mode != "exact",
+            "results": results,
+        }
+
+        return result
+
+    def iterOverlap(
+        self, target, shape, vertical=None, cutoff=0.01, maxres=1000, sort="overlap",
+        fields=None, timeout=None, cutoffOn="query", mode="exact", period=None, filters=None,
+        text=None, status=None
+    ):
+        """Search the index for records overlapping a polygon, and
+        return a generator yielding the matching records in ranked
+        order as soon as their position is known.
+
+        Parameters
+        ----------
+        target : str
+            The search target. Either "alert" or "map".
+        shape : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`, :obj:`SearchShape`
+            The polygon to search for.
+        vertical : tuple or None, optional
+            A (min, max) range to match against the altitude and ceiling
+            of the records.
+        cutoff : float, optional
+            The minimum relative overlap for a record to be included.
+        maxres : int, optional
+            The maximum number of records to return.
+        sort : str, optional
+            Either "overlap" to return the records with the largest
+            overlap, or "sent" to return the most recently sent records.
+        fields : list or None, optional
+            The keys to include in each record. If None, all keys are
+            included. If all the keys are available from the index, and
+            the overlap can be computed from the indexed bounds, the
+            record's meta data file is not loaded.
+        timeout : int or None, optional
+            The time budget for the search in milliseconds. When it has
+            been used up, the remaining candidates are skipped and the
+            results found so far are returned.
+        cutoffOn : str, optional
+            Either "query" to apply the cutoff to, and rank by, the
+            fraction of the search polygon covered by the record, or
+            "record" for the fraction of the record inside the search
+            polygon. Both are returned with each record, along with the
+            intersection area.
+        mode : str, optional
+            Either "exact" to compute the overlaps from the polygons,
+            "approx" to estimate them from the grid cell coverage stored
+            in the index, or "bbox" to estimate them from the bounds and
+            areas stored in the index. The estimates are computed without
+            loading any files, so only the index fields can be returned
+            for alerts, which is also the default. The "approx" mode
+            requires the gridLevel setting, and is only available for
+            alerts.
+        period : tuple or None, optional
+            A (start, end) range of datetime objects to match against the
+            onset and expires dates of alerts. Either may be None for an
+            open range.
+        filters : dict or None, optional
+            A dictionary of CAP fields and lists of accepted values, like
+            {"severity": ["Severe", "Extreme"]}. The accepted keys are
+            "event", "urgency", "severity", "certainty" and
+            "awarenessLevel". Only used for alerts.
+        text : str or None, optional
+            Words to look for in the area descriptions of alerts, like
+            "Sogn og Fjordane". An alert matches if its description in
+            any one language contains all the words, ignoring case and
+            diacritics. The match is made in the index, before any
+            candidates are loaded. Only used for alerts.
+        status : dict or None, optional
+            If provided, the key "partial" is set to True when the
+            generator is exhausted if the search ran out of time.
+
+        Returns
+        -------
+        generator or None
+            A generator of records, or None if the search could not be
+            run.
+        """
+        if mode != "exact" and fields is None and target == "alert":
+            fields = list(INDEX_FIELDS)
+
+        queries = self._searchShapes(
+            target, [shape], sort, fields, cutoffOn, mode, filters, text
+        )
+        if queries is None:
             return None
 
-        area = shape.area
-        west, south, east, north = shape.bounds
+        if status is None:
+            status = {}
+        status["partial"] = False
 
-        # First Pass: DB Lookup
-        # =====================
+        return self._overlapGenerator(
+            target, queries[0], vertical, cutoff, cutoffOn, mode, maxres, sort, fields,
+            self._deadline(timeout), status, period, filters, text
+        )
 
-        passTwo = {}
-        if target == "map":
-            pass
-            # passOne = self._db.searchBounds(target, west, south, east, north)
-            # for entry in passOne:
-            #     if len(entry) == 14:
-            #         recUUID = entry[1]
-            #         recArea = entry[13]
-            #         passTwo[recUUID] = recArea
+    def findOverlapBatch(
+        self, target, shapes, vertical=None, cutoff=0.01, maxres=1000, sort="overlap",
+        fields=None, timeout=None, cutoffOn="query", mode="exact", period=None, filters=None,
+        text=None
+    ):
+        """Search the index for records overlapping each of a set of
+        named polygons. The index is queried once for the envelope of
+        all the polygons, and each candidate record is loaded at most
+        once. See iterOverlap for a description of the parameters.
 
-        elif target == "alert":
-            passOne = self._db.searchBounds(target, west, south, east, north)
-            for entry in passOne:
-                if len(entry) == 13:
-                    recUUID = entry[1]
-                    recZMin = entry[10]
-                    recZMax = entry[11]
-                    recArea = entry[12]
-                    if vertical is None:
-                        passTwo[recUUID] = recArea
-                    else:
-                        if vertical[0] < recZMax and vertical[1] > recZMin:
-                            passTwo[recUUID] = recArea
+        Parameters
+        ----------
+        shapes : dict
+            A dictionary of names and search polygons.
 
-        # Second Pass: Polygon Overlap
-        # ============================
+        Returns
+        -------
+        dict or None
+            The search result with a result entry for each name, or None
+            if the search could not be run.
+        """
+        if not isinstance(shapes, dict):
+            logger.error("Parameter 'shapes' must be a dictionary")
+            return None
+
+        if mode != "exact" and fields is None and target == "alert":
+            fields = list(INDEX_FIELDS)
+
+        queries = self._searchShapes(
+            target, shapes.values(), sort, fields, cutoffOn, mode, filters, text
+        )
+        if queries is None:
+            return None
 
+        deadline = self._deadline(timeout)
+        status = {"partial": False}
         result = {
-            "records": 0,
             "maxres": maxres,
-            "results": [],
+            "partial": False,
+            "estimate": mode != "exact",
+            "results": {},
         }
+        if not shapes:
+            return result
 
-        if target == "map":
-            pass
+        allBounds = [query.bounds for query in queries]
+        west = min(bounds[0] for bounds in allBounds)
+        south = min(bounds[1] for bounds in allBounds)
+        east = max(bounds[2] for bounds in allBounds)
+        north = max(bounds[3] for bounds in allBounds)
 
+        rows = []
+        if target == "map":
+            rows = self._mapRows((west, south, east, north))
         elif target == "alert":
-            for recNum, (recUUID, recArea) in enumerate(passTwo.items()):
-                if recNum >= maxres:
-                    break
-                data = self._getFileData(target, recUUID)
-                logger.error(str(data))
-                recShape = Shape.polygonFromGeoJson(data.get("polygon", {}))
-                if recShape is not None:
-                    isectShape = shape.intersection(recShape)
-                    overlap = isectShape.area / area
-                    if overlap >= cutoff:
-                        data["overlap"] = overlap
-                        result["results"].append(data)
-
-            result["records"] = len(result["results"])
+            rows = self._alertRows(
+                (west, south, east, north), vertical, None, period, filters, text
+            )
+
+        cache = {}
+        for name, query in zip(shapes, queries):
+            if target == "map":
+                candidates = self._mapCandidates(query, rows, cutoff, cutoffOn, mode)
+            else:
+                candidates = self._alertCandidates(query, rows, cutoff, cutoffOn, mode)
+            records = list(self._rankCandidates(
+                target, query, candidates, cutoff, maxres, sort, fields,
+                deadline, status, cache
+            ))
+            result["results"][name] = {
+                "records": len(records),
+                "results": records,
+            }
+
+        result["partial"] = status["partial"]
 
         return result
 
+    def findPoints(self, target, points, vertical=None, fields=None):
+        """Search the index for records with a polygon containing each
+        of a list of points. Each point is looked up separately in the
+        index, but the candidate records are loaded and prepared only
+        once. No overlap areas are computed. Map regions are looked up
+        by the indexed bounds of their tiles.
+
+        Parameters
+        ----------
+        target : str
+            The search target. Either "alert" or "map".
+        points : list
+            A list of (longitude, latitude) tuples.
+        vertical : tuple or None, optional
+            A (min, max) range to match against the altitude and ceiling
+            of the alerts. Not used for map regions.
+        fields : list or None, optional
+            The keys to include in each record. If None, all keys are
+            included.
+
+        Returns
+        -------
+        list or None
+            A list with the search result for each point, with the most
+            recently sent alerts or most recently valid map regions
+            first, or None if the search could not be run.
+        """
+        if self._db is None:
+            logger.error("No database specified or available")
+            return None
+
+        if target not in ("alert", "map"):
+            logger.error("Unknown search target '%s'", str(target))
+            return None
+
+        known = MAP_POINT_FIELDS if target == "map" else POINT_FIELDS
+        if fields is not None and not set(fields).issubset(known):
+            logger.error("Unknown fields requested: %s", str(fields))
+            return None
+
+        try:
+            points = [Point(float(lon), float(lat)) for lon, lat in points]
+        except Exception:
+            logger.error("Parameter 'points' must be a list of (longitude, latitude) pairs")
+            return None
+
+        cache = {}
+        results = []
+        for point in points:
+            records = []
+            if target == "alert":
+                rows = self._alertRows(point.bounds, vertical, inclusive=True)
+                rows.sort(key=self._sentTime, reverse=True)
+                for row in rows:
+                    record = self._alertContains(target, point, row, fields, cache)
+                    if record is not None:
+                        records.append(record)
+            else:
+                entries = self._db.searchTiles(*point.bounds, inclusive=True)
+                tiles = {entry[0] for entry in entries or []}
+                rows = [
+                    row for row in self._mapRows(point.bounds, inclusive=True)
+                    if row["uuid"] in tiles
+                ]
+                rows.sort(key=self._validTime, reverse=True)
+                for row in rows:
+                    record = self._mapContains(point, row, fields)
+                    if record is not None:
+                        records.append(record)
+            results.append({
+                "records": len(records),
+                "results": records,
+            })
+
+        return results
+
+    def findGeocodes(
+        self, target, geocodes, vertical=None, maxres=1000, fields=None, period=None,
+        filters=None, text=None
+    ):
+        """Search the index for alerts with any of a set of geocodes,
+        like municipality numbers. The alerts are looked up in the index
+        only, and no polygons are loaded or compared. The meta data
+        files are only loaded if fields outside the index are requested.
+
+        Parameters
+        ----------
+        target : str
+            The search target. Only "alert" is supported.
+        geocodes : dict
+            A dictionary of geocode value names, and a value or a list of
+            values for each, like {"kommune": ["0301", "3005"]}.
+        vertical, period, filters, text
+            As for iterOverlap.
+        maxres : int, optional
+            The maximum number of records to return.
+        fields : list or None, optional
+            The keys to include in each record. If None, all keys are
+            included.
+
+        Returns
+        -------
+        dict or None
+            The search result with the most recently sent records first,
+            or None if the search could not be run.
+        """
+        if self._db is None:
+            logger.error("No database specified or available")
+            return None
+
+        if target != "alert":
+            logger.error("Geocode searches are only available for alerts")
+            return None
+
+        if fields is not None and not set(fields).issubset(POINT_FIELDS):
+            logger.error("Unknown fields requested: %s", str(fields))
+            return None
+
+        unknown = set(filters or {}) - set(ALERT_FILTERS)
+        if unknown:
+            logger.error("Unknown alert filters: %s", str(sorted(unknown)))
+            return None
+
+        if not (text is None or isinstance(text, str)):
+            logger.error("Parameter 'text' must be a string")
+            return None
+
+        pairs = []
+        try:
+            for valueName, values in geocodes.items():
+                values = values if isinstance(values, list) else [values]
+                pairs.extend((str(valueName), str(value)) for value in values)
+        except Exception:
+            logger.error("Parameter 'geocodes' must be a dictionary of values by value name")
+            return None
+
+        rows = []
+        for entry in self._db.searchGeocodes(
+            pairs, vertical=vertical, period=period, filters=filters, text=text
+        ) or []:
+            if len(entry) == 21:
+                rows.append(self._alertIndexRow(entry))
+        rows.sort(key=self._sentTime, reverse=True)
+
+        needFile = fields is None or not set(fields).issubset(INDEX_FIELDS)
+        cache = {}
+        records = []
+        for row in rows[:maxres]:
+            data = None
+            if needFile:
+                data = self._loadAlert(target, row["uuid"], cache)["data"]
+                if not data:
+                    continue
+            records.append(self._alertRecord(row, data, fields))
+
+        return {
+            "records": len(records),
+            "maxres": maxres,
+            "results": records,
+        }
+
+    def warmUp(self, alertDays=None, loadMaps=False):
+        """Read the index, and load the recent alerts and the map
+        regions into the process-wide caches, so that the first searches
+        don't have to.
+
+        Parameters
+        ----------
+        alertDays : int or None, optional
+            Alerts sent within this many days are loaded, and their
+            polygons parsed and prepared. If None, no alerts are loaded.
+        loadMaps : bool, optional
+            Whether to load all the map regions.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False.
+        """
+        if self._db is None:
+            logger.error("No database specified or available")
+            return False
+
+        with METRICS.timer("warmup"):
+            entries = self._db.searchBounds("alert", -180.0, -90.0, 180.0, 90.0)
+            if entries is None:
+                logger.error("Could not read the alert index")
+                return False
+            rows = [self._alertIndexRow(entry) for entry in entries if len(entry) == 21]
+            logger.info("Read %d alerts from the index", len(rows))
+
+            _alertCache.clear()
+            if alertDays is not None:
+                since = time.time() - alertDays*86400
+                count = 0
+                for row in rows:
+                    if self._sentTime(row) < since:
+                        continue
+                    mtime = self._fileTime("alert", row["uuid"])
+                    data = self._getFileData("alert", row["uuid"])
+                    if mtime is None or not data:
+                        continue
+                    shape = Shape.polygonFromGeoJson(data.get("polygon", {}))
+                    loaded = {
+                        "data": data,
+                        "mtime": mtime,
+                        "shape": shape,
+                        "prepared": prep(shape) if shape is not None else None,
+                    }
+                    self._alertProjected(loaded)
+                    _alertCache[row["uuid"]] = loaded
+                    count += 1
+                logger.info("Loaded %d alerts from the last %d days", count, alertDays)
+
+            if loadMaps:
+                entries = self._db.searchBounds("map", -180.0, -90.0, 180.0, 90.0)
+                if entries is None:
+                    logger.error("Could not read the map index")
+                    return False
+                count = 0
+                for entry in entries:
+                    if self.getRegion(entry[1]) is not None:
+                        count += 1
+                logger.info("Loaded %d map regions", count)
+
+        return True
+
+    def normaliseQuery(self, geoJson, precision=DEFAULT_PRECISION):
+        """Parse a search polygon from a geoJson dict, repair it if it
+        is invalid, and simplify it if it has many points. The result
+        is kept in a process-wide cache keyed on a hash of the content,
+        so repeated searches for the same polygon skip this step.
+
+        Parameters
+        ----------
+        geoJson : dict
+            A geoJson feature, or only its geometry, holding a Polygon
+            or a MultiPolygon.
+        precision : float, optional
+            The relative precision of the polygon area. The tolerance of
+            the simplification is derived from it and the polygon size.
+
+        Returns
+        -------
+        tuple
+            The :obj:`SearchShape`, or None if the polygon is not valid,
+            and the applied simplification tolerance.
+        """
+        if not isinstance(geoJson, dict):
+            logger.error("Parameter 'geoJson' must be a dictionary")
+            return None, 0.0
+
+        try:
+            content = json.dumps(geoJson, sort_keys=True)
+        except Exception:
+            logger.error("Could not serialise geoJson")
+            return None, 0.0
+
+        key = hashlib.sha256(f"{precision!r}:{content}".encode("utf-8")).hexdigest()
+        with _cacheLock:
+            cached = _queryCache.get(key, None)
+            if cached is not None:
+                _queryCache.move_to_end(key)
+                return cached
+
+        with METRICS.timer("normalise"):
+            polygon = Shape.polygonFromGeoJson(geoJson)
+            if polygon is None:
+                return None, 0.0
+            polygon, tolerance = Shape.normalisePolygon(
+                polygon, precision, SIMPLIFY_MIN_POINTS
+            )
+        if polygon is None or polygon.area <= 0.0:
+            logger.error("The search polygon has no area")
+            return None, 0.0
+
+        cached = (SearchShape(polygon), tolerance)
+        with _cacheLock:
+            _queryCache[key] = cached
+            while len(_queryCache) > QUERY_CACHE_SIZE:
+                _queryCache.popitem(last=False)
+
+        return cached
+
+    def hasGridCells(self):
+        """Check if the alerts in the index all have grid cells at the
+        gridLevel setting. The index must be rebuilt after the setting
+        is changed, and until then the cells are not used.
+
+        Returns
+        -------
+        bool
+            True if the grid cells can be used, otherwise False.
+        """
+        if self._db is None or self.conf.searchGridLevel is None:
+            return False
+        return self._db.cellLevel() == self.conf.searchGridLevel
+
+    def getRegion(self, region):
+        """Look up a stored map region by its UUID or its administrative
+        ID. The parsed polygon is kept in a process-wide cache, together
+        with its prepared form and area.
+
+        Parameters
+        ----------
+        region : str
+            The UUID or administrative ID of the map region.
+
+        Returns
+        -------
+        :obj:`SearchShape` or None
+            The region polygon, or None if it could not be found.
+        """
+        if not (isinstance(region, str) and region):
+            logger.error("Parameter 'region' must be a non-empty string")
+            return None
+
+        try:
+            rUUID = str(uuid.UUID(region))
+        except ValueError:
+            if self._db is None:
+                logger.error("No database specified or available")
+                return None
+            rUUID = self._db.findMapUUID(region)
+            if rUUID is None:
+                logger.error("No map region with ID '%s'", region)
+                return None
+
+        with _cacheLock:
+            query = _regionCache.get(rUUID, None)
+            if query is not None:
+                _regionCache.move_to_end(rUUID)
+                return query
+
+        mapShape = Shape(rUUID)
+        polygon = mapShape.polygon()
+        projected = mapShape.projected() if polygon is not None else None
+        if polygon is None or projected is None:
+            logger.error("Could not load map region '%s'", rUUID)
+            return None
+
+        query = SearchShape(polygon, projected)
+        with _cacheLock:
+            _regionCache[rUUID] = query
+            while len(_regionCache) > REGION_CACHE_SIZE:
+                _regionCache.popitem(last=False)
+
+        return query
+
     ##
     #  Alert (CAP) File Methods
     ##
 
     def ingestAlertFile(self, path, doReplace=False):
         """Ingest a CAP file, generate the meta data JSON file and
-        add it to the index database.
+        add it to the index database. Call flushIndex when done
+        ingesting files.
         """
         try:
             capData = CapXML(path)
@@ -147,14 +683,41 @@ class Data():
             return False
 
         geoJson = capData.asGeoJson()
-        if geoJson is None:
+        circles = capData["circle"] or []
+        if geoJson is None and not circles:
             logger.error("CAP file has no polygon: %s", str(path))
             return False
 
-        shape = Shape.polygonFromGeoJson(geoJson)
-        if shape is None:
-            logger.error("Could not parse polygon: %s", str(path))
-            return False
+        shape = Polygon()
+        valid = True
+        if geoJson is not None:
+            shape = Shape.polygonFromGeoJson(geoJson)
+            if shape is None:
+                logger.error("Could not parse polygon: %s", str(path))
+                return False
+
+            # Self-intersecting polygons are stored repaired, so that the
+            # searches never have to intersect an invalid polygon
+            valid = shape.is_valid
+            if not valid:
+                logger.warning("Repairing invalid polygon: %s", str(path))
+                shape = Shape.repairPolygon(shape)
+                if shape is None:
+                    logger.error("Could not repair polygon: %s", str(path))
+                    return False
+                geoJson = Shape.geoJsonFromPolygon(shape)
+
+        # Circles are stored as polygons, so that they are searched like
+        # any other alert, and are indexed by their exact bounds
+        bounds = [shape.bounds] if not shape.is_empty else []
+        if circles:
+            circleShapes = [Shape.circlePolygon(*circle) for circle in circles]
+            if any(circle is None for circle in circleShapes):
+                logger.error("Could not parse circle: %s", str(path))
+                return False
+            shape = unary_union([shape, *circleShapes])
+            geoJson = Shape.geoJsonFromPolygon(shape)
+            bounds.extend(Shape.circleBounds(*circle) for circle in circles)
 
         # Save Meta Data
         fUUID = str(uuid.uuid5(UUID_NS, identifier))
@@ -174,16 +737,33 @@ class Data():
             )
             return False
 
-        area = shape.area
-        west, south, east, north = shape.bounds
+        # Areas are computed in equal-area coordinates, so that they are
+        # comparable at all latitudes
+        projected = Shape.projectPolygon(shape)
+        area = projected.area
+        west = max(min(b[0] for b in bounds), -180.0)
+        south = max(min(b[1] for b in bounds), -90.0)
+        east = min(max(b[2] for b in bounds), 180.0)
+        north = min(max(b[3] for b in bounds), 90.0)
         jData = {
             "identifier": identifier,
             "source": path,
             "sent": capData["sent"],
+            "onset": capData["onset"],
+            "expires": capData["expires"],
             "areaDesc": capData["areaDesc"],
             "polygon": geoJson["geometry"],
+            "circle": circles or None,
+            "projected": mapping(projected),
+            "valid": valid,
             "altitude": capData["altitude"],
             "ceiling": capData["ceiling"],
+            "event": capData["event"],
+            "urgency": capData["urgency"],
+            "severity": capData["severity"],
+            "certainty": capData["certainty"],
+            "awarenessLevel": capData["awarenessLevel"],
+            "geocode": capData["geocode"],
             "area": area,
             "bounds": {
                 "west": west,
@@ -221,6 +801,38 @@ class Data():
             with open(path, mode="r") as inFile:
                 data = json.load(inFile)
 
+        # Index each part of a MultiPolygon separately. Files written
+        # before the equal-area polygon was stored have their area in
+        # square degrees, so it is recomputed.
+        parts = None
+        cells = None
+        area = data.get("area", 0.0)
+        valid = data.get("valid", True)
+        if "polygon" in data:
+            shape = Shape.polygonFromGeoJson(data["polygon"])
+            if shape is not None:
+                parts = Shape.partBounds(shape)
+                if "valid" not in data:
+                    valid = shape.is_valid
+                repaired = Shape.repairPolygon(shape) or shape
+                if "projected" not in data:
+                    area = Shape.projectPolygon(repaired).area
+                if self.conf.searchGridLevel is not None:
+                    cells = Shape.gridCoverage(repaired, self.conf.searchGridLevel)
+
+        # Circles are also indexed by their exact bounds, which the
+        # polygons approximating them may not quite reach
+        circles = data.get("circle", None) or []
+        if parts is not None and circles:
+            parts += [Shape.circleBounds(*circle) for circle in circles]
+
+        # Alerts without an altitude start at the surface, and alerts
+        # without a ceiling are at a single altitude
+        altitude = data.get("altitude", None)
+        altitude = 0.0 if altitude is None else altitude
+        ceiling = data.get("ceiling", None)
+        ceiling = altitude if ceiling is None else ceiling
+
         bounds = data.get("bounds", {})
         dbStat = self._db.editAlertRecord(
             cmd="replace" if doReplace else "insert",
@@ -233,14 +845,30 @@ class Data():
             south=bounds.get("south", 0.0),
             east=bounds.get("east", 0.0),
             north=bounds.get("north", 0.0),
-            altitude=data.get("altitude", 0.0),
-            ceiling=data.get("ceiling", 0.0),
-            area=data.get("area", 0.0)
+            altitude=altitude,
+            ceiling=ceiling,
+            area=area,
+            parts=parts,
+            valid=valid,
+            cells=cells,
+            onsetDate=parseDateString(data.get("onset", None)),
+            expiresDate=parseDateString(data.get("expires", None)),
+            meta={key: data.get(key, None) for key in ALERT_FILTERS},
+            geocodes=[tuple(pair) for pair in data.get("geocode", None) or []],
+            areaDesc=data.get("areaDesc", None),
         )
         if dbStat:
             logger.info("Indexed file: %s", path)
         else:
             logger.error("Failed to index file: %s", path)
+            return dbStat
+
+        # An alert indexed at another grid level leaves the cells of the
+        # index incomplete, so they are not used until it is rebuilt
+        level = self._db.cellLevel()
+        if level is not None and level != self.conf.searchGridLevel:
+            logger.warning("The 'gridLevel' setting has changed, and the index must be rebuilt")
+            dbStat = self._db.setCellLevel(None)
 
         return dbStat
 
@@ -273,19 +901,823 @@ class Data():
                         continue
                     self.indexAlertMetaFile(jsonPath)
 
-        return True
+        return self.flushIndex()
+
+    def flushIndex(self):
+        """Write any pending changes to the index database. This must be
+        called when done ingesting files, as the memory provider only
+        writes its snapshot on request.
+        """
+        if self._db is None:
+            logger.error("No database specified or available")
+            return False
+
+        return self._db.flush()
+
+    ##
+    #  Map Region Methods
+    ##
+
+    def ingestMapRegion(
+        self, geoJson, label, source, validFrom=None, validTo=None, meta=None
+    ):
+        """Store a map region polygon, and add it to the index together
+        with the bounds and areas of its tiles. Call flushIndex when
+        done ingesting map regions.
+
+        Parameters
+        ----------
+        geoJson : dict or str
+            A GeoJson feature or geometry, or the path to a file with
+            one, as accepted by Shape.fromGeoJSON.
+        label, source : str
+            The label and source description of the map region.
+        validFrom, validTo : datetime or None, optional
+            The validity range of the map region.
+        meta : dict or None, optional
+            The "admName" and "admID" of the map region.
+
+        Returns
+        -------
+        str or None
+            The UUID of the new map region, or None if it could not be
+            stored.
+        """
+        if self._db is None:
+            logger.error("No database specified or available")
+            return None
+
+        mapShape = Shape.fromGeoJSON(geoJson)
+        if mapShape is None:
+            logger.error("Could not store map region polygon")
+            return None
+
+        if not self._indexMapRegion(
+            "insert", mapShape, label, source, "WGS84", validFrom, validTo, meta
+        ):
+            return None
+
+        return mapShape._uuid
+
+    def rebuildMapTiles(self):
+        """Index the tiles of all the map regions in the index again,
+        so that regions indexed before they were split into tiles are
+        searched tile by tile.
+        """
+        if self._db is None:
+            logger.error("No database specified or available")
+            return False
+
+        entries = self._db.searchBounds("map", -180.0, -90.0, 180.0, 90.0)
+        if entries is None:
+            logger.error("Could not read the map index")
+            return False
+
+        status = True
+        for entry in entries:
+            if len(entry) != 14:
+                continue
+            rUUID, label, source, admName, admID, validFrom, validTo, coordSystem = entry[1:9]
+            status &= self._indexMapRegion(
+                "update", Shape(rUUID), label, source, coordSystem,
+                parseDateString(validFrom), parseDateString(validTo),
+                {"admName": admName, "admID": admID},
+            )
+
+        return self.flushIndex() and status
 
     ##
     #  Internal Functions
     ##
 
+    def _indexMapRegion(
+        self, cmd, mapShape, label, source, coordSystem, validFrom, validTo, meta
+    ):
+        """Add a stored map region to the index, or update it, with the
+        bounds and areas of its tiles.
+        """
+        polygon = mapShape.polygon()
+        projected = mapShape.projected() if polygon is not None else None
+        tiles = mapShape.tiles() if projected is not None else None
+        if tiles is None:
+            logger.error("Could not load map region '%s'", mapShape._uuid)
+            return False
+
+        dbStat = self._db.editMapRecord(
+            cmd=cmd,
+            recordUUID=mapShape._uuid,
+            label=label,
+            source=source,
+            coordSystem=coordSystem,
+            west=polygon.bounds[0],
+            south=polygon.bounds[1],
+            east=polygon.bounds[2],
+            north=polygon.bounds[3],
+            area=projected.area,
+            validFrom=validFrom,
+            validTo=validTo,
+            meta=meta,
+            tiles=[(*tile["bounds"], tile["area"]) for tile in tiles],
+        )
+        if dbStat:
+            logger.info("Indexed map region: %s", mapShape._uuid)
+        else:
+            logger.error("Failed to index map region: %s", mapShape._uuid)
+
+        return dbStat
+
+    def _searchShapes(
+        self, target, shapes, sort, fields, cutoffOn, mode, filters=None, text=None
+    ):
+        """Check the parameters shared by all overlap searches, and
+        wrap the search polygons as SearchShape objects.
+
+        Returns
+        -------
+        list or None
+            A list of SearchShape objects, or None if the search can't
+            be run.
+        """
+        if self._db is None:
+            logger.error("No database specified or available")
+            return None
+
+        if sort not in SORT_KEYS:
+            logger.error("Unknown sort key '%s'", str(sort))
+            return None
+
+        known = MAP_FIELDS if target == "map" else RECORD_FIELDS
+        if fields is not None and not set(fields).issubset(known):
+            logger.error("Unknown fields requested: %s", str(fields))
+            return None
+
+        if cutoffOn not in CUTOFF_KEYS:
+            logger.error("Unknown cutoff ratio '%s'", str(cutoffOn))
+            return None
+
+        if mode not in MODE_KEYS:
+            logger.error("Unknown search mode '%s'", str(mode))
+            return None
+
+        unknown = set(filters or {}) - set(ALERT_FILTERS)
+        if unknown:
+            logger.error("Unknown alert filters: %s", str(sorted(unknown)))
+            return None
+
+        if not (text is None or isinstance(text, str)):
+            logger.error("Parameter 'text' must be a string")
+            return None
+
+        if mode == "approx":
+            if target == "map":
+                logger.error("Approximate searches are only available for alerts")
+                return None
+            if self.conf.searchGridLevel is None:
+                logger.error("Approximate searches require the 'gridLevel' setting")
+                return None
+            if not self.hasGridCells():
+                logger.error("The index has no grid cells at the 'gridLevel' setting")
+                return None
+
+        if mode != "exact" and target == "alert" and not set(fields).issubset(INDEX_FIELDS):
+            logger.error("Estimated searches can only return the index fields")
+            return None
+
+        queries = []
+        for shape in shapes:
+            if isinstance(shape, (Polygon, MultiPolygon)):
+                shape = SearchShape(shape)
+            elif not isinstance(shape, SearchShape):
+                logger.error("Parameter 'shape' must be a shapely polygon")
+                return None
+            if shape.area <= 0.0:
+                logger.error("Parameter 'shape' must have a non-zero area")
+                return None
+            queries.append(shape)
+
+        return queries
+
+    def _overlapGenerator(
+        self, target, query, vertical, cutoff, cutoffOn, mode, maxres, sort, fields,
+        deadline, status, period=None, filters=None, text=None
+    ):
+        """Generator for iterOverlap. The parameters must be checked by
+        the caller.
+        """
+        # First Pass: DB Lookup
+        # =====================
+
+        candidates = []
+        if target == "map":
+            rows = self._mapRows(query.bounds)
+            candidates = self._mapCandidates(query, rows, cutoff, cutoffOn, mode)
+
+        elif target == "alert":
+            cells = self._searchCells(query) if mode != "bbox" else None
+            rows = self._alertRows(query.bounds, vertical, cells, period, filters, text)
+            candidates = self._alertCandidates(query, rows, cutoff, cutoffOn, mode)
+
+        # Second Pass: Polygon Overlap
+        # ============================
+
+        yield from self._rankCandidates(
+            target, query, candidates, cutoff, maxres, sort, fields, deadline, status
+        )
+
+        return
+
+    def _rankCandidates(
+        self, target, query, candidates, cutoff, maxres, sort, fields, deadline, status,
+        cache=None
+    ):
+        """Compute the overlap of the candidates with the search polygon
+        and yield the records in ranked order. If the deadline passes,
+        the remaining candidates are skipped, the pending results are
+        yielded as they are, and the status is flagged as partial.
+        """
+        overlapFunc = self._mapOverlap if target == "map" else self._alertOverlap
+        evaluated = 0
+        matched = 0
+        try:
+            if sort == "overlap":
+                # Check candidates in order of decreasing upper bound. A result
+                # that is at least as good as the upper bound of the next
+                # candidate can't be beaten by any of the remaining ones, so
+                # it is yielded right away. The pending results are kept in
+                # a sorted list bounded to the number of remaining slots, and
+                # when the next upper bound can't beat the worst of a full
+                # list, none of the remaining candidates can either.
+                candidates = sorted(candidates, key=lambda cand: cand["upper"], reverse=True)
+                slots = maxres
+                ready = []
+                for recNum, cand in enumerate(candidates):
+                    while ready and ready[-1][0] >= cand["upper"]:
+                        matched += 1
+                        yield ready.pop()[2]
+                        slots -= 1
+                        if slots <= 0:
+                            return
+                    if len(ready) >= slots and cand["upper"] <= ready[0][0]:
+                        break
+                    if self._pastDeadline(deadline, status):
+                        break
+                    evaluated += 1
+                    match = overlapFunc(target, query, cand, cutoff, fields, cache)
+                    if match is None:
+                        continue
+                    bisect.insort(ready, (match[0], -recNum, match[1]))
+                    if len(ready) > slots:
+                        del ready[0]
+
+                while ready:
+                    matched += 1
+                    yield ready.pop()[2]
+
+            elif sort == "sent":
+                candidates = sorted(candidates, key=lambda cand: cand["sent"], reverse=True)
+                count = 0
+                for cand in candidates:
+                    if count >= maxres:
+                        break
+                    if self._pastDeadline(deadline, status):
+                        break
+                    evaluated += 1
+                    match = overlapFunc(target, query, cand, cutoff, fields, cache)
+                    if match is not None:
+                        count += 1
+                        matched += 1
+                        yield match[1]
+
+        finally:
+            METRICS.count("pruned", len(candidates) - evaluated)
+            METRICS.count("matched", matched)
+
+        return
+
+    def _searchCells(self, query):
+        """Return the grid cells covered by a search polygon if the
+        alerts should be looked up by cell, otherwise None. The cells
+        are only used if the grid is enabled and the polygon fills a
+        small part of its bounds, like long diagonal ones, where they
+        give far fewer candidates than the bounds. The bounds are also
+        used if the index wasn't built with cells at the grid level.
+        """
+        level = self.conf.searchGridLevel
+        if level is None or query.area <= 0.0:
+            return None
+        if Shape.boxArea(*query.bounds) < CELL_SEARCH_RATIO*query.area:
+            return None
+        if not self.hasGridCells():
+            return None
+        return sorted(query.cellWeights(level))
+
+    def _alertRows(
+        self, bounds, vertical, cells=None, period=None, filters=None, text=None, inclusive=False
+    ):
+        """Look up the alerts whose bounds overlap a rectangle and match
+        the vertical range, period, filters and text, and return their
+        index values. If a list of grid cells is given, the alerts
+        covering any of the cells are looked up instead. If inclusive,
+        bounds that only touch the rectangle also match.
+        """
+        rows = []
+        if cells is None:
+            passOne = self._db.searchBounds(
+                "alert", *bounds, vertical=vertical, period=period, filters=filters, text=text,
+                inclusive=inclusive
+            )
+        else:
+            passOne = self._db.searchCells(
+                cells, vertical=vertical, period=period, filters=filters, text=text
+            )
+        for entry in passOne or []:
+            if len(entry) != 21:
+                continue
+            rows.append(self._alertIndexRow(entry))
+
+        return rows
+
+    def _alertIndexRow(self, entry):
+        """Convert an AlertData entry from the index to a dictionary."""
+        recWest, recSouth, recEast, recNorth = entry[6:10]
+        return {
+            "uuid": entry[1],
+            "identifier": entry[2],
+            "source": entry[4],
+            "sent": entry[3],
+            "altitude": entry[10],
+            "ceiling": entry[11],
+            "area": entry[12],
+            "valid": bool(entry[13]),
+            "bounds": {
+                "west": recWest,
+                "east": recEast,
+                "north": recNorth,
+                "south": recSouth,
+            },
+            **dict(zip(CAP_FIELDS, entry[16:21])),
+        }
+
+    def _alertCandidates(self, query, rows, cutoff, cutoffOn="query", mode="exact"):
+        """Compute an upper bound of the relative overlap of each alert
+        from the intersection of the bounds and the area of the alert.
+        Alerts that cannot reach the cutoff are dropped. The overlap is
+        relative to the area of the search polygon or the alert,
+        depending on cutoffOn.
+
+        If the search polygon covers the bounds of an alert, the alert
+        lies entirely within it, and the intersection area is known
+        exactly from the indexed area. In "approx" mode, the
+        intersection area of every alert is estimated from the grid
+        cells instead, and in "bbox" mode from the intersection of the
+        bounds, so no alert needs to be loaded.
+        """
+        area = query.area
+        west, south, east, north = query.bounds
+
+        estimates = None
+        if mode == "approx":
+            weights = query.cellWeights(self.conf.searchGridLevel)
+            estimates = dict(self._db.overlapCells(weights) or [])
+
+        with METRICS.timer("candidates"):
+            candidates = []
+            for row in rows:
+                recArea = row["area"]
+                recBounds = row["bounds"]
+                if recArea <= 0.0:
+                    continue
+                if estimates is not None:
+                    isect = min(estimates.get(row["uuid"], 0.0), recArea, area)
+                    relArea = area if cutoffOn == "query" else recArea
+                    if isect <= 0.0 or isect / relArea < cutoff:
+                        continue
+                    candidates.append({
+                        "uuid": row["uuid"],
+                        "sent": self._sentTime(row),
+                        "upper": isect / relArea,
+                        "isect": isect,
+                        "relArea": relArea,
+                        "index": row,
+                    })
+                    continue
+                boxWest = max(west, recBounds["west"])
+                boxEast = min(east, recBounds["east"])
+                boxSouth = max(south, recBounds["south"])
+                boxNorth = min(north, recBounds["north"])
+                if boxEast <= boxWest or boxNorth <= boxSouth:
+                    continue
+                boxArea = Shape.boxArea(boxWest, boxSouth, boxEast, boxNorth)
+                relArea = area if cutoffOn == "query" else recArea
+                if mode == "bbox":
+                    isect = min(boxArea, recArea, area)
+                    if isect / relArea < cutoff:
+                        continue
+                    candidates.append({
+                        "uuid": row["uuid"],
+                        "sent": self._sentTime(row),
+                        "upper": isect / relArea,
+                        "isect": isect,
+                        "relArea": relArea,
+                        "index": row,
+                    })
+                    continue
+
+                upper = min(BOX_AREA_SLACK*boxArea, recArea, area) / relArea
+                if upper < cutoff:
+                    continue
+
+                isect = None
+                if query.prepared.covers(box(
+                    recBounds["west"], recBounds["south"], recBounds["east"], recBounds["north"]
+                )):
+                    isect = recArea
+                    upper = isect / relArea
+                    if upper < cutoff:
+                        continue
+
+                candidates.append({
+                    "uuid": row["uuid"],
+                    "sent": self._sentTime(row),
+                    "upper": upper,
+                    "isect": isect,
+                    "relArea": relArea,
+                    "index": row,
+                })
+
+        METRICS.count("candidates", len(rows))
+        METRICS.count("pruned", len(rows) - len(candidates))
+
+        return candidates
+
+    def _alertOverlap(self, target, query, cand, cutoff, fields, cache=None):
+        """Compute the relative overlap of a candidate alert with the
+        search polygon, and build its record. The meta data file is
+        only loaded if the intersection or any of the requested fields
+        can't be taken from the index. Returns a tuple of the overlap
+        the cutoff applies to and the record, or None if the overlap is
+        below the cutoff.
+
+        If a cache dictionary is provided, loaded files and parsed
+        polygons are stored in it so that they can be reused.
+        """
+        if cache is None:
+            cache = {}
+
+        loaded = cache.get(cand["uuid"], None)
+        needFile = fields is None or not set(fields).issubset(INDEX_FIELDS)
+        if (needFile or cand["isect"] is None) and loaded is None:
+            loaded = self._loadAlert(target, cand["uuid"], cache)
+
+        data = loaded["data"] if loaded else None
+        if loaded is not None and not data:
+            return None
+
+        isect = cand["isect"]
+        if isect is None and self._insideCircles(query, data):
+            isect = query.area
+        if isect is None:
+            recProjected = self._alertProjected(loaded)
+            if recProjected is None:
+                return None
+            try:
+                with METRICS.timer("intersection"):
+                    isect = query.projected.intersection(recProjected).area
+            except Exception:
+                logger.error("Could not intersect with alert '%s'", cand["uuid"])
+                logException()
+                return None
+
+        overlap = isect / cand["relArea"]
+        if overlap < cutoff:
+            return None
+
+        overlapQuery = isect / query.area
+        record = self._alertRecord(
+            cand["index"], data, fields, overlap=overlapQuery, overlap_query=overlapQuery,
+            overlap_record=isect / cand["index"]["area"], intersection=isect
+        )
+
+        return overlap, record
+
+    def _alertContains(self, target, point, row, fields, cache):
+        """Check if the polygon of an alert covers a point, including
+        its edge, and build its record. Returns None if it doesn't. The loaded files and
+        prepared polygons are stored in the cache dictionary.
+        """
+        loaded = cache.get(row["uuid"], None)
+        if loaded is None:
+            loaded = self._loadAlert(target, row["uuid"], cache)
+
+        data = loaded["data"]
+        if not data:
+            return None
+
+        if "prepared" not in loaded:
+            if "shape" not in loaded:
+                with METRICS.timer("parse"):
+                    loaded["shape"] = Shape.polygonFromGeoJson(data.get("polygon", {}))
+            recShape = loaded["shape"]
+            loaded["prepared"] = prep(recShape) if recShape is not None else None
+
+        # Points inside a circle are found by distance, without the
+        # polygon approximating it
+        for lat, lon, radius in data.get("circle", None) or []:
+            if Shape.circleDistance(lat, lon, point.x, point.y) <= radius:
+                return self._alertRecord(row, data, fields)
+
+        prepared = loaded["prepared"]
+        if prepared is None or not prepared.covers(point):
+            return None
+
+        return self._alertRecord(row, data, fields)
+
+    def _insideCircles(self, query, data):
+        """Check if a search polygon lies within one of the circles of
+        an alert, in which case the whole search polygon overlaps it.
+        """
+        if not data:
+            return False
+        for lat, lon, radius in data.get("circle", None) or []:
+            if query.insideCircle(lat, lon, radius):
+                return True
+        return False
+
+    def _alertProjected(self, loaded):
+        """Return the equal-area polygon of a loaded alert. It is read
+        from the meta data, or projected from the polygon for files
+        written before it was stored there.
+        """
+        if "projected" not in loaded:
+            data = loaded["data"]
+            with METRICS.timer("parse"):
+                if "projected" in data:
+                    projected = Shape.polygonFromGeoJson(data["projected"])
+                else:
+                    if "shape" not in loaded:
+                        loaded["shape"] = Shape.polygonFromGeoJson(data.get("polygon", {}))
+                    recShape = loaded["shape"]
+                    if recShape is not None:
+                        recShape = Shape.repairPolygon(recShape)
+                    projected = Shape.projectPolygon(recShape) if recShape is not None else None
+            loaded["projected"] = projected
+        return loaded["projected"]
+
+    def _alertRecord(self, index, data, fields, **extra):
+        """Build an alert record with the requested fields. The values
+        are taken from the extra keyword arguments, the meta data, or
+        the index values if the meta data is not loaded.
+        """
+        if fields is None:
+            record = {key: value for key, value in data.items() if key != "projected"}
+            record["uuid"] = index["uuid"]
+            record.update(extra)
+            return record
+
+        record = {}
+        for field in fields:
+            if field in extra:
+                record[field] = extra[field]
+            elif data is not None:
+                record[field] = index["uuid"] if field == "uuid" else data.get(field)
+            else:
+                record[field] = index[field]
+
+        return record
+
+    def _mapRows(self, bounds, inclusive=False):
+        """Look up the map regions whose bounds overlap a rectangle, or
+        touch it if inclusive, and return their index values.
+        """
+        rows = []
+        for entry in self._db.searchBounds("map", *bounds, inclusive=inclusive) or []:
+            if len(entry) != 14:
+                continue
+            recWest, recSouth, recEast, recNorth = entry[9:13]
+            rows.append({
+                "uuid": entry[1],
+                "label": entry[2],
+                "source": entry[3],
+                "admName": entry[4],
+                "admID": entry[5],
+                "validFrom": entry[6],
+                "validTo": entry[7],
+                "area": entry[13],
+                "bounds": {
+                    "west": recWest,
+                    "east": recEast,
+                    "north": recNorth,
+                    "south": recSouth,
+                },
+            })
+
+        return rows
+
+    def _mapCandidates(self, query, rows, cutoff, cutoffOn="query", mode="exact"):
+        """Compute an upper bound of the relative overlap of each map
+        region from the tiles near the search polygon. Tiles covered by
+        the search polygon add their indexed area to the intersection
+        directly, and only the remaining tiles have to be intersected.
+        In "bbox" mode, the intersection with each tile is estimated
+        from the intersection of the bounds instead. Regions that cannot
+        reach the cutoff are dropped.
+        """
+        area = query.area
+        west, south, east, north = query.bounds
+
+        with METRICS.timer("candidates"):
+            tiles = {}
+            for entry in self._db.searchTiles(west, south, east, north) or []:
+                tiles.setdefault(entry[0], []).append(entry[1:])
+
+            candidates = []
+            for row in rows:
+                recArea = row["area"]
+                if recArea <= 0.0:
+                    continue
+
+                isect = 0.0
+                upper = 0.0
+                pending = []
+                for number, tWest, tSouth, tEast, tNorth, tArea in tiles.get(row["uuid"], []):
+                    boxWest = max(west, tWest)
+                    boxEast = min(east, tEast)
+                    boxSouth = max(south, tSouth)
+                    boxNorth = min(north, tNorth)
+                    if boxEast <= boxWest or boxNorth <= boxSouth:
+                        continue
+                    boxArea = Shape.boxArea(boxWest, boxSouth, boxEast, boxNorth)
+                    if mode == "bbox":
+                        isect += min(boxArea, tArea)
+                        upper += min(boxArea, tArea)
+                    elif query.prepared.covers(box(tWest, tSouth, tEast, tNorth)):
+                        isect += tArea
+                        upper += tArea
+                    else:
+                        upper += min(BOX_AREA_SLACK*boxArea, tArea)
+                        pending.append(number)
+
+                relArea = area if cutoffOn == "query" else recArea
+                upper = min(upper, recArea, area) / relArea
+                if upper <= 0.0 or upper < cutoff:
+                    continue
+                if mode == "bbox":
+                    isect = min(isect, recArea, area)
+
+                candidates.append({
+                    "uuid": row["uuid"],
+                    "sent": self._validTime(row),
+                    "upper": upper,
+                    "isect": isect,
+                    "tiles": pending,
+                    "relArea": relArea,
+                    "index": row,
+                })
+
+        METRICS.count("candidates", len(rows))
+        METRICS.count("pruned", len(rows) - len(candidates))
+
+        return candidates
+
+    def _mapOverlap(self, target, query, cand, cutoff, fields, cache=None):
+        """Compute the relative overlap of a candidate map region with
+        the search polygon by intersecting the tiles that aren't fully
+        covered, and build its record. Returns a tuple of the overlap
+        the cutoff applies to and the record, or None if the overlap is
+        below the cutoff.
+
+        If a cache dictionary is provided, the loaded tiles are stored
+        in it so that they can be reused.
+        """
+        if cache is None:
+            cache = {}
+
+        isect = cand["isect"]
+        if cand["tiles"]:
+            mapShape = cache.get(cand["uuid"], None)
+            if mapShape is None:
+                mapShape = {"shape": Shape(cand["uuid"])}
+                cache[cand["uuid"]] = mapShape
+            try:
+                with METRICS.timer("intersection"):
+                    for number in cand["tiles"]:
+                        isect += query.projected.intersection(
+                            self._mapTile(mapShape, number)
+                        ).area
+            except Exception:
+                logger.error("Could not intersect with map region '%s'", cand["uuid"])
+                logException()
+                return None
+
+        overlap = isect / cand["relArea"]
+        if overlap < cutoff:
+            return None
+
+        index = cand["index"]
+        overlapQuery = isect / query.area
+        extra = {
+            "overlap": overlapQuery,
+            "overlap_query": overlapQuery,
+            "overlap_record": isect / index["area"],
+            "intersection": isect,
+        }
+        record = {}
+        for field in MAP_FIELDS if fields is None else fields:
+            record[field] = extra[field] if field in extra else index[field]
+
+        return overlap, record
+
+    def _mapContains(self, point, row, fields):
+        """Check if a map region covers a point, including its edge, and
+        build its record. Returns None if it doesn't. The region polygon is taken from the
+        process-wide region cache.
+        """
+        region = self.getRegion(row["uuid"])
+        if region is None or not region.prepared.covers(point):
+            return None
+
+        return {field: row[field] for field in (MAP_POINT_FIELDS if fields is None else fields)}
+
+    def _mapTile(self, mapShape, number):
+        """Return the equal-area polygon of a tile of a map region, or
+        the whole region for tile number -1. The tiles are loaded once
+        into the mapShape dictionary.
+        """
+        if number < 0:
+            if "projected" not in mapShape:
+                with METRICS.timer("parse"):
+                    mapShape["projected"] = mapShape["shape"].projected()
+            return mapShape["projected"]
+
+        if "tiles" not in mapShape:
+            with METRICS.timer("parse"):
+                mapShape["tiles"] = mapShape["shape"].tiles()
+        return mapShape["tiles"][number]["polygon"]
+
+    @staticmethod
+    def _deadline(timeout):
+        """Convert a timeout in milliseconds to a deadline."""
+        if timeout is None:
+            return None
+        return time.monotonic() + timeout/1000.0
+
+    @staticmethod
+    def _pastDeadline(deadline, status):
+        """Check if a deadline has passed, and if so, flag the status
+        as partial.
+        """
+        if deadline is not None and time.monotonic() >= deadline:
+            status["partial"] = True
+            return True
+        return False
+
+    @staticmethod
+    def _sentTime(row):
+        """Return the sent time of an index row as a timestamp."""
+        recSent = parseDateString(row["sent"])
+        return recSent.timestamp() if recSent else 0.0
+
+    @staticmethod
+    def _validTime(row):
+        """Return the start of the validity of a map index row as a
+        timestamp.
+        """
+        validFrom = parseDateString(row["validFrom"])
+        return validFrom.timestamp() if validFrom else 0.0
+
+    def _loadAlert(self, target, fUUID, cache):
+        """Load the meta data of an alert and store it in the request
+        cache. Alerts preloaded by warmUp are used if their file has not
+        been modified since.
+        """
+        loaded = _alertCache.get(fUUID, None)
+        if loaded is None or loaded["mtime"] != self._fileTime(target, fUUID):
+            loaded = {"data": self._getFileData(target, fUUID)}
+        cache[fUUID] = loaded
+        return loaded
+
+    def _filePath(self, target, fUUID):
+        """Return the path to a data file based on its uuid."""
+        dirOne = f"{target}_{fUUID[7]}"
+        dirTwo = f"{target}_{fUUID[6]}"
+        return os.path.join(self.conf.dataPath, dirOne, dirTwo, f"{fUUID}.json")
+
+    def _fileTime(self, target, fUUID):
+        """Return the modification time of a data file, or None if it
+        doesn't exist.
+        """
+        try:
+            return os.stat(self._filePath(target, fUUID)).st_mtime_ns
+        except Exception:
+            return None
+
     def _getFileData(self, target, fUUID):
         """Load data from a file based on its uuid."""
+        METRICS.count("loaded")
         try:
-            dirOne = f"{target}_{fUUID[7]}"
-            dirTwo = f"{target}_{fUUID[6]}"
-            filePath = os.path.join(self.conf.dataPath, dirOne, dirTwo, f"{fUUID}.json")
-            return safeLoadJson(filePath)
+            filePath = self._filePath(target, fUUID)
+            with METRICS.timer("load"):
+                return safeLoadJson(filePath)
         except Exception:
             logException()
             return {}
@@ -18,11 +18,16 @@ limitations under the License.
 """
 
 import os
+import math
 import logging
+import numpy as np
 import ma_search
 
 from uuid import uuid4
-from shapely.geometry import MultiPolygon, Polygon, mapping, shape
+from shapely.ops import unary_union
+from shapely.prepared import prep
+from shapely.validation import make_valid
+from shapely.geometry import MultiPolygon, Polygon, box, mapping, shape
 
 from ma_search.common import (
     safeLoadJson, safeWriteJson, logException, checkUUID, preparePath
@@ -30,6 +35,51 @@ from ma_search.common import (
 
 logger = logging.getLogger(__name__)
 
+# Lambert Azimuthal Equal-Area projection for Europe (EPSG:3035) on the
+# GRS80 ellipsoid, with the authalic latitude terms precomputed
+LAEA_A = 6378137.0
+LAEA_E = np.sqrt(0.0066943800229)
+LAEA_LAT0 = np.radians(52.0)
+LAEA_LON0 = np.radians(10.0)
+LAEA_FE = 4321000.0
+LAEA_FN = 3210000.0
+
+# Longest polygon edge in degrees that is projected as a straight line
+LAEA_MAX_SEGMENT = 0.1
+
+# Map polygons with at least this many points are split into square
+# tiles of this size in degrees, so that a search only has to intersect
+# the tiles near the search polygon
+MAP_TILE_MIN_POINTS = 1000
+MAP_TILE_SIZE = 1.0
+
+# CAP circles are stored as polygons with this many points, and with the
+# same area as the circle. Distances are computed on a sphere with the
+# authalic radius in kilometres.
+CIRCLE_SEGMENTS = 64
+CIRCLE_RADIUS = 6371.0072
+
+# CAP circles with a radius of zero mark a point, and their polygon is
+# given this radius in kilometres instead
+CIRCLE_MIN_RADIUS = 0.001
+
+
+def _authalicQ(phi):
+    """The q term of the authalic latitude for latitudes in radians."""
+    e = LAEA_E
+    sinPhi = np.sin(phi)
+    return (1.0 - e**2) * (
+        sinPhi/(1.0 - (e*sinPhi)**2) - np.log((1.0 - e*sinPhi)/(1.0 + e*sinPhi))/(2.0*e)
+    )
+
+
+LAEA_QP = _authalicQ(np.pi/2.0)
+LAEA_RQ = LAEA_A*np.sqrt(LAEA_QP/2.0)
+LAEA_BETA0 = np.arcsin(_authalicQ(LAEA_LAT0)/LAEA_QP)
+LAEA_D = LAEA_A*np.cos(LAEA_LAT0) / (
+    np.sqrt(1.0 - (LAEA_E*np.sin(LAEA_LAT0))**2)*LAEA_RQ*np.cos(LAEA_BETA0)
+)
+
 
 class Shape():
 
@@ -74,16 +124,39 @@ class Shape():
             e.g. not a Polygon.
         """
         uuid = str(uuid4())
-        if cls.polygonFromGeoJson(data) is None:
+        polygon = cls.polygonFromGeoJson(data)
+        if polygon is None:
             return None
 
+        # Invalid polygons are stored repaired, so they never have to be
+        # repaired when searched
+        if not polygon.is_valid:
+            repaired = cls.repairPolygon(polygon)
+            if repaired is None:
+                return None
+            logger.warning("Storing repaired copy of invalid polygon")
+            if isinstance(data, str):
+                data = safeLoadJson(data)
+            if "geometry" in data:
+                data = dict(data, geometry=mapping(repaired))
+            else:
+                data = mapping(repaired)
+
         savePath = preparePath(ma_search.CONFIG.dataPath, "map", uuid)
         path = os.path.join(savePath, uuid+".geojson")
         if not safeWriteJson(path, data):
             logger.error("Cannot write GeoJson file %s", path)
             return None
 
-        return cls(uuid)
+        newShape = cls(uuid)
+        if newShape.projected() is None:
+            logger.error("Cannot write projected GeoJson file for %s", path)
+            return None
+        if newShape.tiles() is None:
+            logger.error("Cannot write tiles GeoJson file for %s", path)
+            return None
+
+        return newShape
 
     ##
     #  Methods
@@ -135,6 +208,93 @@ class Shape():
             else:  # pragma: no cover
                 return None  # not reachable
 
+    def projected(self):
+        """Returns the full polygon in equal-area coordinates. The
+        projected polygon is stored next to the WGS84 polygon the first
+        time it is requested.
+
+        Returns
+        -------
+        :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon` or None
+            Returns shape if it can be found, otherwise None.
+        """
+        path = self._path[:-8]+".laea.geojson"
+        if os.path.isfile(path):
+            return self.polygonFromGeoJson(path)
+
+        full = self.polygonFromGeoJson(self._path)
+        if full is None:
+            logger.error("Full polygon cannot be loaded from %s", self._path)
+            return None
+
+        projected = self.projectPolygon(full)
+        if not safeWriteJson(path, mapping(projected)):
+            logger.error("Cannot write projected polygon to file")
+            return None
+
+        return projected
+
+    def tiles(self):
+        """Returns the full polygon split into tiles. Polygons with
+        fewer than MAP_TILE_MIN_POINTS points are a single tile. The
+        tiles are stored in equal-area coordinates next to the WGS84
+        polygon the first time they are requested.
+
+        Returns
+        -------
+        list or None
+            A list of dictionaries with the (west, south, east, north)
+            "bounds" in degrees, the "area" in square metres and the
+            projected "polygon" of each tile, or None if the polygon
+            can't be found.
+        """
+        path = self._path[:-8]+".tiles.geojson"
+        if os.path.isfile(path):
+            data = safeLoadJson(path)
+            if data is None:
+                return None
+            tiles = []
+            for feature in data.get("features", []):
+                polygon = self.polygonFromGeoJson(feature)
+                if polygon is None:
+                    return None
+                tiles.append({
+                    "bounds": tuple(feature["properties"]["bounds"]),
+                    "area": polygon.area,
+                    "polygon": polygon,
+                })
+            return tiles
+
+        full = self.polygonFromGeoJson(self._path)
+        if full is None:
+            logger.error("Full polygon cannot be loaded from %s", self._path)
+            return None
+
+        pieces = [full]
+        if self.pointCount(full) >= MAP_TILE_MIN_POINTS:
+            pieces = self.tilePolygon(full, MAP_TILE_SIZE)
+
+        tiles = []
+        features = []
+        for piece in pieces:
+            projected = self.projectPolygon(piece)
+            tiles.append({
+                "bounds": piece.bounds,
+                "area": projected.area,
+                "polygon": projected,
+            })
+            features.append({
+                "type": "Feature",
+                "properties": {"bounds": list(piece.bounds)},
+                "geometry": mapping(projected),
+            })
+
+        if not safeWriteJson(path, {"type": "FeatureCollection", "features": features}):
+            logger.error("Cannot write polygon tiles to file")
+            return None
+
+        return tiles
+
     def toGeoJson(self, **kwargs):
         """Return geometry as as GeoJson
 
@@ -198,6 +358,379 @@ class Shape():
             logException()
             return None
 
+    @staticmethod
+    def partBounds(polygon):
+        """Returns the bounds of each part of a polygon.
+
+        Parameters
+        ----------
+        polygon : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            Shapely object (Polygon).
+
+        Returns
+        -------
+        list
+            A list of (west, south, east, north) tuples, one for each
+            Polygon in a MultiPolygon, or a single entry for a Polygon.
+        """
+        if isinstance(polygon, MultiPolygon):
+            return [part.bounds for part in polygon.geoms]
+        return [polygon.bounds]
+
+    @staticmethod
+    def pointCount(polygon):
+        """Returns the number of coordinates in a polygon, including
+        its holes and all its parts.
+        """
+        parts = polygon.geoms if isinstance(polygon, MultiPolygon) else [polygon]
+        count = 0
+        for part in parts:
+            count += len(part.exterior.coords)
+            count += sum(len(ring.coords) for ring in part.interiors)
+        return count
+
+    @staticmethod
+    def tilePolygon(polygon, size):
+        """Returns the parts of a polygon inside each square of a grid
+        of longitude and latitude tiles.
+
+        Parameters
+        ----------
+        polygon : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            Shapely object (Polygon) in WGS84 longitude and latitude.
+        size : float
+            The width and height of the tiles in degrees.
+
+        Returns
+        -------
+        list
+            A list of polygons, one for each tile the polygon covers.
+        """
+        tiles = []
+        if polygon.is_empty:
+            return tiles
+
+        west, south, east, north = polygon.bounds
+        xMin = int(math.floor(west/size))
+        xMax = int(math.ceil(east/size))
+        yMin = int(math.floor(south/size))
+        yMax = int(math.ceil(north/size))
+
+        for y in range(yMin, yMax):
+            row = Shape._polygonalPart(polygon.intersection(box(
+                xMin*size, y*size, xMax*size, (y + 1)*size
+            )))
+            if row.is_empty:
+                continue
+            prepared = prep(row)
+            for x in range(xMin, xMax):
+                cell = box(x*size, y*size, (x + 1)*size, (y + 1)*size)
+                if not prepared.intersects(cell):
+                    continue
+                if prepared.covers(cell):
+                    tile = cell
+                else:
+                    tile = Shape._polygonalPart(row.intersection(cell))
+                if tile.area > 0.0:
+                    tiles.append(tile)
+
+        return tiles
+
+    @staticmethod
+    def repairPolygon(polygon):
+        """Returns a valid copy of an invalid polygon, with only the
+        polygonal parts of the repaired geometry kept.
+
+        Parameters
+        ----------
+        polygon : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            Shapely object (Polygon).
+
+        Returns
+        -------
+        :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon` or None
+            The polygon itself if it is valid, the repaired polygon, or
+            None if nothing valid was left.
+        """
+        if polygon.is_valid:
+            return polygon
+
+        repaired = Shape._polygonalPart(make_valid(polygon))
+        if repaired.is_empty:
+            logger.error("Could not repair invalid polygon")
+            return None
+
+        return repaired
+
+    @staticmethod
+    def _polygonalPart(geom):
+        """Returns the polygonal parts of a geometry, which may be
+        empty.
+        """
+        if isinstance(geom, (Polygon, MultiPolygon)):
+            return geom
+        polygonal = unary_union([
+            part for part in getattr(geom, "geoms", [])
+            if isinstance(part, (Polygon, MultiPolygon))
+        ])
+        return polygonal if isinstance(polygonal, (Polygon, MultiPolygon)) else Polygon()
+
+    @staticmethod
+    def normalisePolygon(polygon, precision=0.0, minPoints=0):
+        """Returns a repaired and simplified copy of a polygon.
+
+        Invalid polygons are repaired, and only the polygonal parts of
+        the repaired geometry are kept. The simplification tolerance is
+        chosen so that the area changes by about the given fraction,
+        which is roughly the tolerance times the perimeter.
+
+        Parameters
+        ----------
+        polygon : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            Shapely object (Polygon).
+        precision : float
+            The relative precision of the area. If 0.0, the polygon is
+            not simplified.
+        minPoints : int
+            Polygons with fewer points than this are not simplified.
+
+        Returns
+        -------
+        tuple
+            The normalised polygon, or None if nothing valid was left,
+            and the applied tolerance.
+        """
+        polygon = Shape.repairPolygon(polygon)
+        if polygon is None:
+            return None, 0.0
+
+        if precision <= 0.0 or polygon.length <= 0.0:
+            return polygon, 0.0
+
+        if Shape.pointCount(polygon) < minPoints:
+            return polygon, 0.0
+
+        tolerance = precision * polygon.area / polygon.length
+        simple = polygon.simplify(tolerance, preserve_topology=True)
+        if simple.is_empty or not simple.is_valid:
+            return polygon, 0.0
+
+        return simple, tolerance
+
+    @staticmethod
+    def projectCoords(lon, lat):
+        """Returns the equal-area (EPSG:3035) coordinates in metres of
+        longitudes and latitudes in degrees.
+        """
+        beta = np.arcsin(_authalicQ(np.radians(np.asarray(lat, dtype=float)))/LAEA_QP)
+        dLon = np.radians(np.asarray(lon, dtype=float)) - LAEA_LON0
+        cosDLon = np.cos(dLon)
+        b = LAEA_RQ*np.sqrt(2.0/(
+            1.0 + np.sin(LAEA_BETA0)*np.sin(beta) + np.cos(LAEA_BETA0)*np.cos(beta)*cosDLon
+        ))
+        east = LAEA_FE + b*LAEA_D*np.cos(beta)*np.sin(dLon)
+        north = LAEA_FN + (b/LAEA_D)*(
+            np.cos(LAEA_BETA0)*np.sin(beta) - np.sin(LAEA_BETA0)*np.cos(beta)*cosDLon
+        )
+        return east, north
+
+    @staticmethod
+    def projectPolygon(polygon):
+        """Returns a copy of a polygon in equal-area coordinates, where
+        the area is in square metres regardless of the latitude.
+
+        Parameters
+        ----------
+        polygon : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            Shapely object (Polygon) in WGS84 longitude and latitude.
+
+        Returns
+        -------
+        :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            The projected polygon.
+        """
+        if isinstance(polygon, MultiPolygon):
+            return MultiPolygon([Shape.projectPolygon(part) for part in polygon.geoms])
+        if polygon.is_empty:
+            return Polygon()
+
+        rings = [
+            np.column_stack(Shape.projectCoords(*Shape._densifyRing(*ring.xy)))
+            for ring in [polygon.exterior, *polygon.interiors]
+        ]
+        projected = Polygon(rings[0], rings[1:])
+        if not projected.is_valid and polygon.is_valid:
+            # Nearly touching rings may cross when densified
+            projected = Shape.repairPolygon(projected) or projected
+
+        return projected
+
+    @staticmethod
+    def _densifyRing(lon, lat):
+        """Returns the coordinates of a ring with points added along
+        edges longer than LAEA_MAX_SEGMENT, since straight edges in
+        longitude and latitude are curved in the projection.
+        """
+        lon = np.asarray(lon, dtype=float)
+        lat = np.asarray(lat, dtype=float)
+        dLon = np.diff(lon)
+        dLat = np.diff(lat)
+        steps = np.ceil(np.maximum(np.abs(dLon), np.abs(dLat))/LAEA_MAX_SEGMENT)
+        steps = np.maximum(steps, 1).astype(int)
+        if np.all(steps == 1):
+            return lon, lat
+
+        edge = np.repeat(np.arange(len(dLon)), steps)
+        frac = np.arange(len(edge)) - np.repeat(np.cumsum(steps) - steps, steps)
+        frac = frac/steps[edge]
+        return (
+            np.append(lon[edge] + frac*dLon[edge], lon[-1]),
+            np.append(lat[edge] + frac*dLat[edge], lat[-1]),
+        )
+
+    @staticmethod
+    def circlePolygon(lat, lon, radius, segments=CIRCLE_SEGMENTS):
+        """Returns a polygon approximating a CAP circle, given by its
+        centre latitude and longitude in degrees and its radius in
+        kilometres. The points are placed slightly outside the circle,
+        so that the polygon has about the same area as the circle.
+        A circle with radius zero is given a minimal radius.
+        """
+        step = 2.0*math.pi/segments
+        scale = math.sqrt(step/math.sin(step))
+        dist = min(max(radius, CIRCLE_MIN_RADIUS)*scale/CIRCLE_RADIUS, math.pi)
+        phi = math.radians(lat)
+        bearing = np.arange(segments)*step
+        pLat = np.arcsin(
+            np.sin(phi)*np.cos(dist) + np.cos(phi)*np.sin(dist)*np.cos(bearing)
+        )
+        pLon = math.radians(lon) + np.arctan2(
+            np.sin(bearing)*np.sin(dist)*np.cos(phi),
+            np.cos(dist) - np.sin(phi)*np.sin(pLat)
+        )
+        return Shape.repairPolygon(Polygon(np.column_stack((np.degrees(pLon), np.degrees(pLat)))))
+
+    @staticmethod
+    def circleBounds(lat, lon, radius):
+        """Returns the exact (west, south, east, north) bounds of a CAP
+        circle, given by its centre latitude and longitude in degrees
+        and its radius in kilometres. Circles crossing a pole or the
+        antimeridian span all longitudes. A circle with radius zero is
+        given the same minimal radius as its polygon.
+        """
+        dist = max(radius, CIRCLE_MIN_RADIUS)/CIRCLE_RADIUS
+        north = lat + math.degrees(dist)
+        south = lat - math.degrees(dist)
+        ratio = math.sin(dist)/math.cos(math.radians(lat)) if abs(lat) < 90.0 else 2.0
+        if north >= 90.0 or south <= -90.0 or dist >= math.pi/2.0 or ratio >= 1.0:
+            return -180.0, max(south, -90.0), 180.0, min(north, 90.0)
+
+        dLon = math.degrees(math.asin(ratio))
+        if lon - dLon < -180.0 or lon + dLon > 180.0:
+            return -180.0, south, 180.0, north
+
+        return lon - dLon, south, lon + dLon, north
+
+    @staticmethod
+    def circleDistance(lat, lon, pLon, pLat):
+        """Returns the great circle distance in kilometres from the
+        centre of a CAP circle to one or more points given by longitude
+        and latitude.
+        """
+        phi = math.radians(lat)
+        pPhi = np.radians(np.asarray(pLat, dtype=float))
+        dLon = np.radians(np.asarray(pLon, dtype=float) - lon)
+        hav = np.sin((pPhi - phi)/2.0)**2 + math.cos(phi)*np.cos(pPhi)*np.sin(dLon/2.0)**2
+        return 2.0*CIRCLE_RADIUS*np.arcsin(np.sqrt(np.clip(hav, 0.0, 1.0)))
+
+    @staticmethod
+    def boxArea(west, south, east, north):
+        """Returns the area in square metres of a longitude and latitude
+        rectangle on the ellipsoid.
+        """
+        dLon = np.radians(east - west)
+        dQ = _authalicQ(np.radians(north)) - _authalicQ(np.radians(south))
+        return float(LAEA_RQ**2 * dLon * dQ / LAEA_QP)
+
+    @staticmethod
+    def cellKey(x, y, level):
+        """Returns the quadkey of a grid cell from its column, counted
+        from longitude -180, and its row, counted from latitude 90.
+        """
+        digits = []
+        for bit in range(level - 1, -1, -1):
+            digits.append(str(((x >> bit) & 1) + 2*((y >> bit) & 1)))
+        return "".join(digits)
+
+    @staticmethod
+    def cellBounds(key):
+        """Returns the (west, south, east, north) bounds of a grid cell
+        from its quadkey.
+        """
+        x = y = 0
+        for digit in key:
+            x = 2*x + (int(digit) & 1)
+            y = 2*y + (int(digit) >> 1)
+        dLon = 360.0/2**len(key)
+        dLat = 180.0/2**len(key)
+        return (-180.0 + x*dLon, 90.0 - (y + 1)*dLat, -180.0 + (x + 1)*dLon, 90.0 - y*dLat)
+
+    @staticmethod
+    def gridCoverage(polygon, level):
+        """Returns the coverage of a polygon on a grid of longitude and
+        latitude cells, with 2^level by 2^level cells over the globe.
+
+        Parameters
+        ----------
+        polygon : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            Shapely object (Polygon) in WGS84 longitude and latitude.
+        level : int
+            The level of the grid, which is also the length of the
+            quadkeys.
+
+        Returns
+        -------
+        dict
+            The equal-area intersection in square metres of the polygon
+            with each cell it overlaps, by quadkey.
+        """
+        cells = {}
+        if polygon.is_empty:
+            return cells
+
+        count = 2**level
+        dLon = 360.0/count
+        dLat = 180.0/count
+        west, south, east, north = polygon.bounds
+        xMin = max(int(math.floor((west + 180.0)/dLon)), 0)
+        xMax = min(int(math.ceil((east + 180.0)/dLon)), count)
+        yMin = max(int(math.floor((90.0 - north)/dLat)), 0)
+        yMax = min(int(math.ceil((90.0 - south)/dLat)), count)
+
+        for y in range(yMin, yMax):
+            cellNorth = 90.0 - y*dLat
+            cellSouth = cellNorth - dLat
+            row = Shape._polygonalPart(polygon.intersection(box(
+                -180.0 + xMin*dLon, cellSouth, -180.0 + xMax*dLon, cellNorth
+            )))
+            if row.is_empty:
+                continue
+            prepared = prep(row)
+            for x in range(xMin, xMax):
+                cellWest = -180.0 + x*dLon
+                cell = box(cellWest, cellSouth, cellWest + dLon, cellNorth)
+                if not prepared.intersects(cell):
+                    continue
+                if prepared.covers(cell):
+                    area = Shape.boxArea(cellWest, cellSouth, cellWest + dLon, cellNorth)
+                else:
+                    part = Shape._polygonalPart(row.intersection(cell))
+                    area = Shape.projectPolygon(part).area if not part.is_empty else 0.0
+                if area > 0.0:
+                    cells[Shape.cellKey(x, y, level)] = area
+
+        return cells
+
     @staticmethod
     def geoJsonFromPolygon(polygon, extra=None):
         """Returns geoJson from a shapely object
@@ -230,3 +763,58 @@ class Shape():
             return geoJson
 
 # END Class Shape
+
+
+class SearchShape():
+
+    __slots__ = ("polygon", "prepared", "projected", "area", "bounds", "_weights", "_coords")
+
+    def __init__(self, polygon, projected=None):
+        """A search polygon with its prepared form, equal-area projection,
+        area and bounds, which are computed once so that the polygon can
+        be reused for many searches.
+
+        Parameters
+        ----------
+        polygon : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            The search polygon.
+        projected : :obj:`shapely.Polygon`, :obj:`shapely.MultiPolygon`
+            The search polygon in equal-area coordinates, if known. If
+            None, it is projected from the polygon.
+        """
+        self.polygon = polygon
+        self.prepared = prep(polygon)
+        self.projected = Shape.projectPolygon(polygon) if projected is None else projected
+        self.area = self.projected.area
+        self.bounds = polygon.bounds
+        self._weights = {}
+        self._coords = None
+        return
+
+    def insideCircle(self, lat, lon, radius):
+        """Returns True if the search polygon lies within a CAP circle,
+        given by its centre latitude and longitude in degrees and its
+        radius in kilometres. As the circle is convex, it is enough to
+        check the distance to the points of the outer rings.
+        """
+        if self._coords is None:
+            parts = getattr(self.polygon, "geoms", [self.polygon])
+            self._coords = np.concatenate([
+                np.asarray(part.exterior.coords, dtype=float) for part in parts
+            ])
+        return bool(np.all(Shape.circleDistance(
+            lat, lon, self._coords[:, 0], self._coords[:, 1]
+        ) <= radius))
+
+    def cellWeights(self, level):
+        """Returns the fraction of each grid cell covered by the search
+        polygon, by quadkey. The values are computed once per level.
+        """
+        if level not in self._weights:
+            self._weights[level] = {
+                key: area/Shape.boxArea(*Shape.cellBounds(key))
+                for key, area in Shape.gridCoverage(self.polygon, level).items()
+            }
+        return self._weights[level]
+
+# END Class SearchShape
@@ -17,8 +17,10 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+from ma_search.db.memory import MemoryDB
 from ma_search.db.sqlite import SQLiteDB
 
 __all__ = [
-    "SQLiteDB"
+    "MemoryDB",
+    "SQLiteDB",
 ]
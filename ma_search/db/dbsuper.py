@@ -17,12 +17,24 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import math
 import logging
 
 import ma_search
 
+from ma_search.common import dateToTimestamp
+
 logger = logging.getLogger(__name__)
 
+# The CAP fields of alerts that can be filtered on, and their columns
+ALERT_FILTERS = {
+    "event": "Event",
+    "urgency": "Urgency",
+    "severity": "Severity",
+    "certainty": "Certainty",
+    "awarenessLevel": "AwarenessLevel",
+}
+
 
 class Database():
 
@@ -33,14 +45,113 @@ class Database():
         return
 
     ##
-    #  Methods
+    #  Search Methods
+    ##
+
+    def searchBounds(
+        self, target, west, south, east, north, vertical=None, period=None, filters=None,
+        text=None, inclusive=False
+    ):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def searchBoundsAt(self, west, south, east, north, when, vertical=None, filters=None):
+        """Find all alerts where the bounds rectangle overlaps, and
+        which are in effect at a given datetime.
+        """
+        return self.searchBounds(
+            "alert", west, south, east, north,
+            vertical=vertical, period=(when, when), filters=filters
+        )
+
+    def searchBoundsBetween(
+        self, west, south, east, north, start, end, vertical=None, filters=None
+    ):
+        """Find all alerts where the bounds rectangle overlaps, and
+        which are in effect at any time between two datetimes.
+        """
+        return self.searchBounds(
+            "alert", west, south, east, north,
+            vertical=vertical, period=(start, end), filters=filters
+        )
+
+    def searchTiles(self, west, south, east, north, inclusive=False):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def searchCells(self, cells, vertical=None, period=None, filters=None, text=None):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def searchGeocodes(self, geocodes, vertical=None, period=None, filters=None, text=None):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def overlapCells(self, weights):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def findMapUUID(self, admID):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def cellLevel(self):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    ##
+    #  Database Methods
+    ##
+
+    def purgeMapTable(self):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def purgeAlertTable(self):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def setCellLevel(self, level):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def flush(self):
+        """Write any pending changes to storage. Providers that store
+        each change as it is made have nothing to do.
+        """
+        return True
+
+    ##
+    #  Data Methods
     ##
 
     def editMapRecord(
         self, cmd, recordUUID, label, source, coordSystem, west, south, east, north, area,
-        validFrom=None, validTo=None, meta=None
+        validFrom=None, validTo=None, meta=None, tiles=None
+    ):
+        """Implemented in subclass."""
+        raise NotImplementedError
+
+    def editAlertRecord(
+        self, cmd, recordUUID, identifier, sentDate, sourcePath, coordSystem,
+        west, south, east, north, altitude, ceiling, area, parts=None, valid=True,
+        cells=None, onsetDate=None, expiresDate=None, meta=None, geocodes=None,
+        areaDesc=None
     ):
         """Implemented in subclass."""
         raise NotImplementedError
 
+    ##
+    #  Internal Functions
+    ##
+
+    def _periodTimestamps(self, period):
+        """Convert a (start, end) period of datetime objects to
+        timestamps. A missing period, start or end is unbounded.
+        """
+        if period is None:
+            return -math.inf, math.inf
+        tStart, tEnd = map(dateToTimestamp, period)
+        return -math.inf if tStart is None else tStart, math.inf if tEnd is None else tEnd
+
 # END Class Database
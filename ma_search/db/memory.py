@@ -0,0 +1,1105 @@
+"""
+MetAlert Search : In-Memory DB
+==============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import time
+import uuid
+import logging
+
+import numpy as np
+
+from datetime import datetime
+
+from ma_search.db.dbsuper import ALERT_FILTERS, Database
+from ma_search.common import logException, parseDateString, textTokens
+from ma_search.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+# The column layout is identical to the SQLite tables so that search
+# results can be consumed in the same way regardless of provider.
+# Each entry is (name, dtype, nullable).
+TABLE_COLUMNS = {
+    "MapData": (
+        ("ID",          np.int64,   False),
+        ("UUID",        np.str_,    False),
+        ("Label",       np.str_,    False),
+        ("Source",      np.str_,    False),
+        ("AdmName",     np.str_,    True),
+        ("AdmID",       np.str_,    True),
+        ("ValidFrom",   np.str_,    True),
+        ("ValidTo",     np.str_,    True),
+        ("CoordSystem", np.str_,    False),
+        ("BoundWest",   np.float64, False),
+        ("BoundSouth",  np.float64, False),
+        ("BoundEast",   np.float64, False),
+        ("BoundNorth",  np.float64, False),
+        ("Area",        np.float64, False),
+    ),
+    "MapTiles": (
+        ("UUID",        np.str_,    False),
+        ("Tile",        np.int64,   False),
+        ("BoundWest",   np.float64, False),
+        ("BoundSouth",  np.float64, False),
+        ("BoundEast",   np.float64, False),
+        ("BoundNorth",  np.float64, False),
+        ("Area",        np.float64, False),
+    ),
+    "AlertData": (
+        ("ID",          np.int64,   False),
+        ("UUID",        np.str_,    False),
+        ("Identifier",  np.str_,    False),
+        ("SentDate",    np.str_,    False),
+        ("SourcePath",  np.str_,    False),
+        ("CoordSystem", np.str_,    False),
+        ("BoundWest",   np.float64, False),
+        ("BoundSouth",  np.float64, False),
+        ("BoundEast",   np.float64, False),
+        ("BoundNorth",  np.float64, False),
+        ("Altitude",    np.float64, False),
+        ("Ceiling",     np.float64, False),
+        ("Area",        np.float64, False),
+        ("Valid",       np.int64,   False),
+        ("OnsetDate",   np.str_,    False),
+        ("ExpiresDate", np.str_,    True),
+        ("Event",       np.str_,    True),
+        ("Urgency",     np.str_,    True),
+        ("Severity",    np.str_,    True),
+        ("Certainty",   np.str_,    True),
+        ("AwarenessLevel", np.int64, True),
+    ),
+    "AlertParts": (
+        ("UUID",        np.str_,    False),
+        ("BoundWest",   np.float64, False),
+        ("BoundSouth",  np.float64, False),
+        ("BoundEast",   np.float64, False),
+        ("BoundNorth",  np.float64, False),
+        ("Altitude",    np.float64, False),
+        ("Ceiling",     np.float64, False),
+        ("Onset",       np.float64, False),
+        ("Expires",     np.float64, False),
+    ),
+    "AlertCells": (
+        ("Cell",        np.str_,    False),
+        ("UUID",        np.str_,    False),
+        ("Area",        np.float64, False),
+    ),
+    "AlertGeocodes": (
+        ("ValueName",   np.str_,    False),
+        ("Value",       np.str_,    False),
+        ("UUID",        np.str_,    False),
+    ),
+    "AlertText": (
+        ("UUID",        np.str_,    False),
+        ("Language",    np.str_,    False),
+        ("Tokens",      np.str_,    False),
+    ),
+}
+TARGET_TABLE = {"alert": "AlertData", "map": "MapData"}
+
+# Missing values in nullable columns. Awareness levels start at 1.
+NULL_VALUES = {np.str_: "", np.int64: 0}
+
+# Values of columns missing from snapshots written by earlier versions.
+# Missing onset dates are copied from the sent dates, and the missing
+# values of alert parts are copied from the alerts after loading.
+COLUMN_DEFAULTS = {
+    "Valid": 1, "OnsetDate": "", "ExpiresDate": "",
+    "Event": "", "Urgency": "", "Severity": "", "Certainty": "", "AwarenessLevel": 0,
+    "Altitude": np.nan, "Ceiling": np.nan, "Onset": np.nan, "Expires": np.nan,
+}
+
+
+class MemoryDB(Database):
+
+    def __init__(self):
+        super().__init__()
+
+        self._tables = {}
+        self._nextID = {}
+        self._pending = {}
+        self._dropped = {}
+        self._keys = {}
+        self._snapFile = None
+        self._snapStat = None
+        self._cellLevel = self.conf.searchGridLevel
+        self._isNew = True
+        self._isDirty = False
+
+        for table in TABLE_COLUMNS:
+            self._createTable(table)
+
+        if isinstance(self.conf.memoryPath, str):
+            self._snapFile = os.path.join(self.conf.memoryPath, "index.npz")
+            self._isNew = not os.path.isfile(self._snapFile)
+            if not self._isNew:
+                self.loadSnapshot()
+
+        return
+
+    def __del__(self):
+        """Write the snapshot when the object is destroyed, if it has
+        not been flushed. This is only a fallback, as it may fail when
+        the interpreter is shutting down.
+        """
+        if self._isDirty:
+            logger.debug("Saving memory index snapshot")
+            self.saveSnapshot()
+        return
+
+    ##
+    #  Search Methods
+    ##
+
+    def searchBounds(
+        self, target, west, south, east, north, vertical=None, period=None, filters=None,
+        text=None, inclusive=False
+    ):
+        """Find all entries in target where the bounds rectangle
+        overlaps. For alerts, the altitude and ceiling must also
+        overlap the vertical (min, max) range, the onset and expires
+        dates the period (start, end), the CAP fields must have one of
+        the values listed in the filters dictionary, and the area
+        description in one language must contain all the words of the
+        text, if given. If inclusive, bounds that only touch the
+        rectangle also match, as for a point on the edge.
+        """
+        self._checkSnapshot()
+        self._materialise()
+        start = time.perf_counter()
+        try:
+            tables = self._tables
+            table = TARGET_TABLE[target]
+            data = tables[table]
+            if target == "alert":
+                # Alerts are matched on the bounds of their polygon parts
+                parts = tables["AlertParts"]
+                mask = self._boundsMask(parts, west, south, east, north, inclusive)
+                if vertical is not None:
+                    mask &= self._verticalMask(parts, vertical)
+                if period is not None:
+                    mask &= self._periodMask(parts, period)
+                mask = np.isin(data["UUID"], parts["UUID"][mask])
+                mask &= self._filterMask(data, filters)
+                mask &= self._textMask(tables, text)
+            else:
+                mask = self._boundsMask(data, west, south, east, north, inclusive)
+            dRecords = self._fetchRows(tables, table, np.flatnonzero(mask))
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def searchTiles(self, west, south, east, north, inclusive=False):
+        """Find all map tiles where the bounds rectangle overlaps, or
+        touches it if inclusive. Returns a list of tuples of UUID, tile
+        number, bounds and area.
+        """
+        self._checkSnapshot()
+        self._materialise()
+        start = time.perf_counter()
+        try:
+            tables = self._tables
+            data = tables["MapTiles"]
+            index = np.flatnonzero(self._boundsMask(data, west, south, east, north, inclusive))
+            dRecords = list(zip(*[
+                data[name][index].tolist() for name in (
+                    "UUID", "Tile", "BoundWest", "BoundSouth", "BoundEast", "BoundNorth", "Area"
+                )
+            ]))
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def searchCells(self, cells, vertical=None, period=None, filters=None, text=None):
+        """Find all alerts covering any of a list of grid cells, given
+        by quadkey. The vertical range, period, filters and text are
+        applied as for searchBounds.
+        """
+        self._checkSnapshot()
+        self._materialise()
+        start = time.perf_counter()
+        try:
+            tables = self._tables
+            data = tables["AlertData"]
+            posting = tables["AlertCells"]
+            found = posting["UUID"][np.isin(posting["Cell"], np.array(list(cells), dtype=np.str_))]
+            mask = np.isin(data["UUID"], found)
+            if vertical is not None:
+                mask &= self._verticalMask(data, vertical)
+            if period is not None:
+                parts = tables["AlertParts"]
+                mask &= np.isin(data["UUID"], parts["UUID"][self._periodMask(parts, period)])
+            mask &= self._filterMask(data, filters)
+            mask &= self._textMask(tables, text)
+            dRecords = self._fetchRows(tables, "AlertData", np.flatnonzero(mask))
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def searchGeocodes(self, geocodes, vertical=None, period=None, filters=None, text=None):
+        """Find all alerts with any of a list of (valueName, value)
+        geocode pairs. The vertical range, period, filters and text are
+        applied as for searchBounds.
+        """
+        self._checkSnapshot()
+        self._materialise()
+        start = time.perf_counter()
+        try:
+            tables = self._tables
+            data = tables["AlertData"]
+            posting = tables["AlertGeocodes"]
+            byName = {}
+            for valueName, value in geocodes:
+                byName.setdefault(valueName, []).append(value)
+            match = np.zeros(len(posting["UUID"]), dtype=bool)
+            for valueName, values in byName.items():
+                match |= (posting["ValueName"] == valueName) & np.isin(
+                    posting["Value"], np.array(values, dtype=np.str_)
+                )
+            mask = np.isin(data["UUID"], posting["UUID"][match])
+            if vertical is not None:
+                mask &= self._verticalMask(data, vertical)
+            if period is not None:
+                parts = tables["AlertParts"]
+                mask &= np.isin(data["UUID"], parts["UUID"][self._periodMask(parts, period)])
+            mask &= self._filterMask(data, filters)
+            mask &= self._textMask(tables, text)
+            dRecords = self._fetchRows(tables, "AlertData", np.flatnonzero(mask))
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def overlapCells(self, weights):
+        """Estimate the overlap area of each alert with a polygon from
+        the fraction of each grid cell the polygon covers, given as a
+        dictionary of weights by quadkey. Returns a list of tuples of
+        UUID and area.
+        """
+        self._checkSnapshot()
+        self._materialise()
+        start = time.perf_counter()
+        try:
+            tables = self._tables
+            data = tables["AlertCells"]
+            keys = np.array(sorted(weights), dtype=np.str_)
+            values = np.array([weights[key] for key in keys], dtype=np.float64)
+            index = np.searchsorted(keys, data["Cell"]).clip(0, max(len(keys) - 1, 0))
+            mask = keys[index] == data["Cell"] if len(keys) > 0 else np.zeros(0, dtype=bool)
+            uuids, inverse = np.unique(data["UUID"][mask], return_inverse=True)
+            areas = np.bincount(
+                inverse, weights=data["Area"][mask]*values[index[mask]], minlength=len(uuids)
+            )
+            dRecords = list(zip(uuids.tolist(), areas.tolist()))
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def findMapUUID(self, admID):
+        """Find the UUID of the most recently added map record with a
+        given administrative ID. Returns None if there is no match.
+        """
+        self._checkSnapshot()
+        self._materialise()
+        try:
+            tables = self._tables
+            data = tables["MapData"]
+            index = np.flatnonzero(data["AdmID"] == str(admID))
+            if index.size == 0:
+                return None
+            latest = index[np.argmax(data["ID"][index])]
+            return str(data["UUID"][latest])
+        except Exception:
+            logException()
+            return None
+
+    def cellLevel(self):
+        """Return the grid level of the cells in the alert index, or
+        None if the alerts are not all indexed with cells at one level.
+        """
+        self._checkSnapshot()
+        return self._cellLevel
+
+    ##
+    #  Database Methods
+    ##
+
+    def purgeMapTable(self):
+        """Purge all map data and start fresh."""
+        status = True
+        status &= self._createTable("MapData")
+        status &= self._createTable("MapTiles")
+        self._isDirty = True
+        return status
+
+    def purgeAlertTable(self):
+        """Purge all alert data and start fresh."""
+        status = True
+        status &= self._createTable("AlertData")
+        status &= self._createTable("AlertParts")
+        status &= self._createTable("AlertCells")
+        status &= self._createTable("AlertGeocodes")
+        status &= self._createTable("AlertText")
+        self._cellLevel = self.conf.searchGridLevel
+        self._isDirty = True
+        return status
+
+    def setCellLevel(self, level):
+        """Record the grid level of the cells in the alert index, or
+        None if the alerts are not all indexed with cells at one level.
+        """
+        self._cellLevel = None if level is None else int(level)
+        self._isDirty = True
+        return True
+
+    def flush(self):
+        """Write the snapshot if the index has changed since it was
+        loaded or last saved.
+
+        Returns
+        -------
+        bool
+            True if successful or there was nothing to write, otherwise
+            False
+        """
+        if not self._isDirty or self._snapFile is None:
+            return True
+        return self.saveSnapshot()
+
+    def loadSnapshot(self):
+        """Load the index from the snapshot file.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        if self._snapFile is None:
+            logger.error("No snapshot file specified")
+            return False
+
+        try:
+            # The tables are loaded into new dictionaries and swapped in
+            # at the end, so a search running while the snapshot is
+            # reloaded sees either the old or the new index
+            snapStat = self._statSnapshot()
+            tables = {}
+            nextID = {}
+            with np.load(self._snapFile, allow_pickle=False) as snap:
+                for table, columns in TABLE_COLUMNS.items():
+                    if f"{table}.UUID" not in snap.files:
+                        tables[table] = self._emptyTable(table)
+                        nextID[table] = 1
+                        continue
+                    rows = len(snap[f"{table}.UUID"])
+                    tables[table] = {
+                        name: snap[f"{table}.{name}"] if f"{table}.{name}" in snap.files
+                        else np.full(rows, COLUMN_DEFAULTS[name], dtype=dtype)
+                        for name, dtype, _ in columns
+                    }
+                    nextID[table] = int(snap[f"{table}.NextID"])
+                # Snapshots written by earlier versions have no grid level
+                cellLevel = int(snap["Info.GridLevel"]) if "Info.GridLevel" in snap.files else -1
+            if "AlertData.OnsetDate" not in snap.files:
+                tables["AlertData"]["OnsetDate"] = tables["AlertData"]["SentDate"]
+            if not ("AlertParts.Altitude" in snap.files and "AlertParts.Onset" in snap.files):
+                self._fillParts(tables)
+            if "MapTiles.UUID" not in snap.files:
+                self._fillTiles(tables)
+            self._tables = tables
+            self._nextID = nextID
+            self._cellLevel = cellLevel if cellLevel >= 0 else None
+            self._pending = {table: {} for table in TABLE_COLUMNS}
+            self._dropped = {table: set() for table in TABLE_COLUMNS}
+            self._keys = {
+                table: set(tables[table]["UUID"].tolist()) for table in TARGET_TABLE.values()
+            }
+            self._snapStat = snapStat
+            self._isDirty = False
+            logger.debug("Loaded memory index snapshot: %s", self._snapFile)
+
+        except Exception:
+            logger.error("Could not load snapshot: %s", self._snapFile)
+            logException()
+            return False
+
+        return True
+
+    def saveSnapshot(self):
+        """Write the index to the snapshot file. The file is written to
+        a temporary file first and then moved into place.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        if self._snapFile is None:
+            return False
+
+        self._materialise()
+        arrays = {}
+        for table, data in self._tables.items():
+            for name, values in data.items():
+                arrays[f"{table}.{name}"] = values
+            arrays[f"{table}.NextID"] = np.int64(self._nextID[table])
+        arrays["Info.GridLevel"] = np.int64(-1 if self._cellLevel is None else self._cellLevel)
+
+        tmpFile = self._snapFile + ".tmp"
+        try:
+            with open(tmpFile, mode="wb") as outFile:
+                np.savez(outFile, **arrays)
+            os.replace(tmpFile, self._snapFile)
+            self._snapStat = self._statSnapshot()
+            self._isDirty = False
+
+        except Exception:
+            logger.error("Could not write snapshot: %s", self._snapFile)
+            logException()
+            return False
+
+        return True
+
+    ##
+    #  Data Methods
+    ##
+
+    def editMapRecord(
+        self, cmd, recordUUID, label, source, coordSystem, west, south, east, north, area,
+        validFrom=None, validTo=None, meta=None, tiles=None
+    ):
+        """Insert or update a map record in the database.
+
+        Parameters
+        ----------
+        cmd : str
+            The command to be run on the database. Must be either "insert",
+            "update" or "replace".
+        recordUUID : str
+            The UUID of the dataset to be added or modified.
+        label : str
+            A user-defined label for the record.
+        source : str
+            A user-defined source description for the record.
+        coordSystem : str
+            The coordinate system (datum) used for this record.
+        west, south, east, north, area : float
+            The coordinates in degrees of the bounding rectangle, and the
+            equal-area area of the polygon in square metres.
+        validFrom, validTo : datetime or None, optional
+            The validity range of the record.
+        meta : dict or None, optional
+            A dictionary of meta data values to be added. Currently accepted
+            are "admName" and "admID". Other values will be ignored.
+        tiles : list or None, optional
+            A list of (west, south, east, north, area) tuples, one for each
+            tile of the polygon as returned by Shape.tiles. These are used by
+            searchTiles. If None, the whole polygon is a single tile.
+
+        Returns
+        -------
+        bool :
+            True if successful, otherwise False
+        """
+        pUUID = None
+        fromDate = None
+        toDate = None
+        admName = None
+        admID = None
+        valid = True
+
+        try:
+            pUUID = str(uuid.UUID(recordUUID))
+        except Exception:
+            logger.error("The UUID '%s' is not valid" % str(recordUUID))
+            logException()
+            valid = False
+
+        if not (-90.0 <= south < north <= 90.0):
+            logger.error("Coordinates must be in the range (-90 <= south < north <= 90)")
+            valid = False
+
+        if not (-180.0 <= west < east <= 180.0):
+            logger.error("Coordinates must be in the range (-180 <= west < east <= 180)")
+            valid = False
+
+        if isinstance(validFrom, datetime):
+            fromDate = validFrom.isoformat()
+
+        if isinstance(validTo, datetime):
+            toDate = validTo.isoformat()
+
+        if isinstance(meta, dict):
+            admName = meta.get("admName", None)
+            admID = meta.get("admID", None)
+
+        if tiles is None:
+            tiles = [(west, south, east, north, area)]
+            numbers = [-1]
+        else:
+            numbers = list(range(len(tiles)))
+        if not all(len(tile) == 5 and tile[0] <= tile[2] and tile[1] <= tile[3] for tile in tiles):
+            logger.error("Tiles must be a list of (west, south, east, north, area) tuples")
+            valid = False
+
+        if not valid:
+            logger.error("Incorrect parameters provided to editMapEntry")
+            return False
+
+        status = self._editRecord("MapData", cmd, pUUID, {
+            "Label": label,
+            "Source": source,
+            "AdmName": admName,
+            "AdmID": admID,
+            "ValidFrom": fromDate,
+            "ValidTo": toDate,
+            "CoordSystem": coordSystem,
+            "BoundWest": west,
+            "BoundSouth": south,
+            "BoundEast": east,
+            "BoundNorth": north,
+            "Area": area,
+        })
+        if status and pUUID in self._keys["MapData"]:
+            self._setMapTiles(pUUID, numbers, tiles)
+
+        return status
+
+    def editAlertRecord(
+        self, cmd, recordUUID, identifier, sentDate, sourcePath, coordSystem,
+        west, south, east, north, altitude, ceiling, area, parts=None, valid=True,
+        cells=None, onsetDate=None, expiresDate=None, meta=None, geocodes=None,
+        areaDesc=None
+    ):
+        """Insert or update an alert record in the database.
+
+        Parameters
+        ----------
+        cmd : str
+            The command to be run on the database. Must be either "insert",
+            "update" or "replace".
+        recordUUID : str
+            The UUID of the dataset to be added or modified.
+        identifier : str
+            The unique identifier from the alert itself.
+        sentDate : datetime
+            The timestamp of when the alert was sent
+        sourcePath : str
+            The path to the CAP file.
+        coordSystem : str
+            The coordinate system (datum) used for this record.
+        west, south, east, north, altitude, ceiling, area : float
+            The coordinates in degrees of the bounding rectangle, the altitude
+            and ceiling of the alert, and the area of the polygon as reported
+            by shapely.
+        parts : list or None, optional
+            A list of (west, south, east, north) bounds, one for each part of
+            a MultiPolygon. These are used by searchBounds. If None, the
+            bounding rectangle of the whole alert is used as a single part.
+        valid : bool, optional
+            Whether the polygon of the alert was valid as received. Invalid
+            polygons are repaired before they are stored.
+        cells : dict or None, optional
+            The area of the alert within each grid cell, by quadkey. These
+            are used by overlapCells and searchCells. If None, the alert
+            has no cells.
+        onsetDate, expiresDate : datetime or None, optional
+            The period the alert is in effect. If None, the alert starts at
+            the sent date and has no end.
+        meta : dict or None, optional
+            A dictionary of CAP fields to be added. Currently accepted are
+            "event", "urgency", "severity", "certainty" and
+            "awarenessLevel". Other values will be ignored.
+        geocodes : list or None, optional
+            A list of (valueName, value) geocode pairs of the alert's area.
+            These are used by searchGeocodes. If None, the alert has no
+            geocodes.
+        areaDesc : dict or None, optional
+            The description of the alert's area by language. These are
+            used by the text search. If None, the alert has no
+            description.
+
+        Returns
+        -------
+        bool :
+            True if successful, otherwise False
+        """
+        pUUID = None
+        isValid = bool(valid)
+        valid = True
+
+        if not isinstance(meta, dict):
+            meta = {}
+
+        try:
+            pUUID = str(uuid.UUID(recordUUID))
+        except Exception:
+            logger.error("The UUID '%s' is not valid" % str(recordUUID))
+            logException()
+            valid = False
+
+        if not (-90.0 <= south < north <= 90.0):
+            logger.error("Coordinates must be in the range (-90 <= south < north <= 90)")
+            valid = False
+
+        if not (-180.0 <= west < east <= 180.0):
+            logger.error("Coordinates must be in the range (-180 <= west < east <= 180)")
+            valid = False
+
+        if ceiling < altitude:
+            logger.error("Ceiling must be greater or equal to altitude")
+            valid = False
+
+        if onsetDate is None:
+            onsetDate = sentDate
+        if not isinstance(onsetDate, datetime):
+            logger.error("OnsetDate must be a datetime object")
+            valid = False
+        if not (expiresDate is None or isinstance(expiresDate, datetime)):
+            logger.error("ExpiresDate must be a datetime object or None")
+            valid = False
+
+        if valid:
+            period = self._periodTimestamps((onsetDate, expiresDate))
+            if period[1] < period[0]:
+                logger.error("ExpiresDate must be later than OnsetDate")
+                valid = False
+            onsetDate = onsetDate.isoformat()
+            expiresDate = None if expiresDate is None else expiresDate.isoformat()
+
+        if isinstance(sentDate, datetime):
+            sentDate = sentDate.isoformat()
+        else:
+            logger.error("SentDate must be a datetime object")
+            valid = False
+
+        if parts is None:
+            parts = [(west, south, east, north)]
+        if not all(len(part) == 4 and part[0] <= part[2] and part[1] <= part[3] for part in parts):
+            logger.error("Parts must be a list of (west, south, east, north) bounds")
+            valid = False
+
+        if cells is None:
+            cells = {}
+        if not (isinstance(cells, dict) and all(isinstance(key, str) for key in cells)):
+            logger.error("Cells must be a dictionary of areas by quadkey")
+            valid = False
+
+        if geocodes is None:
+            geocodes = []
+        if not all(
+            len(pair) == 2 and all(isinstance(v, str) for v in pair) for pair in geocodes
+        ):
+            logger.error("Geocodes must be a list of (valueName, value) pairs")
+            valid = False
+
+        if areaDesc is None:
+            areaDesc = {}
+        if not (isinstance(areaDesc, dict) and all(
+            isinstance(key, str) and isinstance(value, str) for key, value in areaDesc.items()
+        )):
+            logger.error("AreaDesc must be a dictionary of descriptions by language")
+            valid = False
+
+        if not valid:
+            logger.error("Incorrect parameters provided to editMapEntry")
+            return False
+
+        status = self._editRecord("AlertData", cmd, pUUID, {
+            "Identifier": identifier,
+            "SentDate": sentDate,
+            "SourcePath": sourcePath,
+            "CoordSystem": coordSystem,
+            "BoundWest": west,
+            "BoundSouth": south,
+            "BoundEast": east,
+            "BoundNorth": north,
+            "Altitude": altitude,
+            "Ceiling": ceiling,
+            "Area": area,
+            "Valid": int(isValid),
+            "OnsetDate": onsetDate,
+            "ExpiresDate": expiresDate,
+            **{column: meta.get(key, None) for key, column in ALERT_FILTERS.items()},
+        })
+        if status and pUUID in self._keys["AlertData"]:
+            self._setAlertParts(pUUID, parts, altitude, ceiling, period)
+            self._setAlertCells(pUUID, cells)
+            self._setAlertGeocodes(pUUID, geocodes)
+            self._setAlertText(pUUID, areaDesc)
+
+        return status
+
+    ##
+    #  Internal Functions
+    ##
+
+    def _createTable(self, table):
+        """Create an empty set of column arrays for a table.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        self._tables[table] = self._emptyTable(table)
+        self._nextID[table] = 1
+        self._pending[table] = {}
+        self._dropped[table] = set()
+        if table in TARGET_TABLE.values():
+            self._keys[table] = set()
+        return True
+
+    def _emptyTable(self, table):
+        """Return a set of empty column arrays for a table."""
+        return {name: np.empty(0, dtype=dtype) for name, dtype, _ in TABLE_COLUMNS[table]}
+
+    def _statSnapshot(self):
+        """Return the inode, modification time and size of the snapshot
+        file. Each save writes a new file, so the inode changes even if
+        the time doesn't.
+        """
+        stat = os.stat(self._snapFile)
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _checkSnapshot(self):
+        """Reload the snapshot if it has been written by another process
+        since it was loaded, so that alerts ingested elsewhere become
+        searchable. An index with unsaved changes is not reloaded.
+        """
+        if self._snapFile is None or self._isDirty:
+            return
+        try:
+            snapStat = self._statSnapshot()
+        except OSError:
+            return
+        if snapStat != self._snapStat:
+            # A file that can't be loaded is only tried once
+            logger.info("Reloading memory index snapshot: %s", self._snapFile)
+            self._snapStat = snapStat
+            self.loadSnapshot()
+        return
+
+    def _editRecord(self, table, cmd, pUUID, values):
+        """Apply an insert, replace or update command to a table. The
+        error messages match those reported by SQLite.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        for name, _, nullable in TABLE_COLUMNS[table][2:]:
+            if values[name] is None and not nullable:
+                logger.error("IntegrityError: NOT NULL constraint failed: %s.%s", table, name)
+                return False
+
+        exists = pUUID in self._keys[table]
+        if cmd == "insert":
+            if exists:
+                logger.error("IntegrityError: UNIQUE constraint failed: %s.UUID", table)
+                return False
+            self._appendRow(table, pUUID, values)
+
+        elif cmd == "replace":
+            if exists:
+                self._dropRows(table, pUUID)
+            self._appendRow(table, pUUID, values)
+
+        elif cmd == "update":
+            if exists:
+                self._updateRow(table, pUUID, values)
+
+        else:
+            logger.error("Unknown command '%s'" % cmd)
+            return False
+
+        self._isDirty = True
+
+        return True
+
+    def _appendRow(self, table, pUUID, values):
+        """Add a single row to a table, with the next ID."""
+        values = dict(values, ID=self._nextID[table], UUID=pUUID)
+        self._appendRows(table, pUUID, [
+            tuple(values[name] for name, _, _ in TABLE_COLUMNS[table])
+        ])
+        self._nextID[table] += 1
+        return
+
+    def _updateRow(self, table, pUUID, values):
+        """Update the values of an existing row in place. The pending
+        rows are applied first, and the columns are copied, so that a
+        search holding on to the old arrays is not affected.
+        """
+        self._materialise()
+        data = dict(self._tables[table])
+        match = data["UUID"] == pUUID
+        for name, dtype, _ in TABLE_COLUMNS[table][2:]:
+            value = NULL_VALUES.get(dtype) if values[name] is None else values[name]
+            value = np.array([value], dtype=dtype)
+            # Text arrays have a fixed width that may need to grow
+            column = data[name].astype(np.promote_types(data[name].dtype, value.dtype))
+            column[match] = value[0]
+            data[name] = column
+        self._tables = {**self._tables, table: data}
+        return
+
+    def _appendRows(self, table, pUUID, rows):
+        """Add rows belonging to a record to a table. The rows are tuples
+        of values in the column order of the table, and are buffered
+        until the next search, so adding a record doesn't copy the
+        whole table.
+        """
+        self._pending[table].setdefault(pUUID, []).extend(rows)
+        if table in self._keys:
+            self._keys[table].add(pUUID)
+        self._isDirty = True
+        return
+
+    def _dropRows(self, table, pUUID):
+        """Remove all rows belonging to a record from a table. Rows that
+        are still buffered are dropped right away, the others when the
+        buffered changes are applied.
+        """
+        self._pending[table].pop(pUUID, None)
+        self._dropped[table].add(pUUID)
+        if table in self._keys:
+            self._keys[table].discard(pUUID)
+        self._isDirty = True
+        return
+
+    def _materialise(self):
+        """Apply the buffered changes to the column arrays. Each table
+        is rebuilt once for all the rows added and removed since the
+        last time, so building an index of n records takes O(n) time.
+        The tables are swapped in whole, like when a snapshot is loaded.
+        """
+        tables = None
+        for table, columns in TABLE_COLUMNS.items():
+            pending = self._pending[table]
+            dropped = self._dropped[table]
+            if not (pending or dropped):
+                continue
+
+            data = self._tables[table]
+            if dropped:
+                keep = ~np.isin(data["UUID"], np.array(list(dropped), dtype=np.str_))
+                data = {name: values[keep] for name, values in data.items()}
+            else:
+                data = dict(data)
+
+            rows = [row for uuidRows in pending.values() for row in uuidRows]
+            for (name, dtype, _), values in zip(columns, zip(*rows) if rows else ()):
+                values = [NULL_VALUES.get(dtype) if v is None else v for v in values]
+                data[name] = np.concatenate((data[name], np.array(values, dtype=dtype)))
+
+            if tables is None:
+                tables = dict(self._tables)
+            tables[table] = data
+            self._pending[table] = {}
+            self._dropped[table] = set()
+
+        if tables is not None:
+            self._tables = tables
+
+        return
+
+    def _setMapTiles(self, pUUID, numbers, tiles):
+        """Replace the tiles of a map in the MapTiles table."""
+        self._dropRows("MapTiles", pUUID)
+        self._appendRows("MapTiles", pUUID, [
+            (pUUID, number, *tile) for number, tile in zip(numbers, tiles)
+        ])
+        return
+
+    def _setAlertParts(self, pUUID, parts, altitude, ceiling, period):
+        """Replace the part bounds of an alert in the AlertParts table."""
+        self._dropRows("AlertParts", pUUID)
+        self._appendRows("AlertParts", pUUID, [
+            (pUUID, *part, altitude, ceiling, *period) for part in parts
+        ])
+        return
+
+    def _setAlertCells(self, pUUID, cells):
+        """Replace the grid cells of an alert in the AlertCells table."""
+        self._dropRows("AlertCells", pUUID)
+        self._appendRows("AlertCells", pUUID, [
+            (key, pUUID, area) for key, area in cells.items()
+        ])
+        return
+
+    def _setAlertGeocodes(self, pUUID, geocodes):
+        """Replace the geocodes of an alert in the AlertGeocodes table."""
+        self._dropRows("AlertGeocodes", pUUID)
+        self._appendRows("AlertGeocodes", pUUID, [
+            (valueName, value, pUUID) for valueName, value in geocodes
+        ])
+        return
+
+    def _setAlertText(self, pUUID, areaDesc):
+        """Replace the area descriptions of an alert in the AlertText
+        table. The descriptions are stored as their words separated and
+        enclosed by spaces, so that a word is matched as " word ".
+        """
+        self._dropRows("AlertText", pUUID)
+        self._appendRows("AlertText", pUUID, [
+            (pUUID, language, " %s " % " ".join(textTokens(text)))
+            for language, text in areaDesc.items()
+        ])
+        return
+
+    def _fillParts(self, tables):
+        """Copy the altitude, ceiling and validity period of each alert
+        to its parts.
+        """
+        data = tables["AlertData"]
+        parts = tables["AlertParts"]
+        if len(data["UUID"]) == 0:
+            return
+        order = np.argsort(data["UUID"])
+        index = order[np.searchsorted(data["UUID"], parts["UUID"], sorter=order).clip(
+            0, len(order) - 1
+        )]
+        periods = np.array([
+            self._periodTimestamps((parseDateString(onset), parseDateString(expires)))
+            for onset, expires in zip(data["OnsetDate"], data["ExpiresDate"])
+        ], dtype=np.float64).reshape(-1, 2)
+        parts["Altitude"] = data["Altitude"][index]
+        parts["Ceiling"] = data["Ceiling"][index]
+        parts["Onset"] = periods[index, 0]
+        parts["Expires"] = periods[index, 1]
+        return
+
+    def _fillTiles(self, tables):
+        """Give each map region a single tile, numbered -1, covering its
+        bounds.
+        """
+        data = tables["MapData"]
+        tables["MapTiles"] = {
+            "UUID": data["UUID"].copy(),
+            "Tile": np.full(len(data["UUID"]), -1, dtype=np.int64),
+            **{
+                name: data[name].copy()
+                for name in ("BoundWest", "BoundSouth", "BoundEast", "BoundNorth", "Area")
+            },
+        }
+        return
+
+    def _boundsMask(self, data, west, south, east, north, inclusive=False):
+        """Return a boolean mask of the rows in a table where the bounds
+        rectangle overlaps, or also touches it if inclusive.
+        """
+        if inclusive:
+            mask = (west <= data["BoundEast"]) & (east >= data["BoundWest"])
+            mask &= (north >= data["BoundSouth"]) & (south <= data["BoundNorth"])
+            return mask
+        mask = (west < data["BoundEast"]) & (east > data["BoundWest"])
+        mask &= (north > data["BoundSouth"]) & (south < data["BoundNorth"])
+        return mask
+
+    def _verticalMask(self, data, vertical):
+        """Return a boolean mask of the rows in a table where the
+        altitude and ceiling overlap a (min, max) range. Rows with no
+        thickness match a range that includes their altitude.
+        """
+        zMin, zMax = vertical
+        altitude = data["Altitude"]
+        ceiling = data["Ceiling"]
+        return ((zMin < ceiling) & (zMax > altitude)) | (
+            (altitude == ceiling) & (zMin <= altitude) & (zMax >= altitude)
+        )
+
+    def _periodMask(self, data, period):
+        """Return a boolean mask of the rows in a table where the onset
+        and expires timestamps overlap a (start, end) period.
+        """
+        tStart, tEnd = self._periodTimestamps(period)
+        return (data["Onset"] <= tEnd) & (data["Expires"] > tStart)
+
+    def _filterMask(self, data, filters):
+        """Return a boolean mask of the rows in the AlertData table
+        where the CAP fields have one of the values listed in a filters
+        dictionary. The values are not cast to the width of a string
+        column, so that longer values can't match a prefix.
+        """
+        mask = np.ones(len(data["UUID"]), dtype=bool)
+        for key, values in (filters or {}).items():
+            if key not in ALERT_FILTERS:
+                raise ValueError(f"Unknown alert filter '{key}'")
+            column = data[ALERT_FILTERS[key]]
+            dtype = np.str_ if column.dtype.kind == "U" else None
+            mask &= np.isin(column, np.array(list(values), dtype=dtype))
+        return mask
+
+    def _textMask(self, tables, text):
+        """Return a boolean mask of the rows in the AlertData table
+        where the area description in one language contains all the
+        words of a text. A text without words matches nothing.
+        """
+        data = tables["AlertData"]
+        if text is None:
+            return np.ones(len(data["UUID"]), dtype=bool)
+        words = textTokens(text)
+        posting = tables["AlertText"]
+        match = np.full(len(posting["UUID"]), bool(words))
+        for word in words:
+            match &= np.char.find(posting["Tokens"], f" {word} ") >= 0
+        return np.isin(data["UUID"], posting["UUID"][match])
+
+    def _fetchRows(self, tables, table, index):
+        """Return the rows of a table at the given index positions as a
+        list of tuples in the same format as returned by SQLite. The
+        tables are passed in, so that a search uses the same set of
+        tables throughout, even if the snapshot is reloaded meanwhile.
+        """
+        data = tables[table]
+        columns = []
+        for name, dtype, nullable in TABLE_COLUMNS[table]:
+            values = data[name][index].tolist()
+            if nullable:
+                values = [None if value == NULL_VALUES[dtype] else value for value in values]
+            columns.append(values)
+        return list(zip(*columns))
+
+# END Class MemoryDB
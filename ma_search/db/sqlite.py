@@ -18,14 +18,18 @@ limitations under the License.
 """
 
 import os
+import json
+import math
+import time
 import uuid
 import sqlite3
 import logging
 
 from datetime import datetime
 
-from ma_search.db.dbsuper import Database
-from ma_search.common import logException
+from ma_search.db.dbsuper import ALERT_FILTERS, Database
+from ma_search.common import logException, textTokens
+from ma_search.metrics import METRICS
 
 logger = logging.getLogger(__name__)
 
@@ -48,27 +52,84 @@ class SQLiteDB(Database):
         return
 
     def __del__(self):
-        """Close the database when the object is destroyed."""
+        """Close the database when the object is destroyed. The garbage
+        collector may destroy it in another thread than the one that
+        opened it, in which case the connection is closed when it is
+        freed. All edits are already committed.
+        """
         if isinstance(self._conn, sqlite3.Connection):
             logger.debug("Closing database connection")
-            self._conn.commit()
-            self._conn.close()
+            try:
+                self._conn.commit()
+                self._conn.close()
+            except sqlite3.ProgrammingError:
+                logger.debug("Database connection belongs to another thread")
         return
 
     ##
     #  Search Methods
     ##
 
-    def searchBounds(self, target, west, south, east, north):
+    def searchBounds(
+        self, target, west, south, east, north, vertical=None, period=None, filters=None,
+        text=None, inclusive=False
+    ):
         """Find all entries in target where the bounds rectangle
-        overlaps.
+        overlaps. For alerts, the altitude and ceiling must also
+        overlap the vertical (min, max) range, the onset and expires
+        dates the period (start, end), the CAP fields must have one of
+        the values listed in the filters dictionary, and the area
+        description in one language must contain all the words of the
+        text, if given. If inclusive, bounds that only touch the
+        rectangle also match, as for a point on the edge.
         """
-        tableMap = {"alert": "AlertData", "map": "MapData"}
         dRecords = []
+        zMin, zMax = (-math.inf, math.inf) if vertical is None else vertical
+        tStart, tEnd = self._periodTimestamps(period)
+        start = time.perf_counter()
+        try:
+            if target == "alert":
+                # Alerts are matched on the bounds of their polygon parts.
+                # The R*Tree rounds its values outwards, so the vertical
+                # range and period are checked again on the exact values.
+                filterSQL, filterArgs = self._alertFilter(period, filters, text)
+                verticalSQL, verticalArgs = self._verticalFilter(vertical)
+                cursor = self._conn.execute((
+                    "SELECT * FROM AlertData WHERE UUID IN (\n"
+                    f"  SELECT UUID FROM AlertParts WHERE {self._boundsFilter(inclusive)}\n"
+                    "  AND ? <= Ceiling AND ? >= Altitude AND ? >= Onset AND ? < Expires\n"
+                    f") AND {verticalSQL}{filterSQL};\n"
+                ), (
+                    west, east, north, south, zMin, zMax, tEnd, tStart, *verticalArgs,
+                    *filterArgs
+                ))
+            elif target == "map":
+                cursor = self._conn.execute((
+                    f"SELECT * FROM MapData WHERE {self._boundsFilter(inclusive)};\n"
+                ), (west, east, north, south))
+            else:
+                raise ValueError(f"Unknown search target '{target}'")
+            dRecords = cursor.fetchall()
+            cursor.close()
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def searchTiles(self, west, south, east, north, inclusive=False):
+        """Find all map tiles where the bounds rectangle overlaps, or
+        touches it if inclusive. Returns a list of tuples of UUID, tile
+        number, bounds and area.
+        """
+        start = time.perf_counter()
         try:
             cursor = self._conn.execute((
-                f"SELECT * FROM {tableMap[target]} WHERE\n"
-                "? < BoundEast AND ? > BoundWest AND ? > BoundSouth AND ? < BoundNorth;\n"
+                "SELECT UUID, Tile, BoundWest, BoundSouth, BoundEast, BoundNorth, Area\n"
+                f"FROM MapTiles WHERE {self._boundsFilter(inclusive)};\n"
             ), (west, east, north, south))
             dRecords = cursor.fetchall()
             cursor.close()
@@ -77,8 +138,118 @@ class SQLiteDB(Database):
             logException()
             return None
 
+        METRICS.observe("index", time.perf_counter() - start)
+
         return dRecords
 
+    def searchCells(self, cells, vertical=None, period=None, filters=None, text=None):
+        """Find all alerts covering any of a list of grid cells, given
+        by quadkey. The vertical range, period, filters and text are
+        applied as for searchBounds.
+        """
+        start = time.perf_counter()
+        try:
+            filterSQL, filterArgs = self._alertFilter(period, filters, text)
+            verticalSQL, verticalArgs = self._verticalFilter(vertical)
+            cursor = self._conn.execute((
+                "SELECT * FROM AlertData WHERE UUID IN (\n"
+                "  SELECT c.UUID FROM AlertCells c\n"
+                "  JOIN json_each(?) q ON c.Cell = q.value\n"
+                f") AND {verticalSQL}{filterSQL};\n"
+            ), (json.dumps(list(cells)), *verticalArgs, *filterArgs))
+            dRecords = cursor.fetchall()
+            cursor.close()
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def searchGeocodes(self, geocodes, vertical=None, period=None, filters=None, text=None):
+        """Find all alerts with any of a list of (valueName, value)
+        geocode pairs. The vertical range, period, filters and text are
+        applied as for searchBounds.
+        """
+        start = time.perf_counter()
+        try:
+            filterSQL, filterArgs = self._alertFilter(period, filters, text)
+            verticalSQL, verticalArgs = self._verticalFilter(vertical)
+            cursor = self._conn.execute((
+                "SELECT * FROM AlertData WHERE UUID IN (\n"
+                "  SELECT g.UUID FROM AlertGeocodes g\n"
+                "  JOIN json_each(?) q ON g.ValueName = json_extract(q.value, '$[0]')\n"
+                "  AND g.Value = json_extract(q.value, '$[1]')\n"
+                f") AND {verticalSQL}{filterSQL};\n"
+            ), (json.dumps([list(pair) for pair in geocodes]), *verticalArgs, *filterArgs))
+            dRecords = cursor.fetchall()
+            cursor.close()
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def overlapCells(self, weights):
+        """Estimate the overlap area of each alert with a polygon from
+        the fraction of each grid cell the polygon covers, given as a
+        dictionary of weights by quadkey. Returns a list of tuples of
+        UUID and area.
+        """
+        start = time.perf_counter()
+        try:
+            cursor = self._conn.execute((
+                "SELECT c.UUID, SUM(c.Area * q.value) FROM AlertCells c\n"
+                "JOIN json_each(?) q ON c.Cell = q.key\n"
+                "GROUP BY c.UUID;\n"
+            ), (json.dumps(weights),))
+            dRecords = cursor.fetchall()
+            cursor.close()
+
+        except Exception:
+            logException()
+            return None
+
+        METRICS.observe("index", time.perf_counter() - start)
+
+        return dRecords
+
+    def findMapUUID(self, admID):
+        """Find the UUID of the most recently added map record with a
+        given administrative ID. Returns None if there is no match.
+        """
+        try:
+            cursor = self._conn.execute(
+                "SELECT UUID FROM MapData WHERE AdmID = ? ORDER BY ID DESC LIMIT 1;",
+                (str(admID),)
+            )
+            record = cursor.fetchone()
+        except Exception:
+            logException()
+            return None
+
+        return record[0] if record else None
+
+    def cellLevel(self):
+        """Return the grid level of the cells in the alert index, or
+        None if the alerts are not all indexed with cells at one level.
+        """
+        try:
+            cursor = self._conn.execute(
+                "SELECT Value FROM IndexInfo WHERE Key = 'GridLevel';"
+            )
+            record = cursor.fetchone()
+        except Exception:
+            logException()
+            return None
+
+        return int(record[0]) if record else None
+
     ##
     #  Database Methods
     ##
@@ -91,19 +262,40 @@ class SQLiteDB(Database):
         return status
 
     def purgeAlertTable(self):
-        """Purge all alert data and start fresh."""
+        """Purge all alert data and start fresh. The alerts indexed
+        from now on have cells at the current grid level.
+        """
         status = True
         status &= self._dropAlertTable()
         status &= self._createAlertTable()
+        status &= self.setCellLevel(self.conf.searchGridLevel)
         return status
 
+    def setCellLevel(self, level):
+        """Record the grid level of the cells in the alert index, or
+        None if the alerts are not all indexed with cells at one level.
+        """
+        try:
+            with self._conn:
+                self._conn.execute("DELETE FROM IndexInfo WHERE Key = 'GridLevel';")
+                if level is not None:
+                    self._conn.execute(
+                        "INSERT INTO IndexInfo (Key, Value) VALUES ('GridLevel', ?);",
+                        (int(level),)
+                    )
+        except Exception:
+            logException()
+            return False
+
+        return True
+
     ##
     #  Data Methods
     ##
 
     def editMapRecord(
         self, cmd, recordUUID, label, source, coordSystem, west, south, east, north, area,
-        validFrom=None, validTo=None, meta=None
+        validFrom=None, validTo=None, meta=None, tiles=None
     ):
         """Insert or update a map record in the database.
 
@@ -121,13 +313,17 @@ class SQLiteDB(Database):
         coordSystem : str
             The coordinate system (datum) used for this record.
         west, south, east, north, area : float
-            The coordinates in degrees of the bounding rectangle, and the area
-            of it as reported by shapely.
+            The coordinates in degrees of the bounding rectangle, and the
+            equal-area area of the polygon in square metres.
         validFrom, validTo : datetime or None, optional
             The validity range of the record.
         meta : dict or None, optional
             A dictionary of meta data values to be added. Currently accepted
             are "admName" and "admID". Other values will be ignored.
+        tiles : list or None, optional
+            A list of (west, south, east, north, area) tuples, one for each
+            tile of the polygon as returned by Shape.tiles. These are used by
+            searchTiles. If None, the whole polygon is a single tile.
 
         Returns
         -------
@@ -166,50 +362,62 @@ class SQLiteDB(Database):
             admName = meta.get("admName", None)
             admID = meta.get("admID", None)
 
+        if tiles is None:
+            tiles = [(west, south, east, north, area)]
+            numbers = [-1]
+        else:
+            numbers = list(range(len(tiles)))
+        if not all(len(tile) == 5 and tile[0] <= tile[2] and tile[1] <= tile[3] for tile in tiles):
+            logger.error("Tiles must be a list of (west, south, east, north, area) tuples")
+            valid = False
+
         if not valid:
             logger.error("Incorrect parameters provided to editMapEntry")
             return False
 
         if cmd in ("insert", "replace"):
             try:
-                self._conn.execute((
-                    f"{cmd.upper()} INTO MapData ("
-                    "UUID, Label, Source, AdmName, AdmID, ValidFrom, ValidTo, "
-                    "CoordSystem, BoundWest, BoundSouth, BoundEast, BoundNorth, Area"
-                    ") VALUES ("
-                    "?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?"
-                    ");"
-                ), (
-                    pUUID, label, source, admName, admID, fromDate, toDate,
-                    coordSystem, west, south, east, north, area
-                ))
-                self._conn.commit()
+                with self._conn:
+                    self._conn.execute((
+                        f"{cmd.upper()} INTO MapData ("
+                        "UUID, Label, Source, AdmName, AdmID, ValidFrom, ValidTo, "
+                        "CoordSystem, BoundWest, BoundSouth, BoundEast, BoundNorth, Area"
+                        ") VALUES ("
+                        "?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?"
+                        ");"
+                    ), (
+                        pUUID, label, source, admName, admID, fromDate, toDate,
+                        coordSystem, west, south, east, north, area
+                    ))
+                    self._setMapTiles(pUUID, numbers, tiles)
             except Exception:
                 logException()
                 return False
 
         elif cmd == "update":
             try:
-                self._conn.execute((
-                    "UPDATE MapData SET "
-                    "Label = ?, "
-                    "Source = ?, "
-                    "AdmName = ?, "
-                    "AdmID = ?, "
-                    "ValidFrom = ?, "
-                    "ValidTo = ?, "
-                    "CoordSystem = ?, "
-                    "BoundWest = ?, "
-                    "BoundSouth = ?, "
-                    "BoundEast = ?, "
-                    "BoundNorth = ?, "
-                    "Area = ? "
-                    "WHERE UUID = '%s'"
-                ) % str(pUUID), (
-                    label, source, admName, admID, fromDate, toDate,
-                    coordSystem, west, south, east, north, area
-                ))
-                self._conn.commit()
+                with self._conn:
+                    cursor = self._conn.execute((
+                        "UPDATE MapData SET "
+                        "Label = ?, "
+                        "Source = ?, "
+                        "AdmName = ?, "
+                        "AdmID = ?, "
+                        "ValidFrom = ?, "
+                        "ValidTo = ?, "
+                        "CoordSystem = ?, "
+                        "BoundWest = ?, "
+                        "BoundSouth = ?, "
+                        "BoundEast = ?, "
+                        "BoundNorth = ?, "
+                        "Area = ? "
+                        "WHERE UUID = '%s'"
+                    ) % str(pUUID), (
+                        label, source, admName, admID, fromDate, toDate,
+                        coordSystem, west, south, east, north, area
+                    ))
+                    if cursor.rowcount > 0:
+                        self._setMapTiles(pUUID, numbers, tiles)
             except Exception:
                 logException()
                 return False
@@ -222,7 +430,9 @@ class SQLiteDB(Database):
 
     def editAlertRecord(
         self, cmd, recordUUID, identifier, sentDate, sourcePath, coordSystem,
-        west, south, east, north, altitude, ceiling, area
+        west, south, east, north, altitude, ceiling, area, parts=None, valid=True,
+        cells=None, onsetDate=None, expiresDate=None, meta=None, geocodes=None,
+        areaDesc=None
     ):
         """Insert or update a map record in the database.
 
@@ -245,6 +455,32 @@ class SQLiteDB(Database):
             The coordinates in degrees of the bounding rectangle, the altitude
             and ceiling of the alert, and the area of the polygon as reported
             by shapely.
+        parts : list or None, optional
+            A list of (west, south, east, north) bounds, one for each part of
+            a MultiPolygon. These are used by searchBounds. If None, the
+            bounding rectangle of the whole alert is used as a single part.
+        valid : bool, optional
+            Whether the polygon of the alert was valid as received. Invalid
+            polygons are repaired before they are stored.
+        cells : dict or None, optional
+            The area of the alert within each grid cell, by quadkey. These
+            are used by overlapCells and searchCells. If None, the alert
+            has no cells.
+        onsetDate, expiresDate : datetime or None, optional
+            The period the alert is in effect. If None, the alert starts at
+            the sent date and has no end.
+        meta : dict or None, optional
+            A dictionary of CAP fields to be added. Currently accepted are
+            "event", "urgency", "severity", "certainty" and
+            "awarenessLevel". Other values will be ignored.
+        geocodes : list or None, optional
+            A list of (valueName, value) geocode pairs of the alert's area.
+            These are used by searchGeocodes. If None, the alert has no
+            geocodes.
+        areaDesc : dict or None, optional
+            The description of the alert's area by language. These are
+            used by the text search. If None, the alert has no
+            description.
 
         Returns
         -------
@@ -252,8 +488,13 @@ class SQLiteDB(Database):
             True if successful, otherwise False
         """
         pUUID = None
+        isValid = bool(valid)
         valid = True
 
+        if not isinstance(meta, dict):
+            meta = {}
+        fields = [meta.get(key, None) for key in ALERT_FILTERS]
+
         try:
             pUUID = str(uuid.UUID(recordUUID))
         except Exception:
@@ -273,55 +514,121 @@ class SQLiteDB(Database):
             logger.error("Ceiling must be greater or equal to altitude")
             valid = False
 
+        if onsetDate is None:
+            onsetDate = sentDate
+        if not isinstance(onsetDate, datetime):
+            logger.error("OnsetDate must be a datetime object")
+            valid = False
+        if not (expiresDate is None or isinstance(expiresDate, datetime)):
+            logger.error("ExpiresDate must be a datetime object or None")
+            valid = False
+
+        if valid:
+            period = self._periodTimestamps((onsetDate, expiresDate))
+            if period[1] < period[0]:
+                logger.error("ExpiresDate must be later than OnsetDate")
+                valid = False
+            onsetDate = onsetDate.isoformat()
+            expiresDate = None if expiresDate is None else expiresDate.isoformat()
+
         if isinstance(sentDate, datetime):
             sentDate = sentDate.isoformat()
         else:
             logger.error("SentDate must be a datetime object")
             valid = False
 
+        if parts is None:
+            parts = [(west, south, east, north)]
+        if not all(len(part) == 4 and part[0] <= part[2] and part[1] <= part[3] for part in parts):
+            logger.error("Parts must be a list of (west, south, east, north) bounds")
+            valid = False
+
+        if cells is None:
+            cells = {}
+        if not (isinstance(cells, dict) and all(isinstance(key, str) for key in cells)):
+            logger.error("Cells must be a dictionary of areas by quadkey")
+            valid = False
+
+        if geocodes is None:
+            geocodes = []
+        if not all(
+            len(pair) == 2 and all(isinstance(v, str) for v in pair) for pair in geocodes
+        ):
+            logger.error("Geocodes must be a list of (valueName, value) pairs")
+            valid = False
+
+        if areaDesc is None:
+            areaDesc = {}
+        if not (isinstance(areaDesc, dict) and all(
+            isinstance(key, str) and isinstance(value, str) for key, value in areaDesc.items()
+        )):
+            logger.error("AreaDesc must be a dictionary of descriptions by language")
+            valid = False
+
         if not valid:
             logger.error("Incorrect parameters provided to editMapEntry")
             return False
 
         if cmd in ("insert", "replace"):
             try:
-                self._conn.execute((
-                    f"{cmd.upper()} INTO AlertData ("
-                    "UUID, Identifier, SentDate, SourcePath, CoordSystem, "
-                    "BoundWest, BoundSouth, BoundEast, BoundNorth, Altitude, Ceiling, Area"
-                    ") VALUES ("
-                    "?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?"
-                    ");"
-                ), (
-                    pUUID, identifier, sentDate, sourcePath, coordSystem,
-                    west, south, east, north, altitude, ceiling, area
-                ))
-                self._conn.commit()
+                with self._conn:
+                    self._conn.execute((
+                        f"{cmd.upper()} INTO AlertData ("
+                        "UUID, Identifier, SentDate, SourcePath, CoordSystem, "
+                        "BoundWest, BoundSouth, BoundEast, BoundNorth, Altitude, Ceiling, Area, "
+                        "Valid, OnsetDate, ExpiresDate, "
+                        "Event, Urgency, Severity, Certainty, AwarenessLevel"
+                        ") VALUES ("
+                        "?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?"
+                        ");"
+                    ), (
+                        pUUID, identifier, sentDate, sourcePath, coordSystem,
+                        west, south, east, north, altitude, ceiling, area, int(isValid),
+                        onsetDate, expiresDate, *fields
+                    ))
+                    self._setAlertParts(pUUID, parts, altitude, ceiling, period)
+                    self._setAlertCells(pUUID, cells)
+                    self._setAlertGeocodes(pUUID, geocodes)
+                    self._setAlertText(pUUID, areaDesc)
             except Exception:
                 logException()
                 return False
 
         elif cmd == "update":
             try:
-                self._conn.execute((
-                    "UPDATE AlertData SET "
-                    "Identifier = ?, "
-                    "SentDate = ?, "
-                    "SourcePath = ?, "
-                    "CoordSystem = ?, "
-                    "BoundWest = ?, "
-                    "BoundSouth = ?, "
-                    "BoundEast = ?, "
-                    "BoundNorth = ?, "
-                    "Altitude = ?, "
-                    "Ceiling = ?, "
-                    "Area = ? "
-                    "WHERE UUID = '%s'"
-                ) % str(pUUID), (
-                    identifier, sentDate, sourcePath, coordSystem,
-                    west, south, east, north, altitude, ceiling, area
-                ))
-                self._conn.commit()
+                with self._conn:
+                    cursor = self._conn.execute((
+                        "UPDATE AlertData SET "
+                        "Identifier = ?, "
+                        "SentDate = ?, "
+                        "SourcePath = ?, "
+                        "CoordSystem = ?, "
+                        "BoundWest = ?, "
+                        "BoundSouth = ?, "
+                        "BoundEast = ?, "
+                        "BoundNorth = ?, "
+                        "Altitude = ?, "
+                        "Ceiling = ?, "
+                        "Area = ?, "
+                        "Valid = ?, "
+                        "OnsetDate = ?, "
+                        "ExpiresDate = ?, "
+                        "Event = ?, "
+                        "Urgency = ?, "
+                        "Severity = ?, "
+                        "Certainty = ?, "
+                        "AwarenessLevel = ? "
+                        "WHERE UUID = '%s'"
+                    ) % str(pUUID), (
+                        identifier, sentDate, sourcePath, coordSystem,
+                        west, south, east, north, altitude, ceiling, area, int(isValid),
+                        onsetDate, expiresDate, *fields
+                    ))
+                    if cursor.rowcount > 0:
+                        self._setAlertParts(pUUID, parts, altitude, ceiling, period)
+                        self._setAlertCells(pUUID, cells)
+                        self._setAlertGeocodes(pUUID, geocodes)
+                        self._setAlertText(pUUID, areaDesc)
             except Exception:
                 logException()
                 return False
@@ -336,13 +643,204 @@ class SQLiteDB(Database):
     #  Internal Functions
     ##
 
+    def _setMapTiles(self, pUUID, numbers, tiles):
+        """Replace the tiles of a map in the MapTiles table. The caller
+        is responsible for committing the changes.
+        """
+        self._conn.execute("DELETE FROM MapTiles WHERE UUID = ?;", (pUUID,))
+        self._conn.executemany((
+            "INSERT INTO MapTiles ("
+            "BoundWest, BoundSouth, BoundEast, BoundNorth, Area, Tile, UUID"
+            ") VALUES (?, ?, ?, ?, ?, ?, ?);"
+        ), [(*tile, number, pUUID) for number, tile in zip(numbers, tiles)])
+        return
+
+    def _setAlertParts(self, pUUID, parts, altitude, ceiling, period):
+        """Replace the part bounds of an alert in the AlertParts table.
+        The caller is responsible for committing the changes.
+        """
+        self._conn.execute("DELETE FROM AlertParts WHERE UUID = ?;", (pUUID,))
+        self._conn.executemany((
+            "INSERT INTO AlertParts ("
+            "BoundWest, BoundSouth, BoundEast, BoundNorth, Altitude, Ceiling, Onset, Expires, UUID"
+            ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?);"
+        ), [(*part, altitude, ceiling, *period, pUUID) for part in parts])
+        return
+
+    def _boundsFilter(self, inclusive):
+        """Return the SQL condition matching bounds that overlap a
+        (west, east, north, south) rectangle, or also touch it if
+        inclusive.
+        """
+        if inclusive:
+            return "? <= BoundEast AND ? >= BoundWest AND ? >= BoundSouth AND ? <= BoundNorth"
+        return "? < BoundEast AND ? > BoundWest AND ? > BoundSouth AND ? < BoundNorth"
+
+    def _verticalFilter(self, vertical):
+        """Return the SQL condition and arguments matching alerts whose
+        altitude and ceiling overlap a (min, max) range. Alerts with no
+        thickness, like surface alerts indexed as [0, 0], match a range
+        that includes their altitude.
+        """
+        zMin, zMax = (-math.inf, math.inf) if vertical is None else vertical
+        return (
+            "(? < Ceiling AND ? > Altitude OR Altitude = Ceiling AND Altitude BETWEEN ? AND ?)"
+        ), [zMin, zMax, zMin, zMax]
+
+    def _alertFilter(self, period, filters, text=None):
+        """Return the SQL conditions and arguments matching alerts in
+        effect during a (start, end) period, either end of which may be
+        None, with CAP fields in the lists of values of a filters
+        dictionary, and with all the words of a text in the area
+        description of one language. The dates are compared as Julian
+        days so that time zones are handled by SQLite.
+        """
+        conditions = ""
+        args = []
+        start, end = period or (None, None)
+        if end is not None:
+            conditions += " AND julianday(OnsetDate) <= julianday(?)"
+            args.append(end.isoformat())
+        if start is not None:
+            conditions += " AND (ExpiresDate IS NULL OR julianday(ExpiresDate) > julianday(?))"
+            args.append(start.isoformat())
+        for key, values in (filters or {}).items():
+            if key not in ALERT_FILTERS:
+                raise ValueError(f"Unknown alert filter '{key}'")
+            conditions += f" AND {ALERT_FILTERS[key]} IN ({', '.join('?'*len(values))})"
+            args += list(values)
+        if text is not None:
+            # Each word is quoted so that it is never read as an FTS5
+            # operator. A text without words matches nothing.
+            words = " ".join(f'"{word}"' for word in textTokens(text))
+            if words:
+                conditions += " AND UUID IN (SELECT UUID FROM AlertText WHERE AlertText MATCH ?)"
+                args.append(words)
+            else:
+                conditions += " AND 0"
+        return conditions, args
+
+    def _setAlertCells(self, pUUID, cells):
+        """Replace the grid cells of an alert in the AlertCells table.
+        The caller is responsible for committing the changes.
+        """
+        self._conn.execute("DELETE FROM AlertCells WHERE UUID = ?;", (pUUID,))
+        self._conn.executemany((
+            "INSERT INTO AlertCells (Cell, UUID, Area) VALUES (?, ?, ?);"
+        ), [(key, pUUID, area) for key, area in cells.items()])
+        return
+
+    def _setAlertGeocodes(self, pUUID, geocodes):
+        """Replace the geocodes of an alert in the AlertGeocodes table.
+        The caller is responsible for committing the changes.
+        """
+        self._conn.execute("DELETE FROM AlertGeocodes WHERE UUID = ?;", (pUUID,))
+        self._conn.executemany((
+            "INSERT INTO AlertGeocodes (ValueName, Value, UUID) VALUES (?, ?, ?);"
+        ), [(valueName, value, pUUID) for valueName, value in geocodes])
+        return
+
+    def _setAlertText(self, pUUID, areaDesc):
+        """Replace the area descriptions of an alert in the AlertText
+        table. The caller is responsible for committing the changes.
+        """
+        self._conn.execute("DELETE FROM AlertText WHERE UUID = ?;", (pUUID,))
+        self._conn.executemany((
+            "INSERT INTO AlertText (UUID, Language, AreaDesc) VALUES (?, ?, ?);"
+        ), [(pUUID, language, text) for language, text in areaDesc.items()])
+        return
+
     def _checkDB(self):
         """Check the structure of the database files."""
         if self._isNew:
+            self._createIndexInfoTable()
             self._createMapTable()
             self._createAlertTable()
+            self.setCellLevel(self.conf.searchGridLevel)
+            return
+
+        cursor = self._conn.execute("PRAGMA table_info('AlertData');")
+        columns = [column[1] for column in cursor.fetchall()]
+        cursor.close()
+        if columns and "Valid" not in columns:
+            logger.warning("Adding the Valid column to the alert index")
+            self._conn.execute(
+                "ALTER TABLE 'AlertData' ADD COLUMN 'Valid' INTEGER NOT NULL DEFAULT 1;\n"
+            )
+            self._conn.commit()
+        if columns and "OnsetDate" not in columns:
+            logger.warning("Adding the onset and expires columns to the alert index")
+            self._addAlertPeriod()
+        if columns and "Event" not in columns:
+            logger.warning("Adding the CAP field columns to the alert index")
+            self._addAlertFields()
+
+        cursor = self._conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+        tables = [name for name, in cursor.fetchall()]
+        cursor.close()
+        if "AlertParts" not in tables:
+            logger.warning("The alert index is outdated and must be rebuilt")
+            self._createAlertPartsTable()
+        else:
+            cursor = self._conn.execute("PRAGMA table_info('AlertParts');")
+            columns = [column[1] for column in cursor.fetchall()]
+            cursor.close()
+            if "Altitude" not in columns:
+                logger.warning("Adding altitude and ceiling to the alert parts index")
+                self._rebuildAlertParts()
+            elif "Onset" not in columns:
+                logger.warning("Adding onset and expires to the alert parts index")
+                self._rebuildAlertParts()
+        if "AlertCells" not in tables:
+            self._createAlertCellsTable()
+        if "AlertGeocodes" not in tables:
+            logger.warning("Adding the geocode table to the alert index")
+            self._createAlertGeocodesTable()
+        if "AlertText" not in tables:
+            logger.warning("Adding the text table to the alert index, which must be rebuilt")
+            self._createAlertTextTable()
+        if "MapTiles" not in tables:
+            logger.warning("Adding the tiles table to the map index")
+            self._createMapTilesTable()
+            self._conn.execute(
+                "INSERT INTO MapTiles (BoundWest, BoundEast, BoundSouth, BoundNorth, "
+                "UUID, Tile, Area) SELECT BoundWest, BoundEast, BoundSouth, BoundNorth, "
+                "UUID, -1, Area FROM MapData;"
+            )
+            self._conn.commit()
+        if "IndexInfo" not in tables:
+            self._createIndexInfoTable()
+
         return
 
+    def _createIndexInfoTable(self):
+        """Create the table of settings the index was built with. An
+        index without it has no known grid level.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        if not isinstance(self._conn, sqlite3.Connection):
+            logger.error("No database connection open")
+            return False
+
+        try:
+            self._conn.execute(
+                "CREATE TABLE 'IndexInfo' (\n"
+                "  'Key'         TEXT NOT NULL PRIMARY KEY,\n"
+                "  'Value'       TEXT\n"
+                ");\n"
+            )
+            self._conn.commit()
+
+        except Exception:
+            logException()
+            return False
+
+        return True
+
     def _createMapTable(self):
         """Create the lookup table for map regions.
 
@@ -381,6 +879,39 @@ class SQLiteDB(Database):
             logException()
             return False
 
+        return self._createMapTilesTable()
+
+    def _createMapTilesTable(self):
+        """Create the R*Tree of bounds for each tile of the map regions.
+        A region that isn't split into tiles has a single tile numbered
+        -1.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        if not isinstance(self._conn, sqlite3.Connection):
+            logger.error("No database connection open")
+            return False
+
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE 'MapTiles' USING rtree(\n"
+                "  'ID',\n"
+                "  'BoundWest', 'BoundEast',\n"
+                "  'BoundSouth', 'BoundNorth',\n"
+                "  +'UUID' TEXT,\n"
+                "  +'Tile' INTEGER,\n"
+                "  +'Area' REAL\n"
+                ");\n"
+            )
+            self._conn.commit()
+
+        except Exception:
+            logException()
+            return False
+
         return True
 
     def _createAlertTable(self):
@@ -411,9 +942,248 @@ class SQLiteDB(Database):
                 "  'Altitude'    REAL NOT NULL,\n"
                 "  'Ceiling'     REAL NOT NULL,\n"
                 "  'Area'        REAL NOT NULL,\n"
+                "  'Valid'       INTEGER NOT NULL DEFAULT 1,\n"
+                "  'OnsetDate'   TEXT NOT NULL,\n"
+                "  'ExpiresDate' TEXT,\n"
+                "  'Event'       TEXT,\n"
+                "  'Urgency'     TEXT,\n"
+                "  'Severity'    TEXT,\n"
+                "  'Certainty'   TEXT,\n"
+                "  'AwarenessLevel' INTEGER,\n"
                 "  PRIMARY KEY('ID' AUTOINCREMENT)\n"
                 ");\n"
             )
+            for column in ALERT_FILTERS.values():
+                self._conn.execute(
+                    f"CREATE INDEX 'AlertData{column}' ON 'AlertData' ('{column}');\n"
+                )
+            self._conn.commit()
+
+        except Exception:
+            logException()
+            return False
+
+        status = True
+        status &= self._createAlertPartsTable()
+        status &= self._createAlertCellsTable()
+        status &= self._createAlertGeocodesTable()
+        status &= self._createAlertTextTable()
+        return status
+
+    def _addAlertPeriod(self):
+        """Add the onset and expires columns to an AlertData table from
+        before they were added. Existing alerts start at their sent date
+        and have no end.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        try:
+            with self._conn:
+                self._conn.execute(
+                    "ALTER TABLE 'AlertData' ADD COLUMN 'OnsetDate' TEXT NOT NULL DEFAULT '';\n"
+                )
+                self._conn.execute("ALTER TABLE 'AlertData' ADD COLUMN 'ExpiresDate' TEXT;\n")
+                self._conn.execute("UPDATE AlertData SET OnsetDate = SentDate;\n")
+
+        except Exception:
+            logException()
+            return False
+
+        return True
+
+    def _addAlertFields(self):
+        """Add the indexed CAP field columns to an AlertData table from
+        before they were added. The values of existing alerts are NULL
+        until the index is rebuilt.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        try:
+            with self._conn:
+                for column in ALERT_FILTERS.values():
+                    dataType = "INTEGER" if column == "AwarenessLevel" else "TEXT"
+                    self._conn.execute(
+                        f"ALTER TABLE 'AlertData' ADD COLUMN '{column}' {dataType};\n"
+                    )
+                    self._conn.execute(
+                        f"CREATE INDEX 'AlertData{column}' ON 'AlertData' ('{column}');\n"
+                    )
+
+        except Exception:
+            logException()
+            return False
+
+        return True
+
+    def _rebuildAlertParts(self):
+        """Rebuild an AlertParts table from before the altitude, ceiling
+        and validity period were part of it, taking the values from
+        AlertData.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        try:
+            with self._conn:
+                self._conn.execute("ALTER TABLE 'AlertParts' RENAME TO 'AlertPartsOld';\n")
+                self._conn.execute(
+                    "CREATE VIRTUAL TABLE 'AlertParts' USING rtree(\n"
+                    "  'ID',\n"
+                    "  'BoundWest', 'BoundEast',\n"
+                    "  'BoundSouth', 'BoundNorth',\n"
+                    "  'Altitude', 'Ceiling',\n"
+                    "  'Onset', 'Expires',\n"
+                    "  +'UUID' TEXT\n"
+                    ");\n"
+                )
+                self._conn.execute(
+                    "INSERT INTO AlertParts (\n"
+                    "  BoundWest, BoundSouth, BoundEast, BoundNorth, Altitude, Ceiling,\n"
+                    "  Onset, Expires, UUID\n"
+                    ") SELECT\n"
+                    "  p.BoundWest, p.BoundSouth, p.BoundEast, p.BoundNorth,\n"
+                    "  d.Altitude, d.Ceiling,\n"
+                    "  (julianday(d.OnsetDate) - 2440587.5)*86400.0,\n"
+                    "  COALESCE((julianday(d.ExpiresDate) - 2440587.5)*86400.0, 9e999),\n"
+                    "  p.UUID\n"
+                    "FROM AlertPartsOld p JOIN AlertData d ON p.UUID = d.UUID;\n"
+                )
+                self._conn.execute("DROP TABLE 'AlertPartsOld';\n")
+
+        except Exception:
+            logException()
+            return False
+
+        return True
+
+    def _createAlertPartsTable(self):
+        """Create the R*Tree of bounds, altitude, ceiling and validity
+        period for each part of the alerts. The period is stored as
+        timestamps, with no end stored as infinity. An alert with a
+        single polygon has a single part.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        if not isinstance(self._conn, sqlite3.Connection):
+            logger.error("No database connection open")
+            return False
+
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE 'AlertParts' USING rtree(\n"
+                "  'ID',\n"
+                "  'BoundWest', 'BoundEast',\n"
+                "  'BoundSouth', 'BoundNorth',\n"
+                "  'Altitude', 'Ceiling',\n"
+                "  'Onset', 'Expires',\n"
+                "  +'UUID' TEXT\n"
+                ");\n"
+            )
+            self._conn.commit()
+
+        except Exception:
+            logException()
+            return False
+
+        return True
+
+    def _createAlertCellsTable(self):
+        """Create the table of the area of each alert within the grid
+        cells it overlaps.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        if not isinstance(self._conn, sqlite3.Connection):
+            logger.error("No database connection open")
+            return False
+
+        try:
+            self._conn.execute(
+                "CREATE TABLE 'AlertCells' (\n"
+                "  'Cell'        TEXT NOT NULL,\n"
+                "  'UUID'        TEXT NOT NULL,\n"
+                "  'Area'        REAL NOT NULL\n"
+                ");\n"
+            )
+            self._conn.execute("CREATE INDEX 'AlertCellsCell' ON 'AlertCells' ('Cell');\n")
+            self._conn.execute("CREATE INDEX 'AlertCellsUUID' ON 'AlertCells' ('UUID');\n")
+            self._conn.commit()
+
+        except Exception:
+            logException()
+            return False
+
+        return True
+
+    def _createAlertGeocodesTable(self):
+        """Create the table of the geocodes of the area of each alert,
+        indexed on the value name and value.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        if not isinstance(self._conn, sqlite3.Connection):
+            logger.error("No database connection open")
+            return False
+
+        try:
+            self._conn.execute(
+                "CREATE TABLE 'AlertGeocodes' (\n"
+                "  'ValueName'   TEXT NOT NULL,\n"
+                "  'Value'       TEXT NOT NULL,\n"
+                "  'UUID'        TEXT NOT NULL\n"
+                ");\n"
+            )
+            self._conn.execute(
+                "CREATE INDEX 'AlertGeocodesValue' ON 'AlertGeocodes' ('ValueName', 'Value');\n"
+            )
+            self._conn.execute("CREATE INDEX 'AlertGeocodesUUID' ON 'AlertGeocodes' ('UUID');\n")
+            self._conn.commit()
+
+        except Exception:
+            logException()
+            return False
+
+        return True
+
+    def _createAlertTextTable(self):
+        """Create the FTS5 table of the area descriptions of each alert,
+        with one row per language.
+
+        Returns
+        -------
+        bool
+            True if successful, otherwise False
+        """
+        if not isinstance(self._conn, sqlite3.Connection):
+            logger.error("No database connection open")
+            return False
+
+        try:
+            self._conn.execute(
+                "CREATE VIRTUAL TABLE 'AlertText' USING fts5(\n"
+                "  UUID UNINDEXED,\n"
+                "  Language UNINDEXED,\n"
+                "  AreaDesc,\n"
+                "  tokenize = 'unicode61 remove_diacritics 2'\n"
+                ");\n"
+            )
             self._conn.commit()
 
         except Exception:
@@ -432,6 +1202,9 @@ class SQLiteDB(Database):
             self._conn.execute(
                 "DROP TABLE 'MapData';\n"
             )
+            self._conn.execute(
+                "DROP TABLE IF EXISTS 'MapTiles';\n"
+            )
             self._conn.commit()
 
         except Exception:
@@ -450,6 +1223,18 @@ class SQLiteDB(Database):
             self._conn.execute(
                 "DROP TABLE 'AlertData';\n"
             )
+            self._conn.execute(
+                "DROP TABLE IF EXISTS 'AlertParts';\n"
+            )
+            self._conn.execute(
+                "DROP TABLE IF EXISTS 'AlertCells';\n"
+            )
+            self._conn.execute(
+                "DROP TABLE IF EXISTS 'AlertGeocodes';\n"
+            )
+            self._conn.execute(
+                "DROP TABLE IF EXISTS 'AlertText';\n"
+            )
             self._conn.commit()
 
         except Exception:
@@ -0,0 +1,121 @@
+"""
+MetAlert Search : Metrics
+=========================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import time
+import bisect
+import functools
+import threading
+
+from contextlib import contextmanager
+
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+)
+
+
+class Metrics():
+
+    def __init__(self):
+        """Latency histograms for each search stage, and counters for
+        the records handled by the searches. The values are kept in
+        memory for the lifetime of the process.
+        """
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._counters = {}
+        return
+
+    ##
+    #  Methods
+    ##
+
+    def observe(self, stage, seconds):
+        """Add a latency measurement to the histogram of a stage."""
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = [[0]*(len(LATENCY_BUCKETS) + 1), 0.0]
+            buckets = self._stages[stage][0]
+            buckets[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+            self._stages[stage][1] += seconds
+        return
+
+    def count(self, step, value=1):
+        """Increment the record counter of a search step."""
+        with self._lock:
+            self._counters[step] = self._counters.get(step, 0) + value
+        return
+
+    @contextmanager
+    def timer(self, stage):
+        """Context manager measuring the latency of a stage."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def timed(self, stage):
+        """Decorator measuring the latency of each call to a function."""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.timer(stage):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def reset(self):
+        """Clear all values."""
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+        return
+
+    def exposition(self):
+        """Return the metrics in the Prometheus text format."""
+        lines = [
+            "# HELP ma_search_stage_seconds Time spent in each search stage.",
+            "# TYPE ma_search_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, (buckets, total) in sorted(self._stages.items()):
+                cumulative = 0
+                for bound, value in zip(LATENCY_BUCKETS + ("+Inf",), buckets):
+                    cumulative += value
+                    lines.append(
+                        f'ma_search_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} '
+                        f'{cumulative}'
+                    )
+                lines.append(f'ma_search_stage_seconds_sum{{stage="{stage}"}} {total!r}')
+                lines.append(f'ma_search_stage_seconds_count{{stage="{stage}"}} {cumulative}')
+
+            lines.append(
+                "# HELP ma_search_records_total Records handled by each search step."
+            )
+            lines.append("# TYPE ma_search_records_total counter")
+            for step, value in sorted(self._counters.items()):
+                lines.append(f'ma_search_records_total{{step="{step}"}} {value}')
+
+        return "\n".join(lines) + "\n"
+
+# END Class Metrics
+
+
+METRICS = Metrics()
@@ -18,5 +18,6 @@ limitations under the License.
 """
 
 from ma_search.utils.ingest_cap import ingestCap
+from ma_search.utils.rebuild_index import rebuildIndex
 
-__all__ = ["ingestCap"]
+__all__ = ["ingestCap", "rebuildIndex"]
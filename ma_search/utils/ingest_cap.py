@@ -60,3 +60,5 @@ def ingestCap(sysArgs):
                     ingestFile(os.path.join(pathArg, fileName))
         else:
             ingestFile(pathArg)
+
+    data.flushIndex()
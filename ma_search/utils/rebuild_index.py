@@ -0,0 +1,58 @@
+import sys
+import getopt
+
+from ma_search.data import Data
+
+
+def rebuildIndex(sysArgs):
+    """Parse command line, rebuild the alert index from the saved alert
+    files and/or index the tiles of the stored map regions again
+    """
+
+    # Valid Input Options
+    shortOpt = "ham"
+    longOpt  = [
+        "help",
+        "alerts",
+        "maps",
+    ]
+
+    helpMsg = (
+        "Usage:\n"
+        " -h, --help      Print this message.\n"
+        " -a, --alerts    Rebuild the alert index from the saved alert files\n"
+        " -m, --maps      Index the tiles of all stored map regions again\n"
+    )
+
+    try:
+        inOpts, inRemain = getopt.getopt(sysArgs, shortOpt, longOpt)
+    except getopt.GetoptError as E:
+        print(helpMsg)
+        print("ERROR: %s" % str(E))
+        sys.exit(1)
+
+    doAlerts = False
+    doMaps = False
+
+    for inOpt, _ in inOpts:
+        if inOpt in ("-h", "--help"):
+            print(helpMsg)
+            sys.exit()
+        elif inOpt in ("-a", "--alerts"):
+            doAlerts = True
+        elif inOpt in ("-m", "--maps"):
+            doMaps = True
+
+    if not (doAlerts or doMaps):
+        print(helpMsg)
+        sys.exit(1)
+
+    data = Data()
+    status = True
+    if doAlerts:
+        status &= data.rebuildAlertIndex()
+    if doMaps:
+        status &= data.rebuildMapTiles()
+
+    if not status:
+        sys.exit(1)
@@ -0,0 +1,140 @@
+"""
+MetAlert Search : Vertical Index Benchmark
+==========================================
+Compare alert searches filtered on altitude and ceiling in the index
+against searches on the bounds only with the vertical range checked
+afterwards, on a synthetic archive.
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+import sys
+import time
+import uuid
+import random
+import logging
+import tempfile
+
+from datetime import datetime, timedelta
+
+import ma_search
+
+from ma_search.db.memory import MemoryDB
+from ma_search.db.sqlite import SQLiteDB
+
+logging.basicConfig(level="INFO")
+
+# Column positions of altitude and ceiling in the AlertData rows
+COL_ALTITUDE = 10
+COL_CEILING = 11
+
+# Vertical extents in metres, as (weight, altitude range, thickness range).
+# Most alerts are surface weather, the rest are aviation alerts in
+# flight level bands.
+VERTICAL_KINDS = [
+    (0.70, (0.0, 0.0), (0.0, 0.0)),
+    (0.15, (0.0, 0.0), (1000.0, 3000.0)),
+    (0.15, (300.0, 10000.0), (300.0, 3000.0)),
+]
+
+# Queries as (name, vertical range)
+QUERIES = [
+    ("surface", (0.0, 500.0)),
+    ("FL050-FL100", (1524.0, 3048.0)),
+    ("FL300-FL350", (9144.0, 10668.0)),
+]
+
+
+def populate(theDB, count, seed=42):
+    """Fill a database with random alerts over Europe."""
+    rng = random.Random(seed)
+    weights = [kind[0] for kind in VERTICAL_KINDS]
+    baseDate = datetime(2021, 1, 1)
+    for i in range(count):
+        _, (aLow, aHigh), (tLow, tHigh) = rng.choices(VERTICAL_KINDS, weights)[0]
+        altitude = rng.uniform(aLow, aHigh)
+        ceiling = altitude + rng.uniform(tLow, tHigh)
+        width = rng.uniform(0.2, 5.0)
+        height = rng.uniform(0.2, 3.0)
+        west = rng.uniform(-10.0, 30.0)
+        south = rng.uniform(35.0, 70.0)
+        theDB.editAlertRecord(
+            cmd="insert", recordUUID=str(uuid.uuid4()), identifier=f"bench{i}",
+            sentDate=baseDate + timedelta(minutes=i), sourcePath=f"bench{i}.cap.xml",
+            coordSystem="WGS84", west=west, south=south, east=west + width,
+            north=south + height, altitude=altitude, ceiling=ceiling,
+            area=width*height*1e10
+        )
+    return
+
+
+def filterVertical(rows, vertical):
+    """Apply the vertical check to rows found on the bounds only."""
+    zMin, zMax = vertical
+    matched = []
+    for r in rows:
+        altitude, ceiling = r[COL_ALTITUDE], r[COL_CEILING]
+        if altitude == ceiling:
+            if zMin <= altitude <= zMax:
+                matched.append(r)
+        elif zMin < ceiling and zMax > altitude:
+            matched.append(r)
+    return matched
+
+
+def timeQuery(func, repeat):
+    """Return the best time in milliseconds, and the result."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = (time.perf_counter() - start)*1000.0
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def runBenchmark(theDB, label, repeat):
+    """Time each query with and without the vertical index filter."""
+    print(f"\n{label}")
+    print(f"{'query':<14} {'hits':>6} {'bounds+filter':>14} {'indexed':>10}")
+    for name, vertical in QUERIES:
+        tPost, rPost = timeQuery(lambda: filterVertical(
+            theDB.searchBounds("alert", -5.0, 45.0, 20.0, 65.0), vertical
+        ), repeat)
+        tIndex, rIndex = timeQuery(lambda: theDB.searchBounds(
+            "alert", -5.0, 45.0, 20.0, 65.0, vertical=vertical
+        ), repeat)
+        assert sorted(r[1] for r in rPost) == sorted(r[1] for r in rIndex)
+        print(f"{name:<14} {len(rIndex):>6} {tPost:>11.2f} ms {tIndex:>7.2f} ms")
+    return
+
+
+if __name__ == "__main__":
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    repeat = 5
+    with tempfile.TemporaryDirectory() as tmpDir:
+        ma_search.CONFIG.sqlitePath = tmpDir
+        ma_search.CONFIG.memoryPath = None
+
+        sqliteDB = SQLiteDB()
+        sqliteDB._conn.execute("PRAGMA synchronous = OFF")
+        populate(sqliteDB, count)
+        sqliteDB._conn.commit()
+        runBenchmark(sqliteDB, f"SQLite, {count} alerts", repeat)
+        del sqliteDB
+
+        memoryDB = MemoryDB()
+        populate(memoryDB, count)
+        runBenchmark(memoryDB, f"Memory, {count} alerts", repeat)
+        del memoryDB
@@ -17,19 +17,49 @@ See the License for the specific language governing permissions and
 limitations under the License.
 """
 
+import os
 import json
+import time
+import shutil
 import pytest
+import threading
 
-from ma_search.data import Data
+from datetime import datetime, timezone
+
+from ma_search.data import Data, Shape
 from ma_search.api import app
+from ma_search.metrics import METRICS
 
 MSG_GEOJSON = (
     b"Payload must contain an object named 'polygon' cotaining a "
     b"valid geoJson Polygon or MultiPolygon\n"
 )
+MSG_GEOCODE_SHAPE = (
+    b"The 'geocode' search parameter can't be combined with a 'polygon' or a 'region'\n"
+)
 MSG_VERTICAL = b"The 'vertical' search parameter must be a list of 2 integers or floats\n"
 MSG_CUTOFF = b"The 'cutoff' search parameter must be a float in the interval (0.0, 1.0] \n"
+MSG_CUTOFF_ON = b"The 'cutoff_on' search parameter must be either 'query' or 'record'\n"
+MSG_MODE = b"The 'mode' search parameter must be one of 'exact', 'approx' or 'bbox'\n"
+MSG_APPROX = b"The 'approx' search mode is not enabled on this server\n"
+MSG_APPROX_MAP = b"The 'approx' search mode is only available for alerts\n"
+MSG_APPROX_INDEX = b"The 'approx' search mode is not available until the index is rebuilt\n"
 MSG_MAXRES = b"The 'maxres' search parameter must be an integer larger than 0\n"
+MSG_PRECISION = b"The 'precision' search parameter must be a number in the interval [0.0, 1.0)\n"
+MSG_TIMEOUT = b"The 'timeout_ms' search parameter must be an integer larger than 0\n"
+MSG_SORT = b"The 'sort' search parameter must be either 'overlap' or 'sent'\n"
+MSG_TIME = (
+    b"The 'time' search parameter must be an ISO 8601 date string, or a list of a start "
+    b"and an end date string in order, either of which may be null\n"
+)
+MSG_FILTER_MAP = b"The 'time' and CAP field search parameters are only available for alerts\n"
+MSG_TEXT = b"The 'text' search parameter must be a string with one or more words\n"
+MSG_TEXT_MAP = b"The 'text' search parameter is only available for alerts\n"
+MSG_BATCH = (
+    b"Payload must contain a list named 'polygons' of objects with a unique 'name' "
+    b"and a 'polygon' or 'region'\n"
+)
+MSG_FIELDS = b"The 'fields' search parameter must be a list of one or more of:"
 
 
 @pytest.fixture(scope="function")
@@ -189,10 +219,780 @@ def testCoreApi_SearchAlert(client, monkeypatch):
     assert result["records"] == 0
     assert result["results"] == []
 
+    # Sort : Invalid Value
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "sort": "stuff",
+    })
+    assert response.status_code == 400
+    assert response.data == MSG_SORT
+
+    # Sort : Valid
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "sort": "sent",
+    })
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert result["records"] == 0
+
+    # Fields : Wrong Data Type
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "fields": "uuid",
+    })
+    assert response.status_code == 400
+    assert response.data.startswith(MSG_FIELDS)
+
+    # Fields : Empty or Unknown
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "fields": [],
+    })
+    assert response.status_code == 400
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "fields": ["uuid", "stuff"],
+    })
+    assert response.status_code == 400
+
+    # Fields : Valid
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "fields": ["uuid", "overlap"],
+    })
+    assert response.status_code == 200
+
+    # Precision : Invalid Values
+    for precision in ["abc", -0.1, 1.0]:
+        response = client.post("/v1/search/alert", json={
+            "polygon": geoJson,
+            "precision": precision,
+        })
+        assert response.status_code == 400
+        assert response.data == MSG_PRECISION
+
+    # Precision : Valid, and the tolerance is reported
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "precision": 0,
+    })
+    assert response.status_code == 200
+    assert json.loads(response.data)["tolerance"] == 0.0
+
+    # Polygon : Invalid polygons are repaired, but file paths are not accepted
+    response = client.post("/v1/search/alert", json={
+        "polygon": {
+            "type": "Polygon",
+            "coordinates": [[[0.0, 0.0], [2.0, 2.0], [2.0, 0.0], [0.0, 2.0], [0.0, 0.0]]],
+        }
+    })
+    assert response.status_code == 200
+    response = client.post("/v1/search/alert", json={"polygon": "/etc/stuff.json"})
+    assert response.status_code == 400
+    assert response.data == MSG_GEOJSON
+
+    # Timeout : Invalid Values
+    for timeout in ["abc", 0, -5]:
+        response = client.post("/v1/search/alert", json={
+            "polygon": geoJson,
+            "timeout_ms": timeout,
+        })
+        assert response.status_code == 400
+        assert response.data == MSG_TIMEOUT
+
+    # Timeout : Valid
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "timeout_ms": 1000,
+    })
+    assert response.status_code == 200
+    assert json.loads(response.data)["partial"] is False
+
+    # Timeout : Server default
+    calls = []
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.findOverlap", lambda *a, **k: calls.append(k) or {})
+        client.post("/v1/search/alert", json={"polygon": geoJson})
+        assert calls[-1]["timeout"] is None
+        mp.setattr("ma_search.api.data.conf.searchTimeout", 250)
+        client.post("/v1/search/alert", json={"polygon": geoJson})
+        assert calls[-1]["timeout"] == 250
+        client.post("/v1/search/alert", json={"polygon": geoJson, "timeout_ms": 100})
+        assert calls[-1]["timeout"] == 100
+
+    # Cutoff On : Invalid Value
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "cutoff_on": "stuff",
+    })
+    assert response.status_code == 400
+    assert response.data == MSG_CUTOFF_ON
+
+    # Cutoff On : Valid, and passed on
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.findOverlap", lambda *a, **k: calls.append(k) or {})
+        client.post("/v1/search/alert", json={"polygon": geoJson})
+        assert calls[-1]["cutoffOn"] == "query"
+        response = client.post("/v1/search/alert", json={
+            "polygon": geoJson,
+            "cutoff_on": "record",
+        })
+        assert response.status_code == 200
+        assert calls[-1]["cutoffOn"] == "record"
+
+    # Mode : Invalid Value
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "mode": "stuff",
+    })
+    assert response.status_code == 400
+    assert response.data == MSG_MODE
+
+    # Mode : Not enabled
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson,
+        "mode": "approx",
+    })
+    assert response.status_code == 400
+    assert response.data == MSG_APPROX
+
+    # Mode : Not available until the index has been rebuilt with cells
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.conf.searchGridLevel", 8)
+        response = client.post("/v1/search/alert", json={
+            "polygon": geoJson,
+            "mode": "approx",
+        })
+        assert response.status_code == 400
+        assert response.data == MSG_APPROX_INDEX
+
+    # Mode : Valid, and only index fields for approximate searches
+    with monkeypatch.context() as mp:
+        from ma_search.api import data
+        mp.setattr("ma_search.api.data.conf.searchGridLevel", 8)
+        assert data.rebuildAlertIndex() is True
+        response = client.post("/v1/search/alert", json={
+            "polygon": geoJson,
+            "mode": "approx",
+            "fields": ["uuid", "polygon"],
+        })
+        assert response.status_code == 400
+        assert response.data.startswith(MSG_FIELDS)
+        response = client.post("/v1/search/alert", json={
+            "polygon": geoJson,
+            "mode": "approx",
+        })
+        assert response.status_code == 200
+        assert json.loads(response.data)["records"] == 0
+
+        mp.setattr("ma_search.api.data.findOverlap", lambda *a, **k: calls.append(k) or {})
+        client.post("/v1/search/alert", json={"polygon": geoJson})
+        assert calls[-1]["mode"] == "exact"
+        client.post("/v1/search/alert", json={"polygon": geoJson, "mode": "approx"})
+        assert calls[-1]["mode"] == "approx"
+
+        # Maps can't be searched approximately
+        response = client.post("/v1/search/map", json={"polygon": geoJson, "mode": "approx"})
+        assert response.status_code == 400
+        assert response.data == MSG_APPROX_MAP
+
+    # Map : Fields are checked against the map fields
+    response = client.post("/v1/search/map", json={"polygon": geoJson, "fields": ["sent"]})
+    assert response.status_code == 400
+    assert response.data.startswith(MSG_FIELDS)
+    assert b"admName" in response.data
+    response = client.post("/v1/search/map", json={
+        "polygon": geoJson, "fields": ["admName", "overlap"]
+    })
+    assert response.status_code == 200
+    assert json.loads(response.data)["records"] == 0
+
+    # Time : Invalid Values
+    for value in ["stuff", ["2021-01-01T00:00:00"], ["2021-01-02", "2021-01-01"], 5]:
+        response = client.post("/v1/search/alert", json={"polygon": geoJson, "time": value})
+        assert response.status_code == 400
+        assert response.data == MSG_TIME
+
+    # Filters : Invalid Values
+    for name, value in [
+        ("severity", "Severe"), ("severity", []), ("event", [1]),
+        ("awareness_level", ["2"]), ("awareness_level", [True]),
+    ]:
+        response = client.post("/v1/search/alert", json={"polygon": geoJson, name: value})
+        assert response.status_code == 400
+        assert response.data.startswith(f"The '{name}' search parameter".encode())
+
+    # Time and Filters : Not for maps
+    response = client.post("/v1/search/map", json={"polygon": geoJson, "time": "2021-01-01"})
+    assert response.status_code == 400
+    assert response.data == MSG_FILTER_MAP
+    response = client.post("/v1/search/map", json={"polygon": geoJson, "event": ["Kuling"]})
+    assert response.status_code == 400
+    assert response.data == MSG_FILTER_MAP
+
+    # Time and Filters : Valid, and passed on
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.findOverlap", lambda *a, **k: calls.append(k) or {})
+        client.post("/v1/search/alert", json={"polygon": geoJson})
+        assert [calls[-1][name] for name in ("period", "filters", "text")] == [None] * 3
+        response = client.post("/v1/search/alert", json={
+            "polygon": geoJson,
+            "time": "2021-01-01T12:00:00Z",
+            "severity": ["Severe", "Extreme"],
+            "awareness_level": [3, 4],
+        })
+        assert response.status_code == 200
+        start, end = calls[-1]["period"]
+        assert start == end and start.isoformat() == "2021-01-01T12:00:00+00:00"
+        assert calls[-1]["filters"] == {
+            "severity": ["Severe", "Extreme"], "awarenessLevel": [3, 4]
+        }
+        client.post("/v1/search/alert", json={"polygon": geoJson, "time": [None, "2021-01-01"]})
+        assert calls[-1]["period"][0] is None
+        assert calls[-1]["period"][1].isoformat() == "2021-01-01T00:00:00"
+
+    # Text : Invalid
+    for text in ["", " - ", 42, ["Måløy"]]:
+        response = client.post("/v1/search/alert", json={"polygon": geoJson, "text": text})
+        assert response.status_code == 400
+        assert response.data == MSG_TEXT
+    response = client.post("/v1/search/map", json={"polygon": geoJson, "text": "Måløy"})
+    assert response.status_code == 400
+    assert response.data == MSG_TEXT_MAP
+
+    # Text : Valid, and passed on
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.findOverlap", lambda *a, **k: calls.append(k) or {})
+        response = client.post("/v1/search/alert", json={"polygon": geoJson, "text": "Måløy"})
+        assert response.status_code == 200
+        assert calls[-1]["text"] == "Måløy"
+
     # Internal Server Error
     with monkeypatch.context() as mp:
-        mp.setattr("ma_search.api.data.findOverlap", lambda *a: None)
+        mp.setattr("ma_search.api.data.findOverlap", lambda *a, **k: None)
         response = client.post("/v1/search/alert", json={"polygon": geoJson})
         assert response.status_code == 500
 
 # END Test testCoreApi_SearchAlert
+
+
+@pytest.mark.core
+def testCoreApi_SearchAlertStream(client, fncDir, filesDir, monkeypatch):
+    """Test search/alert with a streamed response."""
+    dirsOne = os.path.join(fncDir, "alert_6", "alert_d")
+    dirsTwo = os.path.join(fncDir, "alert_4", "alert_f")
+    os.makedirs(dirsOne)
+    os.makedirs(dirsTwo)
+    fileOne = "957773d6-bc0d-5a72-be5e-27801d28e82b.json"
+    fileTwo = "a35e85f4-b0d1-5b1f-9db0-79007f49be07.json"
+    shutil.copyfile(
+        os.path.join(filesDir, "test_archive", fileOne), os.path.join(dirsOne, fileOne)
+    )
+    shutil.copyfile(
+        os.path.join(filesDir, "test_archive", fileTwo), os.path.join(dirsTwo, fileTwo)
+    )
+    from ma_search.api import data
+    assert data.rebuildAlertIndex() is True
+
+    geoJson = {
+        "type": "Polygon",
+        "coordinates": [
+            [[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5], [0.5, 0.5]]
+        ]
+    }
+    ndJson = {"Accept": "application/x-ndjson"}
+
+    # Regular JSON is still the default
+    response = client.post("/v1/search/alert", json={"polygon": geoJson})
+    assert response.status_code == 200
+    assert response.mimetype == "application/json"
+    assert json.loads(response.data)["records"] == 2
+
+    # Streamed
+    response = client.post("/v1/search/alert", json={"polygon": geoJson}, headers=ndJson)
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = response.data.decode("utf-8").splitlines()
+    assert len(lines) == 3
+    for line in lines[:2]:
+        assert json.loads(line)["overlap"] == pytest.approx(0.25, rel=1e-3)
+    assert json.loads(lines[2]) == {"records": 2, "partial": False, "tolerance": 0.0}
+
+    response = client.post(
+        "/v1/search/alert", json={"polygon": geoJson, "maxres": 1}, headers=ndJson
+    )
+    lines = response.data.decode("utf-8").splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1])["records"] == 1
+    assert response.headers["X-Estimate"] == "false"
+
+    # The trailer reports a search that ran out of time
+    with monkeypatch.context() as mp:
+        mp.setattr(
+            "ma_search.data.data.Data._pastDeadline",
+            staticmethod(lambda deadline, status: status.update(partial=True) or True),
+        )
+        response = client.post(
+            "/v1/search/alert", json={"polygon": geoJson, "timeout_ms": 100}, headers=ndJson
+        )
+    lines = response.data.decode("utf-8").splitlines()
+    assert json.loads(lines[-1]) == {"records": len(lines) - 1, "partial": True, "tolerance": 0.0}
+
+    # Bounding box estimates
+    response = client.post("/v1/search/alert", json={"polygon": geoJson, "mode": "bbox"})
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert result["estimate"] is True
+    assert result["records"] == 2
+    assert "areaDesc" not in result["results"][0]
+
+    response = client.post(
+        "/v1/search/alert", json={"polygon": geoJson, "mode": "bbox"}, headers=ndJson
+    )
+    assert response.headers["X-Estimate"] == "true"
+    assert len(response.data.decode("utf-8").splitlines()) == 3
+
+    response = client.post("/v1/search/alert", json={
+        "polygon": geoJson, "mode": "bbox", "fields": ["areaDesc"]
+    })
+    assert response.status_code == 400
+
+    # Internal Server Error
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.iterOverlap", lambda *a, **k: None)
+        response = client.post("/v1/search/alert", json={"polygon": geoJson}, headers=ndJson)
+        assert response.status_code == 500
+
+# END Test testCoreApi_SearchAlertStream
+
+
+@pytest.mark.core
+def testCoreApi_SearchAlertBatch(client, fncDir, filesDir, monkeypatch):
+    """Test search/alert/batch endpoint."""
+    dirsOne = os.path.join(fncDir, "alert_6", "alert_d")
+    os.makedirs(dirsOne)
+    fileOne = "957773d6-bc0d-5a72-be5e-27801d28e82b.json"
+    shutil.copyfile(
+        os.path.join(filesDir, "test_archive", fileOne), os.path.join(dirsOne, fileOne)
+    )
+    from ma_search.api import data
+    assert data.rebuildAlertIndex() is True
+
+    geoOne = {
+        "type": "Polygon",
+        "coordinates": [
+            [[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5], [0.5, 0.5]]
+        ]
+    }
+    geoTwo = {
+        "type": "Polygon",
+        "coordinates": [
+            [[5.0, 5.0], [6.0, 5.0], [6.0, 6.0], [5.0, 6.0], [5.0, 5.0]]
+        ]
+    }
+
+    # Invalid target and payload
+    assert client.post("/v1/search/whatever/batch", json={}).status_code == 404
+    response = client.post("/v1/search/alert/batch")
+    assert response.status_code == 400
+    assert response.data == b"Could not parse JSON payload\n"
+
+    # Invalid polygon lists
+    for polygons in [
+        None, [], "stuff", ["stuff"], [{"polygon": geoOne}],
+        [{"name": "a", "polygon": geoOne}, {"name": "a", "polygon": geoTwo}],
+    ]:
+        response = client.post("/v1/search/alert/batch", json={"polygons": polygons})
+        assert response.status_code == 400
+        assert response.data == MSG_BATCH
+
+    response = client.post("/v1/search/alert/batch", json={
+        "polygons": [{"name": "a", "polygon": {}}],
+    })
+    assert response.status_code == 400
+    assert response.data.startswith(b"Polygon 'a' is not a valid geoJson")
+
+    # The shared search parameters are checked
+    response = client.post("/v1/search/alert/batch", json={
+        "polygons": [{"name": "a", "polygon": geoOne}],
+        "sort": "stuff",
+    })
+    assert response.status_code == 400
+    assert response.data == MSG_SORT
+
+    # Valid
+    response = client.post("/v1/search/alert/batch", json={
+        "polygons": [{"name": "a", "polygon": geoOne}, {"name": "b", "polygon": geoTwo}],
+        "fields": ["uuid", "overlap"],
+    })
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert result["maxres"] == 1000
+    assert result["results"]["a"]["records"] == 1
+    assert result["results"]["a"]["results"][0] == {
+        "uuid": "957773d6-bc0d-5a72-be5e-27801d28e82b", "overlap": pytest.approx(0.25, rel=1e-3)
+    }
+    assert result["results"]["b"] == {"records": 0, "results": [], "tolerance": 0.0}
+
+    # Internal Server Error
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.findOverlapBatch", lambda *a, **k: None)
+        response = client.post("/v1/search/alert/batch", json={
+            "polygons": [{"name": "a", "polygon": geoOne}],
+        })
+        assert response.status_code == 500
+
+# END Test testCoreApi_SearchAlertBatch
+
+
+@pytest.mark.core
+def testCoreApi_SearchAlertRegion(client, fncDir, filesDir):
+    """Test search/alert with a stored map region."""
+    dirsOne = os.path.join(fncDir, "alert_6", "alert_d")
+    os.makedirs(dirsOne)
+    fileOne = "957773d6-bc0d-5a72-be5e-27801d28e82b.json"
+    shutil.copyfile(
+        os.path.join(filesDir, "test_archive", fileOne), os.path.join(dirsOne, fileOne)
+    )
+    from ma_search.api import data
+    assert data.rebuildAlertIndex() is True
+
+    region = Shape.fromGeoJSON({
+        "type": "Polygon",
+        "coordinates": [
+            [[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5], [0.5, 0.5]]
+        ]
+    })
+    assert data._db.editMapRecord(
+        cmd="insert", recordUUID=region._uuid, label="Kommune", source="test",
+        coordSystem="WGS84", west=0.5, south=0.5, east=1.5, north=1.5, area=1.0,
+        meta={"admName": "Oslo", "admID": "0301"}
+    ) is True
+
+    # Unknown region
+    response = client.post("/v1/search/alert", json={"region": "5001"})
+    assert response.status_code == 404
+    assert response.data == b"No such region '5001'\n"
+
+    # By UUID and by administrative ID
+    for key in (region._uuid, "0301"):
+        response = client.post("/v1/search/alert", json={"region": key})
+        assert response.status_code == 200
+        result = json.loads(response.data)
+        assert result["records"] == 1
+        assert result["results"][0]["overlap"] == pytest.approx(0.25, rel=1e-3)
+
+    # Batch
+    response = client.post("/v1/search/alert/batch", json={
+        "polygons": [{"name": "a", "region": "0301"}, {"name": "b", "region": "5001"}],
+    })
+    assert response.status_code == 404
+
+    response = client.post("/v1/search/alert/batch", json={
+        "polygons": [{"name": "a", "region": "0301"}],
+    })
+    assert response.status_code == 200
+    assert json.loads(response.data)["results"]["a"]["records"] == 1
+
+# END Test testCoreApi_SearchAlertRegion
+
+
+@pytest.mark.core
+def testCoreApi_PointAlert(client, fncDir, filesDir, monkeypatch):
+    """Test point/alert endpoint."""
+    dirsOne = os.path.join(fncDir, "alert_6", "alert_d")
+    os.makedirs(dirsOne)
+    fileOne = "957773d6-bc0d-5a72-be5e-27801d28e82b.json"
+    shutil.copyfile(
+        os.path.join(filesDir, "test_archive", fileOne), os.path.join(dirsOne, fileOne)
+    )
+    from ma_search.api import data
+    assert data.rebuildAlertIndex() is True
+
+    # Invalid target and payload
+    assert client.post("/v1/point/whatever", json={}).status_code == 404
+    response = client.post("/v1/point/alert")
+    assert response.status_code == 400
+    assert response.data == b"Could not parse JSON payload\n"
+
+    # Invalid points
+    for payload in [
+        {}, {"point": "stuff"}, {"point": [1.0]}, {"point": ["1", "2"]},
+        {"point": [200.0, 1.0]}, {"point": [1.0, 100.0]}, {"points": []},
+        {"points": [[1.0, 1.0], [1.0]]},
+    ]:
+        response = client.post("/v1/point/alert", json=payload)
+        assert response.status_code == 400
+        assert response.data.startswith(b"Payload must contain either a 'point'")
+
+    # Invalid parameters
+    response = client.post("/v1/point/alert", json={"point": [1.0, 1.0], "vertical": "a"})
+    assert response.status_code == 400
+    assert response.data == MSG_VERTICAL
+    for fields in ["uuid", [], ["overlap"]]:
+        response = client.post("/v1/point/alert", json={"point": [1.0, 1.0], "fields": fields})
+        assert response.status_code == 400
+        assert response.data.startswith(MSG_FIELDS)
+
+    # Single point
+    response = client.post("/v1/point/alert", json={"point": [1.5, 1.5], "fields": ["uuid"]})
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        "records": 1, "results": [{"uuid": "957773d6-bc0d-5a72-be5e-27801d28e82b"}]
+    }
+
+    # Bulk
+    response = client.post("/v1/point/alert", json={"points": [[1.5, 1.5], [5.0, 5.0]]})
+    assert response.status_code == 200
+    result = json.loads(response.data)
+    assert [r["records"] for r in result["results"]] == [1, 0]
+
+    # Map regions have their own fields
+    for fields in [["identifier"], ["overlap"]]:
+        response = client.post("/v1/point/map", json={"point": [1.0, 1.0], "fields": fields})
+        assert response.status_code == 400
+        assert response.data.startswith(MSG_FIELDS)
+        assert b"admName" in response.data
+    response = client.post("/v1/point/map", json={"point": [1.5, 1.5], "fields": ["admID"]})
+    assert response.status_code == 200
+    assert json.loads(response.data) == {"records": 0, "results": []}
+
+    # Internal Server Error
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.findPoints", lambda *a: None)
+        response = client.post("/v1/point/alert", json={"point": [1.0, 1.0]})
+        assert response.status_code == 500
+
+# END Test testCoreApi_PointAlert
+
+
+@pytest.mark.core
+def testCoreApi_SearchAlertGeocode(client, filesDir, monkeypatch):
+    """Test search/alert endpoint with geocodes."""
+    from ma_search.api import data
+    capFile = os.path.join(filesDir, "METfare-20210921T070421.cap.xml")
+    assert data.ingestAlertFile(capFile) is True
+
+    # Invalid target and geocodes
+    response = client.post("/v1/search/map", json={"geocode": {"emma_id": "NO809"}})
+    assert response.status_code == 400
+    assert response.data == b"The 'geocode' search parameter is only available for alerts\n"
+    for geocode in ["NO809", {}, {"emma_id": []}, {"emma_id": 809}, {"emma_id": ["NO1", 2]}]:
+        response = client.post("/v1/search/alert", json={"geocode": geocode})
+        assert response.status_code == 400
+        assert response.data.startswith(b"The 'geocode' search parameter must be")
+
+    # Geocodes can't be combined with a polygon or a region
+    geocode = {"emma_id": ["NO808"]}
+    for payload in [{"polygon": {"type": "Polygon", "coordinates": []}}, {"region": "mock"}]:
+        response = client.post("/v1/search/alert", json={"geocode": geocode, **payload})
+        assert response.status_code == 400
+        assert response.data == MSG_GEOCODE_SHAPE
+
+    # Invalid parameters
+    for payload, message in [
+        ({"vertical": "a"}, MSG_VERTICAL), ({"maxres": 0}, MSG_MAXRES),
+        ({"time": "stuff"}, MSG_TIME), ({"fields": ["overlap"]}, MSG_FIELDS),
+    ]:
+        response = client.post("/v1/search/alert", json={"geocode": geocode, **payload})
+        assert response.status_code == 400
+        assert response.data.startswith(message)
+    response = client.post("/v1/search/alert", json={"geocode": geocode, "severity": "Severe"})
+    assert response.status_code == 400
+
+    # Valid, without a polygon
+    response = client.post("/v1/search/alert", json={
+        "geocode": {"emma_id": "NO808", "kommune": ["0301"]},
+        "fields": ["identifier", "awarenessLevel"],
+        "time": ["2021-09-21T00:00:00Z", None],
+        "event": ["Kuling"],
+    })
+    assert response.status_code == 200
+    assert json.loads(response.data) == {
+        "records": 1, "maxres": 1000, "results": [{
+            "identifier": "2.49.0.1.578.0.210921070421906.1705", "awarenessLevel": 2
+        }]
+    }
+    response = client.post("/v1/search/alert", json={"geocode": {"emma_id": "NO999"}})
+    assert response.status_code == 200
+    assert json.loads(response.data)["records"] == 0
+
+    # Valid, as newline delimited JSON
+    response = client.post(
+        "/v1/search/alert", json={"geocode": geocode, "fields": ["identifier"]},
+        headers={"Accept": "application/x-ndjson"},
+    )
+    assert response.status_code == 200
+    assert response.mimetype == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.data.decode().splitlines()]
+    assert lines == [
+        {"identifier": "2.49.0.1.578.0.210921070421906.1705"},
+        {"records": 1, "partial": False, "maxres": 1000},
+    ]
+
+    # Valid, with a text
+    response = client.post("/v1/search/alert", json={"geocode": geocode, "text": "maaloey"})
+    assert response.status_code == 200
+    assert json.loads(response.data)["records"] == 1
+    response = client.post("/v1/search/alert", json={"geocode": geocode, "text": "Florø"})
+    assert response.status_code == 200
+    assert json.loads(response.data)["records"] == 0
+    response = client.post("/v1/search/alert", json={"geocode": geocode, "text": ""})
+    assert response.status_code == 400
+    assert response.data == MSG_TEXT
+
+    # Internal Server Error
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.findGeocodes", lambda *a: None)
+        response = client.post("/v1/search/alert", json={"geocode": geocode})
+        assert response.status_code == 500
+
+# END Test testCoreApi_SearchAlertGeocode
+
+
+@pytest.mark.core
+def testCoreApi_Metrics(client, fncDir, filesDir, monkeypatch):
+    """Test the metrics endpoint."""
+    dirsOne = os.path.join(fncDir, "alert_6", "alert_d")
+    os.makedirs(dirsOne)
+    fileOne = "957773d6-bc0d-5a72-be5e-27801d28e82b.json"
+    shutil.copyfile(
+        os.path.join(filesDir, "test_archive", fileOne), os.path.join(dirsOne, fileOne)
+    )
+    from ma_search.api import data
+    assert data.rebuildAlertIndex() is True
+
+    # The polygon is not used elsewhere, so it isn't in the normalisation cache
+    METRICS.reset()
+    response = client.post("/v1/search/alert", json={"polygon": {
+        "type": "Polygon",
+        "coordinates": [
+            [[0.5, 0.5], [1.6, 0.5], [1.6, 1.6], [0.5, 1.6], [0.5, 0.5]]
+        ]
+    }})
+    assert response.status_code == 200
+
+    assert client.post("/metrics").status_code == 405
+    response = client.get("/metrics")
+    assert response.status_code == 200
+    assert response.mimetype == "text/plain"
+    lines = response.data.decode("utf-8").splitlines()
+    for stage in ("request", "normalise", "index", "candidates", "search", "load", "parse",
+                  "intersection", "serialise"):
+        assert f'ma_search_stage_seconds_count{{stage="{stage}"}} 1' in lines
+    assert 'ma_search_records_total{step="candidates"} 1' in lines
+    assert 'ma_search_records_total{step="loaded"} 1' in lines
+    assert 'ma_search_records_total{step="matched"} 1' in lines
+    assert 'ma_search_records_total{step="pruned"} 0' in lines
+
+    # Batch and point requests are timed too
+    METRICS.reset()
+    response = client.post("/v1/search/alert/batch", json={"polygons": [{
+        "name": "a", "polygon": {
+            "type": "Polygon",
+            "coordinates": [[[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5], [0.5, 0.5]]],
+        },
+    }]})
+    assert response.status_code == 200
+    response = client.post("/v1/point/alert", json={"point": [1.5, 1.5]})
+    assert response.status_code == 200
+    lines = client.get("/metrics").data.decode("utf-8").splitlines()
+    assert 'ma_search_stage_seconds_count{stage="request"} 2' in lines
+
+    # Streamed requests are timed until the body has been sent
+    def slowRecords(*args, **kwargs):
+        yield {"uuid": "a"}
+        time.sleep(0.2)
+        yield {"uuid": "b"}
+
+    METRICS.reset()
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.api.data.iterOverlap", slowRecords)
+        response = client.post("/v1/search/alert", json={"polygon": {
+            "type": "Polygon",
+            "coordinates": [[[0.5, 0.5], [1.5, 0.5], [1.5, 1.5], [0.5, 1.5], [0.5, 0.5]]],
+        }}, headers={"Accept": "application/x-ndjson"})
+        assert len(response.data.decode("utf-8").splitlines()) == 3
+        response.close()
+    buckets, total = METRICS._stages["request"]
+    assert sum(buckets) == 1
+    assert total >= 0.2
+
+# END Test testCoreApi_Metrics
+
+
+@pytest.mark.core
+def testCoreApi_Ready(client, tmpConf, monkeypatch):
+    """Test the warm-up and the ready endpoint."""
+    import ma_search.api
+
+    assert client.get("/v1/ready").status_code == 200
+
+    # Warm-up disabled
+    tmpConf.warmupEnabled = False
+    assert ma_search.api.startWarmUp() is None
+    assert client.get("/v1/ready").status_code == 200
+
+    # Not ready until the warm-up has completed
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def mockWarmUp(self, alertDays, loadMaps):
+        calls.append((alertDays, loadMaps))
+        started.set()
+        release.wait(5.0)
+        return False
+
+    tmpConf.warmupEnabled = True
+    tmpConf.warmupAlertDays = 3
+    tmpConf.warmupMaps = True
+    monkeypatch.setattr(Data, "warmUp", mockWarmUp)
+    thread = ma_search.api.startWarmUp()
+    assert started.wait(5.0)
+    response = client.get("/v1/ready")
+    assert response.status_code == 503
+    assert response.data == b"Warming up\n"
+
+    # Ready also if the warm-up fails
+    release.set()
+    thread.join(5.0)
+    response = client.get("/v1/ready")
+    assert response.status_code == 200
+    assert response.data == b"Ready\n"
+    assert calls == [(3, True)]
+
+# END Test testCoreApi_Ready
+
+
+@pytest.mark.core
+def testCoreApi_WarmUpThread(client, tmpConf, fncDir, monkeypatch):
+    """Test the warm-up thread against an SQLite index."""
+    import ma_search.api
+    from ma_search.api import data
+
+    monkeypatch.setattr("ma_search.data.data._alertCache", {})
+    recent = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    testCap = os.path.join(fncDir, "mockRecent.cap.xml")
+    with open(testCap, mode="w", encoding="utf-8") as outFile:
+        outFile.write(
+            "<alert><identifier>mockRecent</identifier>"
+            f"<sent>{recent}</sent>"
+            "<info><area><polygon>0,0 0,2 2,2 2,0 0,0</polygon></area></info>"
+            "</alert>"
+        )
+    assert data.ingestAlertFile(testCap) is True
+
+    tmpConf.warmupEnabled = True
+    tmpConf.warmupAlertDays = 7
+    tmpConf.warmupMaps = True
+    thread = ma_search.api.startWarmUp()
+    thread.join(10.0)
+    assert client.get("/v1/ready").status_code == 200
+
+    cache = ma_search.data.data._alertCache
+    assert len(cache) == 1
+    assert list(cache.values())[0]["data"]["identifier"] == "mockRecent"
+
+# END Test testCoreApi_WarmUpThread
@@ -25,8 +25,9 @@ import datetime
 from tools import readFile, writeFile, causeOSError
 
 from ma_search.common import (
-    checkFloat, preparePath, safeMakeDir, safeMakeDirs, safeWriteString,
-    safeWriteJson, safeLoadString, safeLoadJson, checkUUID, parseDateString
+    checkFloat, checkInt, preparePath, safeMakeDir, safeMakeDirs, safeWriteString,
+    safeWriteJson, safeLoadString, safeLoadJson, checkUUID, parseDateString,
+    dateToTimestamp, textTokens
 )
 
 
@@ -43,6 +44,19 @@ def testCoreCommon_CheckFloat():
 # END Test testCoreCommon_CheckFloat
 
 
+@pytest.mark.core
+def testCoreCommon_CheckInt():
+    """Test the checkInt function."""
+    assert checkInt(None, 3, True) is None
+    assert checkInt("None", 3, True) is None
+    assert checkInt(None, 3, False) == 3
+    assert checkInt("2", 3, False) == 2
+    assert checkInt(" 2 ", 3, False) == 2
+    assert checkInt("yellow", 3, False) == 3
+
+# END Test testCoreCommon_CheckInt
+
+
 @pytest.mark.core
 def testCoreCommon_PreparePath(fncDir, monkeypatch):
     """Test the preparePath function."""
@@ -258,3 +272,32 @@ def testCoreCommon_ParseDateString():
     assert dtObj == datetime.datetime(2021, 9, 21, 7, 4, 21, tzinfo=datetime.timezone.utc)
 
 # END Test testCoreCommon_ParseDateString
+
+
+@pytest.mark.core
+def testCoreCommon_DateToTimestamp():
+    """Test the dateToTimestamp function."""
+    assert dateToTimestamp(None) is None
+
+    utc = datetime.timezone.utc
+    assert dateToTimestamp(datetime.datetime(1970, 1, 2, tzinfo=utc)) == 86400.0
+    assert dateToTimestamp(datetime.datetime(1970, 1, 2)) == 86400.0
+
+    cet = datetime.timezone(datetime.timedelta(hours=1))
+    assert dateToTimestamp(datetime.datetime(1970, 1, 2, 1, tzinfo=cet)) == 86400.0
+
+# END Test testCoreCommon_DateToTimestamp
+
+
+@pytest.mark.core
+def testCoreCommon_TextTokens():
+    """Test the textTokens function."""
+    assert textTokens(None) == []
+    assert textTokens(123) == []
+    assert textTokens("") == []
+    assert textTokens(" - , ") == []
+    assert textTokens("Måløy - Svinøy") == ["maløy", "svinøy"]
+    assert textTokens("Sogn_og FJORDANE, Ærø") == ["sogn", "og", "fjordane", "ærø"]
+    assert textTokens("Côte-d'Or 3.5km") == ["cote", "d", "or", "3", "5km"]
+
+# END Test testCoreCommon_TextTokens
@@ -105,4 +105,54 @@ def testCoreConfig_Validate(tmpDir, caplog):
     theConf.sqlitePath = tmpDir
     assert theConf._validateConfig() is True
 
+    # Memory Settings
+    theConf.dbProvider = "memory"
+
+    # Wrong type
+    caplog.clear()
+    theConf.memoryPath = None
+    assert theConf._validateConfig() is False
+    assert "Setting 'memoryPath' must be a string" in caplog.text
+
+    # Folder exists (the file does not need to exist)
+    theConf.memoryPath = tmpDir
+    assert theConf._validateConfig() is True
+
+    # Search Settings
+    caplog.clear()
+    theConf.searchTimeout = -1
+    assert theConf._validateConfig() is False
+    assert "Setting 'timeoutMS' must be an integer larger than 0 or null" in caplog.text
+    assert theConf.searchTimeout is None
+
+    theConf.searchTimeout = 500
+    assert theConf._validateConfig() is True
+
+    caplog.clear()
+    theConf.searchGridLevel = 13
+    assert theConf._validateConfig() is False
+    assert "Setting 'gridLevel' must be an integer from 1 to 12 or null" in caplog.text
+    assert theConf.searchGridLevel is None
+
+    theConf.searchGridLevel = 10
+    assert theConf._validateConfig() is True
+
+    # Warm-up Settings
+    caplog.clear()
+    theConf.warmupEnabled = "yes"
+    theConf.warmupAlertDays = -1
+    theConf.warmupMaps = None
+    assert theConf._validateConfig() is False
+    assert "Setting 'enabled' under 'warmup' must be a boolean" in caplog.text
+    assert "Setting 'alertDays' must be an integer of 0 or larger, or null" in caplog.text
+    assert "Setting 'maps' under 'warmup' must be a boolean" in caplog.text
+    assert theConf.warmupEnabled is False
+    assert theConf.warmupAlertDays is None
+    assert theConf.warmupMaps is False
+
+    theConf.warmupEnabled = True
+    theConf.warmupAlertDays = 7
+    theConf.warmupMaps = True
+    assert theConf._validateConfig() is True
+
 # END Test testCoreConfig_Validate
@@ -103,4 +103,12 @@ def testCoreInit_Maintenance(filesDir, tmpConf, fncDir):
         maintenance(["ingest_cap"])
     maintenance(["filename", "ingest_cap", filesDir])
 
+    with pytest.raises(SystemExit):
+        maintenance(["filename", "rebuild_index"])
+    with pytest.raises(SystemExit):
+        maintenance(["filename", "rebuild_index", "--maps"])
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+    maintenance(["filename", "rebuild_index", "--alerts", "--maps"])
+
 # END Test testCoreInit_Maintenance
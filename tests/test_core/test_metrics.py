@@ -0,0 +1,78 @@
+"""
+MetAlert Search : Metrics Tests
+===============================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import pytest
+
+from ma_search.metrics import Metrics
+
+
+@pytest.mark.core
+def testCoreMetrics_Exposition(monkeypatch):
+    """Test collecting and formatting metrics."""
+    metrics = Metrics()
+
+    # Nothing collected
+    assert metrics.exposition() == (
+        "# HELP ma_search_stage_seconds Time spent in each search stage.\n"
+        "# TYPE ma_search_stage_seconds histogram\n"
+        "# HELP ma_search_records_total Records handled by each search step.\n"
+        "# TYPE ma_search_records_total counter\n"
+    )
+
+    # Histogram buckets are cumulative, and include their upper bound
+    metrics.observe("index", 0.0002)
+    metrics.observe("index", 0.001)
+    metrics.observe("index", 0.03)
+    metrics.observe("index", 20.0)
+    metrics.count("loaded")
+    metrics.count("loaded", 4)
+    metrics.count("candidates", 2)
+
+    lines = metrics.exposition().splitlines()
+    assert 'ma_search_stage_seconds_bucket{stage="index",le="0.0005"} 1' in lines
+    assert 'ma_search_stage_seconds_bucket{stage="index",le="0.001"} 2' in lines
+    assert 'ma_search_stage_seconds_bucket{stage="index",le="0.025"} 2' in lines
+    assert 'ma_search_stage_seconds_bucket{stage="index",le="0.05"} 3' in lines
+    assert 'ma_search_stage_seconds_bucket{stage="index",le="10.0"} 3' in lines
+    assert 'ma_search_stage_seconds_bucket{stage="index",le="+Inf"} 4' in lines
+    assert 'ma_search_stage_seconds_sum{stage="index"} 20.0312' in lines
+    assert 'ma_search_stage_seconds_count{stage="index"} 4' in lines
+    assert 'ma_search_records_total{step="candidates"} 2' in lines
+    assert 'ma_search_records_total{step="loaded"} 5' in lines
+
+    # Timers
+    clock = iter([1.0, 1.5, 2.0, 4.0])
+    monkeypatch.setattr("ma_search.metrics.time.perf_counter", lambda: next(clock))
+    with metrics.timer("load"):
+        pass
+
+    @metrics.timed("request")
+    def request(value):
+        return value
+
+    assert request(42) == 42
+    lines = metrics.exposition().splitlines()
+    assert 'ma_search_stage_seconds_sum{stage="load"} 0.5' in lines
+    assert 'ma_search_stage_seconds_sum{stage="request"} 2.0' in lines
+
+    # Reset
+    metrics.reset()
+    assert "index" not in metrics.exposition()
+
+# END Test testCoreMetrics_Exposition
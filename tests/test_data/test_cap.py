@@ -39,6 +39,13 @@ def testDataCap_Init(filesDir):
     assert isinstance(cap._captree, lxml.etree._ElementTree)
     assert cap["identifier"] == "2.49.0.1.578.0.210921070421906.1705"
     assert cap["WrongName"] is None
+    assert cap["onset"] == "2021-09-21T06:00:00+00:00"
+    assert cap["expires"] == "2021-09-22T10:00:00+00:00"
+    assert cap["event"] == "Kuling"
+    assert cap["urgency"] == "Future"
+    assert cap["severity"] == "Moderate"
+    assert cap["certainty"] == "Likely"
+    assert cap["awarenessLevel"] == 2
 
 # END Test testDataCap_Init
 
@@ -74,6 +81,11 @@ def testDataCap_ParseInfo(filesDir):
     assert cap["areaDesc"] == {"en": "Area1"}
     assert cap["altitude"] is None
     assert cap["ceiling"] is None
+    assert cap["onset"] is None
+    assert cap["expires"] is None
+    assert cap["event"] is None
+    assert cap["severity"] is None
+    assert cap["awarenessLevel"] is None
 
 # END Test testDataCap_ParseInfo
 
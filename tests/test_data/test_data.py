@@ -19,13 +19,22 @@ limitations under the License.
 
 import os
 import json
+import math
+import uuid
 import shutil
+import threading
 import pytest
+import ma_search
 import shapely.geometry
 
+from datetime import datetime, timezone
+from collections import OrderedDict
+
 from tools import writeFile, causeOSError
 
-from ma_search.data import Data
+from ma_search.db import MemoryDB
+from ma_search.data import Data, SearchShape, Shape
+from ma_search.data.data import RECORD_FIELDS
 
 
 @pytest.mark.data
@@ -81,13 +90,13 @@ def testDataData_FindOverlap(tmpConf, fncDir, filesDir):
     assert result["records"] == 2
     assert len(result["results"]) == 2
 
-    assert result["results"][0]["overlap"] == 0.25
+    assert result["results"][0]["overlap"] == pytest.approx(0.25, rel=1e-3)
     assert result["results"][0]["bounds"]["east"] == 2.0
     assert result["results"][0]["bounds"]["west"] == 1.0
     assert result["results"][0]["bounds"]["north"] == 2.0
     assert result["results"][0]["bounds"]["south"] == 1.0
 
-    assert result["results"][1]["overlap"] == 0.25
+    assert result["results"][1]["overlap"] == pytest.approx(0.25, rel=1e-3)
     assert result["results"][0]["bounds"]["east"] == 2.0
     assert result["results"][0]["bounds"]["west"] == 1.0
     assert result["results"][0]["bounds"]["north"] == 2.0
@@ -99,7 +108,7 @@ def testDataData_FindOverlap(tmpConf, fncDir, filesDir):
     assert result["maxres"] == 1
     assert result["records"] == 1
     assert len(result["results"]) == 1
-    assert result["results"][0]["overlap"] == 0.25
+    assert result["results"][0]["overlap"] == pytest.approx(0.25, rel=1e-3)
 
     # Vertical Range
     result = data.findOverlap("alert", shape, vertical=(-1.0, 0.8))
@@ -107,7 +116,7 @@ def testDataData_FindOverlap(tmpConf, fncDir, filesDir):
     assert result["maxres"] == 1000
     assert result["records"] == 1
     assert len(result["results"]) == 1
-    assert result["results"][0]["overlap"] == 0.25
+    assert result["results"][0]["overlap"] == pytest.approx(0.25, rel=1e-3)
     assert result["results"][0]["altitude"] == 0.0
     assert result["results"][0]["ceiling"] == 1.0
 
@@ -121,6 +130,1133 @@ def testDataData_FindOverlap(tmpConf, fncDir, filesDir):
 # END Test testDataData_FindOverlap
 
 
+@pytest.mark.data
+def testDataData_FindOverlapRanking(monkeypatch, tmpConf, fncDir):
+    """Test ranking of overlap search results."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+
+    # Three alerts covering 100%, 50% and 25% of the search polygon,
+    # with the smallest overlap being the most recent
+    for name, sent, polygon in [
+        ("mockFull", "2021-09-01T12:00:00Z", "0,0 0,2 2,2 2,0 0,0"),
+        ("mockHalf", "2021-09-02T12:00:00Z", "0,0 0,1 2,1 2,0 0,0"),
+        ("mockQuarter", "2021-09-03T12:00:00Z", "0,0 0,1 1,1 1,0 0,0"),
+    ]:
+        testCap = os.path.join(fncDir, f"{name}.cap.xml")
+        writeFile(testCap, (
+            "<alert>"
+            f"<identifier>{name}</identifier>"
+            f"<sent>{sent}</sent>"
+            "<info><area>"
+            f"<polygon>{polygon}</polygon>"
+            "<altitude>0</altitude>"
+            "<ceiling>1</ceiling>"
+            "</area></info>"
+            "</alert>"
+        ))
+        assert data.ingestAlertFile(testCap) is True
+
+    shape = shapely.geometry.box(0.0, 0.0, 2.0, 2.0)
+
+    # Invalid parameters
+    assert data.findOverlap("alert", shape, sort="stuff") is None
+    assert data.findOverlap("alert", shapely.geometry.Polygon()) is None
+
+    # Ranked by overlap
+    result = data.findOverlap("alert", shape)
+    assert result["records"] == 3
+    assert [r["identifier"] for r in result["results"]] == [
+        "mockFull", "mockHalf", "mockQuarter"
+    ]
+    overlaps = [r["overlap"] for r in result["results"]]
+    assert overlaps == pytest.approx([1.0, 0.5, 0.25], rel=1e-3)
+
+    # Max results are the best ones, and the rest are never loaded
+    loaded = []
+    getFileData = data._getFileData
+
+    def countFileData(target, fUUID):
+        loaded.append(fUUID)
+        return getFileData(target, fUUID)
+
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", countFileData)
+        result = data.findOverlap("alert", shape, maxres=1)
+        assert result["records"] == 1
+        assert result["results"][0]["identifier"] == "mockFull"
+        assert len(loaded) == 1
+
+        # The cutoff prunes on the upper bound as well
+        loaded.clear()
+        result = data.findOverlap("alert", shape, cutoff=0.4)
+        assert result["records"] == 2
+        assert len(loaded) == 2
+
+    # The generator yields a record before the rest have been loaded
+    loaded.clear()
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", countFileData)
+        assert data.iterOverlap("alert", shape, sort="stuff") is None
+        records = data.iterOverlap("alert", shape)
+        assert next(records)["identifier"] == "mockFull"
+        assert len(loaded) == 1
+        assert [r["identifier"] for r in records] == ["mockHalf", "mockQuarter"]
+        assert len(loaded) == 3
+
+    # Field projection
+    assert data.findOverlap("alert", shape, fields=["stuff"]) is None
+    assert set(data.findOverlap("alert", shape)["results"][0]) == set(RECORD_FIELDS)
+
+    loaded.clear()
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", countFileData)
+
+        # All three lie within the search polygon, so no files are needed
+        result = data.findOverlap("alert", shape, fields=["identifier", "overlap", "bounds"])
+        assert result["results"][0] == {
+            "identifier": "mockFull",
+            "overlap": pytest.approx(1.0),
+            "bounds": {"west": 0.0, "east": 2.0, "north": 2.0, "south": 0.0},
+        }
+        overlaps = [r["overlap"] for r in result["results"]]
+        assert overlaps == pytest.approx([1.0, 0.5, 0.25], rel=1e-3)
+        assert len(loaded) == 0
+
+        # The area description is only in the file
+        result = data.findOverlap("alert", shape, fields=["uuid", "areaDesc"])
+        assert result["records"] == 3
+        assert result["results"][0]["areaDesc"] == {"en": ""}
+        assert len(result["results"][0]["uuid"]) == 36
+        assert len(loaded) == 3
+
+        # Only the alert within the search polygon is taken from the index
+        loaded.clear()
+        partShape = shapely.geometry.box(0.0, 0.0, 2.0, 1.5)
+        result = data.findOverlap("alert", partShape, fields=["identifier", "overlap"])
+        assert [r["identifier"] for r in result["results"]] == [
+            "mockFull", "mockHalf", "mockQuarter"
+        ]
+        assert [r["overlap"] for r in result["results"]] == pytest.approx(
+            [1.0, 0.5, 1.0/3.0], rel=1e-3
+        )
+        assert len(loaded) == 2
+
+    # Overlap relative to both the search polygon and the records
+    overlapFields = ["identifier", "overlap_query", "overlap_record", "intersection"]
+    sideShape = shapely.geometry.box(0.0, 0.0, 2.0, 1.0)
+    assert data.findOverlap("alert", sideShape, cutoffOn="stuff") is None
+    result = data.findOverlap("alert", sideShape, fields=overlapFields)
+    unit = Shape.boxArea(0.0, 0.0, 1.0, 1.0)
+    assert [r["identifier"] for r in result["results"]] == ["mockFull", "mockQuarter", "mockHalf"]
+    assert [
+        [r["overlap_query"], r["overlap_record"], r["intersection"]/unit]
+        for r in result["results"]
+    ] == [
+        pytest.approx([1.0, 0.5, 2.0], rel=1e-3),
+        pytest.approx([0.5, 1.0, 1.0], rel=1e-3),
+        pytest.approx([0.5, 0.5, 1.0], rel=1e-3),
+    ]
+
+    # The cutoff and ranking can apply to the record ratio instead
+    result = data.findOverlap("alert", sideShape, cutoff=0.75, fields=overlapFields)
+    assert [r["identifier"] for r in result["results"]] == ["mockFull"]
+    result = data.findOverlap(
+        "alert", sideShape, cutoff=0.75, fields=overlapFields, cutoffOn="record"
+    )
+    assert [r["identifier"] for r in result["results"]] == ["mockQuarter"]
+    result = data.findOverlap("alert", sideShape, maxres=1, cutoffOn="record")
+    assert result["results"][0]["identifier"] == "mockQuarter"
+    assert result["results"][0]["overlap"] == pytest.approx(0.5, rel=1e-3)
+
+    # Ranked by sent date
+    result = data.findOverlap("alert", shape, sort="sent")
+    assert [r["identifier"] for r in result["results"]] == [
+        "mockQuarter", "mockHalf", "mockFull"
+    ]
+    result = data.findOverlap("alert", shape, maxres=2, sort="sent")
+    assert [r["identifier"] for r in result["results"]] == ["mockQuarter", "mockHalf"]
+
+    # Timeout
+    assert data.findOverlap("alert", shape)["partial"] is False
+    result = data.findOverlap("alert", shape, timeout=0)
+    assert result["partial"] is True
+    assert result["records"] == 0
+    result = data.findOverlap("alert", shape, sort="sent", timeout=0)
+    assert result["partial"] is True
+    assert result["records"] == 0
+
+    class FakeTime:
+        clock = 0.0
+
+        @classmethod
+        def monotonic(cls):
+            cls.clock += 1.0
+            return cls.clock
+
+    # The deadline passes after the first candidate has been checked
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.data.data.time", FakeTime)
+        result = data.findOverlap("alert", shape, timeout=1500)
+        assert result["partial"] is True
+        assert [r["identifier"] for r in result["results"]] == ["mockFull"]
+
+        status = {}
+        records = data.iterOverlap("alert", shape, timeout=1500, status=status)
+        assert status["partial"] is False
+        assert len(list(records)) == 1
+        assert status["partial"] is True
+
+# END Test testDataData_FindOverlapRanking
+
+
+@pytest.mark.data
+def testDataData_FindOverlapBatch(monkeypatch, tmpConf, fncDir):
+    """Test overlap search with several polygons."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+
+    for name, polygon in [
+        ("mockFull", "0,0 0,2 2,2 2,0 0,0"),
+        ("mockHalf", "0,0 0,1 2,1 2,0 0,0"),
+        ("mockQuarter", "0,0 0,1 1,1 1,0 0,0"),
+    ]:
+        testCap = os.path.join(fncDir, f"{name}.cap.xml")
+        writeFile(testCap, (
+            "<alert>"
+            f"<identifier>{name}</identifier>"
+            "<sent>2021-09-01T12:00:00Z</sent>"
+            "<info><area>"
+            f"<polygon>{polygon}</polygon>"
+            "<altitude>0</altitude>"
+            "<ceiling>1</ceiling>"
+            "</area></info>"
+            "</alert>"
+        ))
+        assert data.ingestAlertFile(testCap) is True
+
+    shapes = {
+        "all": shapely.geometry.box(0.0, 0.0, 2.0, 2.0),
+        "east": shapely.geometry.box(1.5, 0.0, 2.5, 2.0),
+        "none": shapely.geometry.box(5.0, 5.0, 6.0, 6.0),
+    }
+
+    # Invalid parameters
+    assert data.findOverlapBatch("alert", list(shapes.values())) is None
+    assert data.findOverlapBatch("alert", {"a": shapely.geometry.Polygon()}) is None
+    assert data.findOverlapBatch("alert", shapes, sort="stuff") is None
+    assert data.findOverlapBatch("alert", shapes, fields=["stuff"]) is None
+    assert data.findOverlapBatch("alert", {}) == {
+        "maxres": 1000, "partial": False, "estimate": False, "results": {}
+    }
+
+    # One index lookup, and each file is loaded only once
+    lookups = []
+    loaded = []
+    searchBounds = data._db.searchBounds
+    getFileData = data._getFileData
+
+    def countSearchBounds(*args, **kwargs):
+        lookups.append(args)
+        return searchBounds(*args, **kwargs)
+
+    def countFileData(target, fUUID):
+        loaded.append(fUUID)
+        return getFileData(target, fUUID)
+
+    with monkeypatch.context() as mp:
+        mp.setattr(data._db, "searchBounds", countSearchBounds)
+        mp.setattr(data, "_getFileData", countFileData)
+        result = data.findOverlapBatch("alert", shapes)
+        assert lookups == [("alert", 0.0, 0.0, 6.0, 6.0)]
+        assert len(loaded) == 3
+
+    assert result["maxres"] == 1000
+    assert list(result["results"]) == ["all", "east", "none"]
+    overlaps = [r["overlap"] for r in result["results"]["all"]["results"]]
+    assert overlaps == pytest.approx([1.0, 0.5, 0.25], rel=1e-3)
+    assert result["results"]["east"]["records"] == 1
+    assert result["results"]["east"]["results"][0]["identifier"] == "mockFull"
+    assert result["results"]["east"]["results"][0]["overlap"] == pytest.approx(0.5, rel=1e-3)
+    assert result["results"]["none"] == {"records": 0, "results": []}
+
+    # The shared records are not modified between the polygons
+    assert result["results"]["all"]["results"][0]["overlap"] == pytest.approx(1.0, rel=1e-3)
+
+    # Same results as the single polygon search
+    for name, shape in shapes.items():
+        single = data.findOverlap("alert", shape, maxres=1, fields=["uuid", "overlap"])
+        batch = data.findOverlapBatch(
+            "alert", {name: shape}, maxres=1, fields=["uuid", "overlap"]
+        )
+        assert batch["results"][name]["results"] == single["results"]
+
+    # Timeout
+    result = data.findOverlapBatch("alert", shapes, timeout=0)
+    assert result["partial"] is True
+    assert result["results"]["all"] == {"records": 0, "results": []}
+
+# END Test testDataData_FindOverlapBatch
+
+
+@pytest.mark.data
+def testDataData_FindOverlapApprox(monkeypatch, tmpConf, fncDir):
+    """Test approximate overlap search from the grid cells."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+    tmpConf.searchGridLevel = 10
+
+    data = Data()
+    for name, polygon in [
+        ("mockFull", "0,0 0,2 2,2 2,0 0,0"),
+        ("mockDiagonal", "0,0 2,2 0,2 0,0"),
+        ("mockFar", "9,9 9,10 10,10 10,9 9,9"),
+    ]:
+        testCap = os.path.join(fncDir, f"{name}.cap.xml")
+        writeFile(testCap, (
+            "<alert>"
+            f"<identifier>{name}</identifier>"
+            "<sent>2021-09-01T12:00:00Z</sent>"
+            "<info><area>"
+            f"<polygon>{polygon}</polygon>"
+            "<altitude>0</altitude>"
+            "<ceiling>1</ceiling>"
+            "</area></info>"
+            "</alert>"
+        ))
+        assert data.ingestAlertFile(testCap) is True
+
+    shape = shapely.geometry.box(0.3, 0.3, 1.7, 1.3)
+    fields = ["identifier", "overlap_query", "overlap_record"]
+
+    # Invalid parameters
+    assert data.findOverlap("alert", shape, mode="stuff") is None
+    assert data.findOverlap("alert", shape, mode="approx", fields=["areaDesc"]) is None
+    with monkeypatch.context() as mp:
+        mp.setattr(tmpConf, "searchGridLevel", None)
+        assert data.findOverlap("alert", shape, mode="approx") is None
+
+    # The estimates are close to the exact overlaps, and no files are loaded
+    loaded = []
+    getFileData = data._getFileData
+
+    def countFileData(target, fUUID):
+        loaded.append(fUUID)
+        return getFileData(target, fUUID)
+
+    exact = data.findOverlap("alert", shape, fields=fields)
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", countFileData)
+        approx = data.findOverlap("alert", shape, fields=fields, mode="approx")
+    assert len(loaded) == 0
+    assert [r["identifier"] for r in approx["results"]] == ["mockFull", "mockDiagonal"]
+    for approxRec, exactRec in zip(approx["results"], exact["results"]):
+        assert approxRec["overlap_query"] == pytest.approx(exactRec["overlap_query"], abs=0.05)
+        assert approxRec["overlap_record"] == pytest.approx(exactRec["overlap_record"], abs=0.05)
+
+    # Full coverage is exact, and only the index fields are returned
+    result = data.findOverlap("alert", shape, mode="approx")
+    assert set(result["results"][0]) == set(ma_search.data.data.INDEX_FIELDS)
+    assert result["results"][0]["overlap"] == pytest.approx(1.0)
+
+    # The cutoff applies to the estimates
+    result = data.findOverlap("alert", shape, cutoff=0.9, mode="approx")
+    assert [r["identifier"] for r in result["results"]] == ["mockFull"]
+    result = data.findOverlap(
+        "alert", shape, cutoff=0.3, cutoffOn="record", fields=fields, mode="approx"
+    )
+    assert [r["identifier"] for r in result["results"]] == ["mockDiagonal", "mockFull"]
+
+    # Batch
+    result = data.findOverlapBatch(
+        "alert", {"a": shape, "far": shapely.geometry.box(9.0, 9.0, 9.5, 9.5)}, mode="approx"
+    )
+    assert result["results"]["a"]["records"] == 2
+    assert result["results"]["far"]["results"][0]["identifier"] == "mockFar"
+
+# END Test testDataData_FindOverlapApprox
+
+
+@pytest.mark.data
+def testDataData_FindOverlapCells(monkeypatch, tmpConf, fncDir):
+    """Test looking up the alerts by grid cell for diagonal polygons."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+    tmpConf.searchGridLevel = 8
+
+    data = Data()
+    for name, polygon in [
+        ("mockCentre", "1,1 1,2 2,2 2,1 1,1"),
+        ("mockCorner", "0,3 0,4 1,4 1,3 0,3"),
+    ]:
+        testCap = os.path.join(fncDir, f"{name}.cap.xml")
+        writeFile(testCap, (
+            "<alert>"
+            f"<identifier>{name}</identifier>"
+            "<sent>2021-09-01T12:00:00Z</sent>"
+            "<info><area>"
+            f"<polygon>{polygon}</polygon>"
+            "<altitude>0</altitude>"
+            "<ceiling>1</ceiling>"
+            "</area></info>"
+            "</alert>"
+        ))
+        assert data.ingestAlertFile(testCap) is True
+
+    lookups = []
+    searchBounds = data._db.searchBounds
+    searchCells = data._db.searchCells
+
+    def countBounds(*args, **kwargs):
+        lookups.append("bounds")
+        return searchBounds(*args, **kwargs)
+
+    def countCells(*args, **kwargs):
+        lookups.append("cells")
+        return searchCells(*args, **kwargs)
+
+    monkeypatch.setattr(data._db, "searchBounds", countBounds)
+    monkeypatch.setattr(data._db, "searchCells", countCells)
+    monkeypatch.setattr(data, "_alertCandidates", lambda query, rows, *a: [
+        {"uuid": row["uuid"], "sent": 0.0, "upper": 1.0, "isect": 1.0, "relArea": 1.0,
+         "index": row} for row in rows
+    ])
+
+    # A square polygon is looked up by bounds
+    result = data.findOverlap("alert", shapely.geometry.box(0.0, 0.0, 4.0, 4.0), cutoff=0.01)
+    assert lookups == ["bounds"]
+    assert result["records"] == 2
+
+    # A diagonal polygon is looked up by cell, and the corner is skipped
+    lookups.clear()
+    diagonal = shapely.geometry.Polygon([
+        (0.0, 0.0), (0.2, 0.0), (4.0, 3.8), (4.0, 4.0), (3.8, 4.0), (0.0, 0.2), (0.0, 0.0)
+    ])
+    result = data.findOverlap("alert", diagonal, cutoff=0.01, fields=["identifier"])
+    assert lookups == ["cells"]
+    assert [r["identifier"] for r in result["results"]] == ["mockCentre"]
+
+    # Without the grid, the bounds are used
+    lookups.clear()
+    tmpConf.searchGridLevel = None
+    result = data.findOverlap("alert", diagonal, cutoff=0.01, fields=["identifier"])
+    assert lookups == ["bounds"]
+    assert result["records"] == 2
+
+    # The bounds are also used until the index is rebuilt at a new level
+    lookups.clear()
+    tmpConf.searchGridLevel = 10
+    assert data._db.cellLevel() == 8
+    assert data.hasGridCells() is False
+    result = data.findOverlap("alert", diagonal, cutoff=0.01, fields=["identifier"])
+    assert lookups == ["bounds"]
+    assert result["records"] == 2
+
+    # An alert indexed at the new level leaves no level with all cells
+    testCap = os.path.join(fncDir, "mockNew.cap.xml")
+    writeFile(testCap, (
+        "<alert><identifier>mockNew</identifier><sent>2021-09-02T12:00:00Z</sent>"
+        "<info><area><polygon>2,2 2,3 3,3 3,2 2,2</polygon></area></info></alert>"
+    ))
+    assert data.ingestAlertFile(testCap) is True
+    assert data._db.cellLevel() is None
+    tmpConf.searchGridLevel = 8
+    assert data.hasGridCells() is False
+
+    lookups.clear()
+    tmpConf.searchGridLevel = 10
+    assert data.rebuildAlertIndex() is True
+    assert data._db.cellLevel() == 10
+    result = data.findOverlap("alert", diagonal, cutoff=0.01, fields=["identifier"])
+    assert lookups == ["cells"]
+    assert sorted(r["identifier"] for r in result["results"]) == ["mockCentre", "mockNew"]
+
+# END Test testDataData_FindOverlapCells
+
+
+@pytest.mark.data
+def testDataData_FindOverlapBBox(monkeypatch, tmpConf, fncDir):
+    """Test overlap estimates from the bounds only."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+    for name, polygon in [
+        ("mockFull", "0,0 0,2 2,2 2,0 0,0"),
+        ("mockDiagonal", "0,0 2,2 0,2 0,0"),
+    ]:
+        testCap = os.path.join(fncDir, f"{name}.cap.xml")
+        writeFile(testCap, (
+            "<alert>"
+            f"<identifier>{name}</identifier>"
+            "<sent>2021-09-01T12:00:00Z</sent>"
+            "<info><area>"
+            f"<polygon>{polygon}</polygon>"
+            "<altitude>0</altitude>"
+            "<ceiling>1</ceiling>"
+            "</area></info>"
+            "</alert>"
+        ))
+        assert data.ingestAlertFile(testCap) is True
+
+    shape = SearchShape(shapely.geometry.box(1.0, 1.0, 3.0, 3.0))
+    fields = ["identifier", "overlap_query", "overlap_record"]
+
+    # Only the index fields can be returned
+    assert data.findOverlap("alert", shape, mode="bbox", fields=["polygon"]) is None
+
+    # No files are loaded, and the estimates are flagged
+    loaded = []
+    getFileData = data._getFileData
+
+    def countFileData(target, fUUID):
+        loaded.append(fUUID)
+        return getFileData(target, fUUID)
+
+    exact = data.findOverlap("alert", shape, fields=fields)
+    assert exact["estimate"] is False
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", countFileData)
+        mp.setattr(shapely.geometry.Polygon, "intersection", None)
+        result = data.findOverlap("alert", shape, fields=fields, mode="bbox")
+    assert len(loaded) == 0
+    assert result["estimate"] is True
+
+    # The overlap of the bounds is the same for both alerts, and it is
+    # an upper bound of the exact overlap
+    assert result["records"] == 2
+    estimates = {r["identifier"]: r for r in result["results"]}
+    for record in exact["results"]:
+        estimate = estimates[record["identifier"]]
+        assert estimate["overlap_query"] == pytest.approx(0.25, rel=1e-2)
+        assert estimate["overlap_query"] >= record["overlap_query"]
+    assert estimates["mockFull"]["overlap_record"] == pytest.approx(0.25, rel=1e-2)
+    assert estimates["mockDiagonal"]["overlap_record"] == pytest.approx(0.5, rel=1e-2)
+
+    # Default fields and the batch search
+    result = data.findOverlap("alert", shape, mode="bbox")
+    assert set(result["results"][0]) == set(ma_search.data.data.INDEX_FIELDS)
+    result = data.findOverlapBatch("alert", {"a": shape}, mode="bbox")
+    assert result["estimate"] is True
+    assert result["results"]["a"]["records"] == 2
+
+# END Test testDataData_FindOverlapBBox
+
+
+@pytest.mark.data
+def testDataData_FindOverlapMap(monkeypatch, tmpConf, fncDir):
+    """Test overlap search of tiled map regions."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+
+    triangle = shapely.geometry.Polygon([(0.0, 0.0), (4.0, 0.0), (0.0, 4.0), (0.0, 0.0)])
+    square = shapely.geometry.box(5.0, 0.0, 6.0, 1.0)
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.data.shape.MAP_TILE_MIN_POINTS", 4)
+        tiled = Shape.fromGeoJSON(shapely.geometry.mapping(triangle))
+    tiles = tiled.tiles()
+    assert len(tiles) == 10
+    assert data._db.editMapRecord(
+        cmd="insert", recordUUID=tiled._uuid, label="Fylke", source="test",
+        coordSystem="WGS84", west=0.0, south=0.0, east=4.0, north=4.0,
+        area=tiled.projected().area, validFrom=datetime(2020, 1, 1),
+        meta={"admName": "Triangle", "admID": "01"},
+        tiles=[(*tile["bounds"], tile["area"]) for tile in tiles],
+    ) is True
+
+    single = Shape.fromGeoJSON(shapely.geometry.mapping(square))
+    assert data._db.editMapRecord(
+        cmd="insert", recordUUID=single._uuid, label="Kommune", source="test",
+        coordSystem="WGS84", west=5.0, south=0.0, east=6.0, north=1.0,
+        area=single.projected().area, meta={"admName": "Square", "admID": "02"},
+    ) is True
+
+    # Invalid parameters
+    query = shapely.geometry.box(0.5, 0.5, 5.5, 2.5)
+    assert data.findOverlap("map", query, fields=["identifier"]) is None
+    assert data.findOverlap("map", query, fields=["label"], mode="approx") is None
+
+    # Only the tiles crossing the edges of the search polygon are
+    # intersected, and the result matches the full polygons
+    intersected = []
+    mapTile = data._mapTile
+
+    def countTile(mapShape, number):
+        intersected.append(number)
+        return mapTile(mapShape, number)
+
+    monkeypatch.setattr(data, "_mapTile", countTile)
+    result = data.findOverlap("map", query)
+    search = SearchShape(query)
+    expected = [
+        search.projected.intersection(Shape.projectPolygon(triangle)).area,
+        search.projected.intersection(Shape.projectPolygon(square)).area,
+    ]
+    assert [r["admName"] for r in result["results"]] == ["Triangle", "Square"]
+    assert set(result["results"][0]) == set(ma_search.data.data.MAP_FIELDS)
+    assert result["results"][0]["label"] == "Fylke"
+    assert result["results"][0]["validFrom"] == "2020-01-01T00:00:00"
+    for record, isect in zip(result["results"], expected):
+        assert record["intersection"] == pytest.approx(isect, rel=1e-6)
+        assert record["overlap"] == pytest.approx(isect/search.area, rel=1e-6)
+    assert result["results"][1]["overlap_record"] == pytest.approx(0.25, rel=1e-3)
+    assert -1 in intersected
+    assert sorted(intersected) == [-1, 0, 1, 2, 3, 4, 7, 8]
+
+    # Cutoff and fields
+    result = data.findOverlap(
+        "map", query, cutoff=0.2, cutoffOn="record", fields=["admID", "overlap_record"]
+    )
+    assert result["results"] == [
+        {"admID": "01", "overlap_record": pytest.approx(expected[0]/tiled.projected().area)},
+        {"admID": "02", "overlap_record": pytest.approx(0.25, rel=1e-3)},
+    ]
+    result = data.findOverlap("map", query, cutoff=0.4, cutoffOn="record", fields=["admID"])
+    assert result["results"] == [{"admID": "01"}]
+
+    # Bounding box estimates from the tiles, without loading any
+    intersected.clear()
+    result = data.findOverlap("map", query, mode="bbox", fields=["admID", "intersection"])
+    assert intersected == []
+    assert result["estimate"] is True
+    assert [r["admID"] for r in result["results"]] == ["01", "02"]
+    assert result["results"][0]["intersection"] >= expected[0]
+    assert result["results"][1]["intersection"] == pytest.approx(expected[1], rel=1e-3)
+
+    # Sort by validity
+    result = data.findOverlap("map", query, sort="sent", fields=["admID"])
+    assert result["results"] == [{"admID": "01"}, {"admID": "02"}]
+
+    # Batch
+    result = data.findOverlapBatch("map", {
+        "a": query, "b": shapely.geometry.box(5.2, 0.2, 5.8, 0.8)
+    }, fields=["admID", "overlap"])
+    assert result["results"]["a"]["records"] == 2
+    assert result["results"]["b"]["results"] == [{"admID": "02", "overlap": pytest.approx(1.0)}]
+
+# END Test testDataData_FindOverlapMap
+
+
+@pytest.mark.data
+def testDataData_GetRegion(monkeypatch, tmpConf, fncDir):
+    """Test search by stored map region."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+
+    testCap = os.path.join(fncDir, "mockHalf.cap.xml")
+    writeFile(testCap, (
+        "<alert>"
+        "<identifier>mockHalf</identifier>"
+        "<sent>2021-09-01T12:00:00Z</sent>"
+        "<info><area>"
+        "<polygon>0,0 0,1 2,1 2,0 0,0</polygon>"
+        "<altitude>0</altitude>"
+        "<ceiling>1</ceiling>"
+        "</area></info>"
+        "</alert>"
+    ))
+    assert data.ingestAlertFile(testCap) is True
+
+    region = Shape.fromGeoJSON({
+        "type": "Polygon",
+        "coordinates": [[[0.0, 0.0], [2.0, 0.0], [2.0, 2.0], [0.0, 2.0], [0.0, 0.0]]],
+    })
+    rUUID = region._uuid
+    assert data._db.editMapRecord(
+        cmd="insert", recordUUID=rUUID, label="Kommune", source="test",
+        coordSystem="WGS84", west=0.0, south=0.0, east=2.0, north=2.0, area=4.0,
+        meta={"admName": "Oslo", "admID": "0301"}
+    ) is True
+
+    # Invalid or unknown regions
+    assert data.getRegion(None) is None
+    assert data.getRegion("") is None
+    assert data.getRegion("5001") is None
+    assert data.getRegion(str(uuid.uuid4())) is None
+
+    # Look up by UUID, and the parsed region is cached
+    query = data.getRegion(rUUID)
+    assert isinstance(query, SearchShape)
+    assert query.polygon.area == 4.0
+    assert query.area == query.projected.area
+    with monkeypatch.context() as mp:
+        mp.setattr(Shape, "polygon", lambda *a, **k: None)
+        assert data.getRegion(rUUID) is query
+        assert data.getRegion("0301") is query
+        assert data.getRegion(rUUID.upper()) is query
+
+    # Search with the region
+    result = data.findOverlap("alert", query)
+    assert result["records"] == 1
+    assert result["results"][0]["overlap"] == pytest.approx(0.5, rel=1e-3)
+
+    result = data.findOverlapBatch("alert", {"region": query})
+    assert result["results"]["region"]["records"] == 1
+
+    # The cache is bounded
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.data.data.REGION_CACHE_SIZE", 1)
+        other = Shape.fromGeoJSON({
+            "type": "Polygon",
+            "coordinates": [[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 0.0]]],
+        })
+        assert data.getRegion(other._uuid).polygon.area == 0.5
+        assert data.getRegion(rUUID) is not query
+
+    # No database
+    data._db = None
+    assert data.getRegion("0301") is None
+
+# END Test testDataData_GetRegion
+
+
+@pytest.mark.data
+def testDataData_NormaliseQuery(monkeypatch, tmpConf, fncDir):
+    """Test normalisation and caching of search polygons."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+
+    # Invalid input
+    assert data.normaliseQuery(None) == (None, 0.0)
+    assert data.normaliseQuery(os.path.join(fncDir, "stuff.json")) == (None, 0.0)
+    assert data.normaliseQuery({"stuff": object()}) == (None, 0.0)
+    assert data.normaliseQuery({"type": "Point", "coordinates": [0.0, 0.0]}) == (None, 0.0)
+    assert data.normaliseQuery({
+        "type": "Polygon", "coordinates": [[[0.0, 0.0], [1.0, 1.0], [2.0, 2.0], [0.0, 0.0]]]
+    }) == (None, 0.0)
+
+    # A repaired polygon is cached
+    bowTie = {
+        "type": "Polygon",
+        "coordinates": [[[0.0, 0.0], [2.0, 2.0], [2.0, 0.0], [0.0, 2.0], [0.0, 0.0]]],
+    }
+    query, tolerance = data.normaliseQuery(bowTie)
+    assert isinstance(query, SearchShape)
+    assert query.polygon.area == 2.0
+    assert tolerance == 0.0
+    with monkeypatch.context() as mp:
+        mp.setattr(Shape, "polygonFromGeoJson", lambda *a: None)
+        assert data.normaliseQuery(json.loads(json.dumps(bowTie)))[0] is query
+        assert data.normaliseQuery(bowTie, precision=0.01) == (None, 0.0)
+
+    # A large polygon is simplified
+    circle = shapely.geometry.Point(0.0, 0.0).buffer(1.0, 1000)
+    query, tolerance = data.normaliseQuery(shapely.geometry.mapping(circle))
+    assert tolerance > 0.0
+    assert query.polygon.area == pytest.approx(circle.area, rel=0.001)
+
+    # The cache is bounded
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.data.data.QUERY_CACHE_SIZE", 1)
+        query, _ = data.normaliseQuery(bowTie)
+        square = shapely.geometry.mapping(shapely.geometry.box(0.0, 0.0, 1.0, 1.0))
+        assert data.normaliseQuery(square)[0].polygon.area == 1.0
+        assert data.normaliseQuery(bowTie)[0] is not query
+
+# END Test testDataData_NormaliseQuery
+
+
+@pytest.mark.data
+def testDataData_CacheLock(monkeypatch, tmpConf, fncDir):
+    """Test that the shared caches are only used under the lock."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = None
+    monkeypatch.setattr("ma_search.data.data._queryCache", OrderedDict())
+    monkeypatch.setattr("ma_search.data.data._regionCache", OrderedDict())
+
+    data = Data()
+    polygon = shapely.geometry.mapping(shapely.geometry.box(0.0, 0.0, 1.0, 1.0))
+    region = Shape.fromGeoJSON(polygon)
+    assert data.normaliseQuery(polygon)[0] is not None
+    assert data.getRegion(region._uuid) is not None
+
+    # Lookups wait while another thread holds the lock
+    for call, args in [(data.normaliseQuery, (polygon,)), (data.getRegion, (region._uuid,))]:
+        results = []
+        worker = threading.Thread(target=lambda: results.append(call(*args)))
+        with ma_search.data.data._cacheLock:
+            worker.start()
+            worker.join(timeout=0.1)
+            assert worker.is_alive()
+            assert results == []
+        worker.join()
+        assert results[0] is not None
+
+# END Test testDataData_CacheLock
+
+
+@pytest.mark.data
+def testDataData_WarmUp(monkeypatch, tmpConf, fncDir):
+    """Test preloading of recent alerts and map regions."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+    monkeypatch.setattr("ma_search.data.data._alertCache", {})
+
+    data = Data()
+
+    recent = datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+    for name, sent in [("mockOld", "2021-09-01T12:00:00Z"), ("mockRecent", recent)]:
+        testCap = os.path.join(fncDir, f"{name}.cap.xml")
+        writeFile(testCap, (
+            "<alert>"
+            f"<identifier>{name}</identifier>"
+            f"<sent>{sent}</sent>"
+            "<info><area>"
+            "<polygon>0,0 0,2 2,2 2,0 0,0</polygon>"
+            "<altitude>0</altitude>"
+            "<ceiling>1</ceiling>"
+            "</area></info>"
+            "</alert>"
+        ))
+        assert data.ingestAlertFile(testCap) is True
+
+    region = Shape.fromGeoJSON({
+        "type": "Polygon",
+        "coordinates": [[[0.0, 0.0], [1.0, 0.0], [1.0, 1.0], [0.0, 1.0], [0.0, 0.0]]],
+    })
+    assert data._db.editMapRecord(
+        cmd="insert", recordUUID=region._uuid, label="Kommune", source="test",
+        coordSystem="WGS84", west=0.0, south=0.0, east=1.0, north=1.0, area=1.0,
+    ) is True
+
+    # Only the recent alert is preloaded
+    assert data.warmUp(alertDays=7, loadMaps=True) is True
+    cache = ma_search.data.data._alertCache
+    assert len(cache) == 1
+    recentUUID = list(cache)[0]
+    assert cache[recentUUID]["data"]["identifier"] == "mockRecent"
+    assert cache[recentUUID]["shape"].area == 4.0
+    assert region._uuid in ma_search.data.data._regionCache
+
+    # Searches skip loading the preloaded alert
+    loaded = []
+    getFileData = data._getFileData
+
+    def countFileData(target, fUUID):
+        loaded.append(fUUID)
+        return getFileData(target, fUUID)
+
+    shape = shapely.geometry.box(1.0, 1.0, 3.0, 3.0)
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", countFileData)
+        result = data.findOverlap("alert", shape)
+        assert result["records"] == 2
+        assert len(loaded) == 1
+        assert recentUUID not in loaded
+
+        assert data.findPoints("alert", [(0.5, 0.5)])[0]["records"] == 2
+        assert len(loaded) == 2
+
+        # A modified file is loaded again
+        loaded.clear()
+        filePath = data._filePath("alert", recentUUID)
+        fileTime = os.stat(filePath).st_mtime
+        os.utime(filePath, (fileTime + 10.0, fileTime + 10.0))
+        assert data.findOverlap("alert", shape)["records"] == 2
+        assert recentUUID in loaded
+
+    # Without alerts or maps, only the index is read
+    assert data.warmUp() is True
+    assert len(cache) == 0
+
+    # The index could not be read
+    with monkeypatch.context() as mp:
+        mp.setattr(data._db, "searchBounds", lambda *a, **k: None)
+        assert data.warmUp() is False
+        mp.setattr(
+            data._db, "searchBounds", lambda target, *a, **k: [] if target == "alert" else None
+        )
+        assert data.warmUp(loadMaps=True) is False
+
+    # No database
+    data._db = None
+    assert data.warmUp() is False
+
+# END Test testDataData_WarmUp
+
+
+@pytest.mark.data
+def testDataData_FindPoints(monkeypatch, tmpConf, fncDir):
+    """Test point in polygon search."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+
+    # The triangle covers the lower left half of its bounds
+    for name, sent, polygon in [
+        ("mockFull", "2021-09-01T12:00:00Z", "0,0 0,2 2,2 2,0 0,0"),
+        ("mockTriangle", "2021-09-02T12:00:00Z", "0,0 2,0 0,2 0,0"),
+        ("mockQuarter", "2021-09-03T12:00:00Z", "0,0 0,1 1,1 1,0 0,0"),
+    ]:
+        testCap = os.path.join(fncDir, f"{name}.cap.xml")
+        writeFile(testCap, (
+            "<alert>"
+            f"<identifier>{name}</identifier>"
+            f"<sent>{sent}</sent>"
+            "<info><area>"
+            f"<polygon>{polygon}</polygon>"
+            "<altitude>0</altitude>"
+            "<ceiling>1</ceiling>"
+            "</area></info>"
+            "</alert>"
+        ))
+        assert data.ingestAlertFile(testCap) is True
+
+    # Invalid parameters
+    assert data.findPoints("alert", [(0.5, 0.5)], fields=["overlap"]) is None
+    assert data.findPoints("alert", [(0.5,)]) is None
+    assert data.findPoints("alert", [("a", "b")]) is None
+
+    # Each file is loaded once
+    loaded = []
+    getFileData = data._getFileData
+
+    def countFileData(target, fUUID):
+        loaded.append(fUUID)
+        return getFileData(target, fUUID)
+
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", countFileData)
+        results = data.findPoints(
+            "alert", [(0.5, 0.5), (1.5, 1.5), (5.0, 5.0)], fields=["identifier"]
+        )
+        assert len(loaded) == 3
+
+    assert results == [
+        {"records": 3, "results": [
+            {"identifier": "mockQuarter"},
+            {"identifier": "mockTriangle"},
+            {"identifier": "mockFull"},
+        ]},
+        {"records": 1, "results": [{"identifier": "mockFull"}]},
+        {"records": 0, "results": []},
+    ]
+
+    # Full records
+    results = data.findPoints("alert", [(1.5, 0.2)])
+    assert results[0]["records"] == 2
+    assert results[0]["results"][0]["identifier"] == "mockTriangle"
+    assert len(results[0]["results"][0]["uuid"]) == 36
+    assert "overlap" not in results[0]["results"][0]
+
+    # Points on the edge of the bounds and polygons
+    results = data.findPoints("alert", [(2.0, 1.0), (1.0, 1.0), (0.0, 0.0)], fields=["identifier"])
+    assert [r["records"] for r in results] == [1, 3, 3]
+
+    # Vertical range
+    results = data.findPoints("alert", [(0.5, 0.5)], vertical=(2.0, 3.0))
+    assert results[0]["records"] == 0
+
+    # Map regions, with the tiled triangle covering the lower left half
+    # of its bounds
+    triangle = shapely.geometry.Polygon([(0.0, 0.0), (4.0, 0.0), (0.0, 4.0), (0.0, 0.0)])
+    with monkeypatch.context() as mp:
+        mp.setattr("ma_search.data.shape.MAP_TILE_MIN_POINTS", 4)
+        tiled = Shape.fromGeoJSON(shapely.geometry.mapping(triangle))
+    assert data._db.editMapRecord(
+        cmd="insert", recordUUID=tiled._uuid, label="Fylke", source="test",
+        coordSystem="WGS84", west=0.0, south=0.0, east=4.0, north=4.0,
+        area=tiled.projected().area, validFrom=datetime(2020, 1, 1),
+        meta={"admName": "Triangle", "admID": "01"},
+        tiles=[(*tile["bounds"], tile["area"]) for tile in tiled.tiles()],
+    ) is True
+
+    single = Shape.fromGeoJSON(shapely.geometry.mapping(shapely.geometry.box(0.0, 0.0, 1.0, 1.0)))
+    assert data._db.editMapRecord(
+        cmd="insert", recordUUID=single._uuid, label="Kommune", source="test",
+        coordSystem="WGS84", west=0.0, south=0.0, east=1.0, north=1.0,
+        area=single.projected().area, validFrom=datetime(2021, 1, 1),
+        meta={"admName": "Square", "admID": "02"},
+    ) is True
+
+    assert data.findPoints("map", [(0.5, 0.5)], fields=["identifier"]) is None
+    assert data.findPoints("map", [(0.5, 0.5)], fields=["overlap"]) is None
+    assert data.findPoints("region", [(0.5, 0.5)]) is None
+
+    results = data.findPoints("map", [(0.5, 0.5), (1.5, 1.5), (3.0, 3.0)], fields=["admID"])
+    assert results == [
+        {"records": 2, "results": [{"admID": "02"}, {"admID": "01"}]},
+        {"records": 1, "results": [{"admID": "01"}]},
+        {"records": 0, "results": []},
+    ]
+
+    # Points on the edges of the tiles and the bounds
+    results = data.findPoints("map", [(1.0, 0.5), (0.0, 4.0), (4.0, 0.0)], fields=["admID"])
+    assert results == [
+        {"records": 2, "results": [{"admID": "02"}, {"admID": "01"}]},
+        {"records": 1, "results": [{"admID": "01"}]},
+        {"records": 1, "results": [{"admID": "01"}]},
+    ]
+
+    results = data.findPoints("map", [(0.5, 2.5)])
+    assert results[0]["records"] == 1
+    record = results[0]["results"][0]
+    assert set(record) == set(ma_search.data.data.MAP_POINT_FIELDS)
+    assert record["uuid"] == tiled._uuid
+    assert record["admName"] == "Triangle"
+    assert record["validFrom"] == "2020-01-01T00:00:00"
+
+    # No database
+    data._db = None
+    assert data.findPoints("alert", [(0.5, 0.5)]) is None
+
+# END Test testDataData_FindPoints
+
+
+@pytest.mark.data
+def testDataData_FindGeocodes(monkeypatch, tmpConf, fncDir, filesDir):
+    """Test alert lookup by geocode."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+    capFile = os.path.join(filesDir, "METfare-20210921T070421.cap.xml")
+    assert data.ingestAlertFile(capFile) is True
+
+    # Invalid parameters
+    assert data.findGeocodes("map", {"emma_id": "NO809"}) is None
+    assert data.findGeocodes("alert", {"emma_id": "NO809"}, fields=["overlap"]) is None
+    assert data.findGeocodes("alert", {"emma_id": "NO809"}, filters={"stuff": []}) is None
+    assert data.findGeocodes("alert", ["emma_id", "NO809"]) is None
+
+    # The geocodes are stored with the meta data
+    result = data.findGeocodes("alert", {"emma_id": ["NO808", "NO999"]})
+    assert result["records"] == 1
+    assert result["maxres"] == 1000
+    assert result["results"][0]["geocode"] == [["emma_id", "NO809"], ["emma_id", "NO808"]]
+    assert data.findGeocodes("alert", {"emma_id": "NO999"})["records"] == 0
+    assert data.findGeocodes("alert", {"kommune": "NO809"})["records"] == 0
+    assert data.findGeocodes("alert", {"emma_id": "NO809"}, vertical=(1000, 2000)) == {
+        "records": 0, "maxres": 1000, "results": []
+    }
+    assert data.findGeocodes("alert", {"emma_id": "NO809"}, filters={
+        "event": ["Kuling"], "awarenessLevel": [2]
+    })["records"] == 1
+
+    # Index fields are returned without loading the meta data
+    loaded = []
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", lambda *a: loaded.append(a) or {})
+        result = data.findGeocodes("alert", {"emma_id": "NO809"}, fields=["uuid", "event"])
+        assert result["results"] == [{
+            "uuid": "e4b5af9b-39ac-5911-a305-2f46be0b35f2", "event": "Kuling"
+        }]
+        assert loaded == []
+
+        # Records with a missing meta data file are skipped
+        assert data.findGeocodes("alert", {"emma_id": "NO809"})["records"] == 0
+        assert len(loaded) == 1
+
+# END Test testDataData_FindGeocodes
+
+
+@pytest.mark.data
+def testDataData_FindText(monkeypatch, tmpConf, fncDir, filesDir):
+    """Test alert search on the area description."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+    capFile = os.path.join(filesDir, "METfare-20210921T070421.cap.xml")
+    assert data.ingestAlertFile(capFile) is True
+    bounds = data.findGeocodes("alert", {"emma_id": "NO809"})["results"][0]["bounds"]
+    shape = shapely.geometry.box(
+        bounds["west"], bounds["south"], bounds["east"], bounds["north"]
+    )
+
+    # Invalid text
+    assert data.findOverlap("alert", shape, text=["Måløy"]) is None
+    assert data.findGeocodes("alert", {"emma_id": "NO809"}, text=42) is None
+
+    # Any of the languages of the description is matched
+    assert data.findOverlap("alert", shape, text="Måløy")["records"] == 1
+    assert data.findOverlap("alert", shape, text="svinoey maaloey")["records"] == 1
+    assert data.findOverlapBatch("alert", {"a": shape}, text="SVINØY")["results"]["a"][
+        "records"
+    ] == 1
+    assert data.findGeocodes("alert", {"emma_id": "NO809"}, text="Svinøy")["records"] == 1
+    assert data.findGeocodes("alert", {"emma_id": "NO809"}, text="Florø")["records"] == 0
+
+    # Alerts that don't match the text are never loaded
+    loaded = []
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_getFileData", lambda *a: loaded.append(a) or {})
+        assert data.findOverlap("alert", shape, text="Florø")["records"] == 0
+        assert data.findOverlapBatch("alert", {"a": shape}, text="Florø")["results"]["a"][
+            "records"
+        ] == 0
+        assert loaded == []
+
+# END Test testDataData_FindText
+
+
+@pytest.mark.data
+def testDataData_MemoryProvider(tmpConf, fncDir, filesDir):
+    """Test overlap search with the in-memory index."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "memory"
+    tmpConf.memoryPath = fncDir
+
+    data = Data()
+    assert isinstance(data._db, MemoryDB)
+
+    # Build a mock archive
+    dirsOne = os.path.join(fncDir, "alert_6", "alert_d")
+    dirsTwo = os.path.join(fncDir, "alert_4", "alert_f")
+    os.makedirs(dirsOne)
+    os.makedirs(dirsTwo)
+    fileOne = "957773d6-bc0d-5a72-be5e-27801d28e82b.json"
+    fileTwo = "a35e85f4-b0d1-5b1f-9db0-79007f49be07.json"
+    shutil.copyfile(
+        os.path.join(filesDir, "test_archive", fileOne), os.path.join(dirsOne, fileOne)
+    )
+    shutil.copyfile(
+        os.path.join(filesDir, "test_archive", fileTwo), os.path.join(dirsTwo, fileTwo)
+    )
+    assert data.rebuildAlertIndex() is True
+    assert os.path.isfile(os.path.join(fncDir, "index.npz"))
+    assert data._db._isDirty is False
+
+    shape = shapely.geometry.box(0.5, 0.5, 1.5, 1.5)
+    result = data.findOverlap("alert", shape)
+    assert result["records"] == 2
+    assert result["results"][0]["overlap"] == pytest.approx(0.25, rel=1e-3)
+
+    result = data.findOverlap("alert", shape, vertical=(-1.0, 0.8))
+    assert result["records"] == 1
+    assert result["results"][0]["altitude"] == 0.0
+
+    # The snapshot is reloaded by a new instance
+    del data
+    data = Data()
+    assert data.findOverlap("alert", shape)["records"] == 2
+
+# END Test testDataData_MemoryProvider
+
+
 @pytest.mark.data
 def testDataData_IngestAlertFile(monkeypatch, tmpConf, fncDir):
     """Test alert file ingestion."""
@@ -169,6 +1305,13 @@ def testDataData_IngestAlertFile(monkeypatch, tmpConf, fncDir):
         "<identifier>mockAlert</identifier>"
         "<sent>2021-09-27T16:00:00Z</sent>"
         "<info>"
+        "<expires>2021-09-28T06:00:00+02:00</expires>"
+        "<event>Kuling</event>"
+        "<severity>Moderate</severity>"
+        "<parameter>"
+        "<valueName>awareness_level</valueName>"
+        "<value>2; yellow; Moderate</value>"
+        "</parameter>"
         "<area>"
         "<polygon>1,1 1,2 2,2 2,1 1,1</polygon>"
         "<altitude>0</altitude>"
@@ -208,15 +1351,237 @@ def testDataData_IngestAlertFile(monkeypatch, tmpConf, fncDir):
     ]]
     assert jsonData["altitude"] == 0.0
     assert jsonData["ceiling"] == 1.0
-    assert jsonData["area"] == 1.0
+    assert jsonData["onset"] is None
+    assert jsonData["expires"] == "2021-09-28T06:00:00+02:00"
+    assert jsonData["event"] == "Kuling"
+    assert jsonData["urgency"] is None
+    assert jsonData["severity"] == "Moderate"
+    assert jsonData["awarenessLevel"] == 2
+    assert jsonData["area"] == pytest.approx(Shape.boxArea(1.0, 1.0, 2.0, 2.0), rel=1e-3)
+    assert jsonData["projected"]["type"] == "Polygon"
     assert jsonData["bounds"]["east"] == 2.0
     assert jsonData["bounds"]["west"] == 1.0
     assert jsonData["bounds"]["north"] == 2.0
     assert jsonData["bounds"]["south"] == 1.0
 
+    # The alert is in effect from the sent date until it expires
+    utc = timezone.utc
+    assert data._db.searchBoundsAt(
+        0.0, 0.0, 3.0, 3.0, datetime(2021, 9, 27, 15, 59, 59, tzinfo=utc)
+    ) == []
+    assert len(data._db.searchBoundsAt(
+        0.0, 0.0, 3.0, 3.0, datetime(2021, 9, 28, 3, 59, 59, tzinfo=utc)
+    )) == 1
+    assert data._db.searchBoundsAt(
+        0.0, 0.0, 3.0, 3.0, datetime(2021, 9, 28, 4, 0, 0, tzinfo=utc)
+    ) == []
+
+    # The period and CAP fields are applied before the polygons are checked
+    shape = shapely.geometry.box(0.5, 0.5, 1.5, 1.5)
+    result = data.findOverlap("alert", shape, fields=["uuid", "event", "awarenessLevel"])
+    assert result["results"] == [{
+        "uuid": "a35e85f4-b0d1-5b1f-9db0-79007f49be07", "event": "Kuling", "awarenessLevel": 2
+    }]
+    period = (datetime(2021, 9, 28, tzinfo=utc), None)
+    filters = {"severity": ["Moderate", "Severe"], "awarenessLevel": [2]}
+    assert data.findOverlap("alert", shape, period=period, filters=filters)["records"] == 1
+    period = (None, datetime(2021, 9, 27, 12, tzinfo=utc))
+    assert data.findOverlap("alert", shape, period=period)["records"] == 0
+    assert data.findOverlap("alert", shape, filters={"event": ["Storm"]})["records"] == 0
+    assert data.findOverlap("alert", shape, filters={"stuff": ["Storm"]}) is None
+
 # END Test testDataData_IngestAlertFile
 
 
+@pytest.mark.data
+def testDataData_IngestCircle(monkeypatch, tmpConf, fncDir):
+    """Test ingestion and search of alerts with a circle area."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+    testCap = os.path.join(fncDir, "circle.cap.xml")
+    writeFile(testCap, (
+        "<alert>"
+        "<identifier>mockCircle</identifier>"
+        "<sent>2021-09-27T16:00:00Z</sent>"
+        "<info>"
+        "<area>"
+        "<circle>60.0,10.0 50</circle>"
+        "</area>"
+        "</info>"
+        "</alert>"
+    ))
+    assert data.ingestAlertFile(testCap) is True
+
+    # The circle is stored with its polygon, and indexed by its exact bounds
+    jsonFile = os.path.join(
+        fncDir, "alert_d", "alert_2", "fda3e62d-24f3-5589-b5e4-03244652205b.json"
+    )
+    with open(jsonFile, mode="r") as inFile:
+        jsonData = json.load(inFile)
+    assert jsonData["circle"] == [[60.0, 10.0, 50.0]]
+    assert jsonData["polygon"]["type"] == "Polygon"
+    assert jsonData["area"] == pytest.approx(math.pi*50e3**2, rel=1e-2)
+    west, south, east, north = Shape.circleBounds(60.0, 10.0, 50.0)
+    assert jsonData["bounds"] == {"west": west, "south": south, "east": east, "north": north}
+    assert len(data._db.searchBounds("alert", east - 0.001, 59.9, east + 1.0, 60.1)) == 1
+
+    # A search polygon inside the circle is not intersected with it
+    projected = []
+    with monkeypatch.context() as mp:
+        mp.setattr(data, "_alertProjected", lambda *a: projected.append(a))
+        shape = shapely.geometry.box(9.9, 59.9, 10.1, 60.1)
+        result = data.findOverlap("alert", shape, fields=["identifier", "circle", "overlap"])
+        assert result["results"] == [{
+            "identifier": "mockCircle", "circle": [[60.0, 10.0, 50.0]], "overlap": 1.0
+        }]
+        assert projected == []
+
+    # A search polygon crossing the circle is intersected with its polygon
+    shape = shapely.geometry.box(10.0, 59.0, 11.0, 61.0)
+    result = data.findOverlap("alert", shape)
+    assert result["records"] == 1
+    assert result["results"][0]["overlap_record"] == pytest.approx(0.5, rel=1e-2)
+
+    # Points near the edge of the circle are checked by distance
+    dist = 49.99/6371.0072
+    bearing = math.pi/64.0
+    phi = math.radians(60.0)
+    lat = math.asin(math.sin(phi)*math.cos(dist) + math.cos(phi)*math.sin(dist)*math.cos(bearing))
+    lon = 10.0 + math.degrees(math.atan2(
+        math.sin(bearing)*math.sin(dist)*math.cos(phi),
+        math.cos(dist) - math.sin(phi)*math.sin(lat)
+    ))
+    polygon = Shape.polygonFromGeoJson(jsonData["polygon"])
+    assert not polygon.contains(shapely.geometry.Point(lon, math.degrees(lat)))
+    result = data.findPoints("alert", [(lon, math.degrees(lat)), (lon, 60.5)], fields=["uuid"])
+    assert [r["records"] for r in result] == [1, 0]
+
+    # A circle with radius zero is ingested as a point
+    writeFile(testCap, (
+        "<alert>"
+        "<identifier>mockPoint</identifier>"
+        "<sent>2021-09-27T16:00:00Z</sent>"
+        "<info>"
+        "<area>"
+        "<circle>70.0,20.0 0</circle>"
+        "</area>"
+        "</info>"
+        "</alert>"
+    ))
+    assert data.ingestAlertFile(testCap) is True
+    shape = shapely.geometry.box(19.9, 69.9, 20.1, 70.1)
+    result = data.findOverlap(
+        "alert", shape, cutoffOn="record", fields=["identifier", "circle"]
+    )
+    assert result["results"] == [{"identifier": "mockPoint", "circle": [[70.0, 20.0, 0.0]]}]
+
+# END Test testDataData_IngestCircle
+
+
+@pytest.mark.data
+def testDataData_MultiPolygonParts(tmpConf, fncDir):
+    """Test that each part of a MultiPolygon alert is indexed."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+    testCap = os.path.join(fncDir, "multi.cap.xml")
+    writeFile(testCap, (
+        "<alert>"
+        "<identifier>mockMultiAlert</identifier>"
+        "<sent>2021-09-27T16:00:00Z</sent>"
+        "<info>"
+        "<area>"
+        "<polygon>1,1 1,2 2,2 2,1 1,1</polygon>"
+        "<polygon>9,9 9,10 10,10 10,9 9,9</polygon>"
+        "<altitude>0</altitude>"
+        "<ceiling>1</ceiling>"
+        "</area>"
+        "</info>"
+        "</alert>"
+    ))
+    assert data.ingestAlertFile(testCap) is True
+
+    # Only the parts are matched, not the gap between them
+    assert data._db.searchBounds("alert", 4.0, 4.0, 6.0, 6.0) == []
+    assert len(data._db.searchBounds("alert", 1.5, 1.5, 9.5, 9.5)) == 1
+
+    shape = shapely.geometry.box(4.0, 4.0, 6.0, 6.0)
+    assert data.findOverlap("alert", shape)["records"] == 0
+
+    shape = shapely.geometry.box(9.5, 9.5, 10.5, 10.5)
+    result = data.findOverlap("alert", shape)
+    assert result["records"] == 1
+    assert result["results"][0]["overlap"] == pytest.approx(0.25, rel=1e-3)
+
+# END Test testDataData_MultiPolygonParts
+
+
+@pytest.mark.data
+def testDataData_InvalidPolygon(monkeypatch, tmpConf, fncDir):
+    """Test that self-intersecting alert polygons are repaired."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    data = Data()
+    testCap = os.path.join(fncDir, "bowtie.cap.xml")
+    writeFile(testCap, (
+        "<alert>"
+        "<identifier>mockBowTie</identifier>"
+        "<sent>2021-09-27T16:00:00Z</sent>"
+        "<info>"
+        "<area>"
+        "<polygon>1,1 2,2 1,2 2,1 1,1</polygon>"
+        "<altitude>0</altitude>"
+        "<ceiling>1</ceiling>"
+        "</area>"
+        "</info>"
+        "</alert>"
+    ))
+
+    # Cannot be repaired
+    with monkeypatch.context() as mp:
+        mp.setattr(Shape, "repairPolygon", lambda *a: None)
+        assert data.ingestAlertFile(testCap) is False
+
+    # The repaired polygon is stored, and flagged in the index
+    assert data.ingestAlertFile(testCap) is True
+    fUUID = str(uuid.uuid5(ma_search.data.data.UUID_NS, "mockBowTie"))
+    with open(data._filePath("alert", fUUID), mode="r") as inFile:
+        jsonData = json.load(inFile)
+    assert jsonData["valid"] is False
+    assert Shape.polygonFromGeoJson(jsonData["polygon"]).is_valid
+    assert Shape.polygonFromGeoJson(jsonData["projected"]).is_valid
+    assert data._db.searchBounds("alert", 0.0, 0.0, 3.0, 3.0)[0][13] == 0
+
+    shape = shapely.geometry.box(1.0, 1.0, 2.0, 2.0)
+    result = data.findOverlap("alert", shape, fields=["valid", "overlap", "overlap_record"])
+    assert result["records"] == 1
+    assert result["results"][0]["valid"] is False
+    assert result["results"][0]["overlap"] == pytest.approx(0.5, rel=1e-3)
+    assert result["results"][0]["overlap_record"] == pytest.approx(1.0)
+
+    # Older meta files are checked when indexed
+    del jsonData["valid"]
+    del jsonData["projected"]
+    jsonData["polygon"] = {
+        "type": "Polygon",
+        "coordinates": [[[1.0, 1.0], [2.0, 2.0], [2.0, 1.0], [1.0, 2.0], [1.0, 1.0]]],
+    }
+    writeFile(data._filePath("alert", fUUID), json.dumps(jsonData))
+    assert data.rebuildAlertIndex() is True
+    assert data._db.searchBounds("alert", 0.0, 0.0, 3.0, 3.0)[0][13] == 0
+    result = data.findOverlap("alert", shape, fields=["valid", "overlap"])
+    assert result["results"] == [{"valid": False, "overlap": pytest.approx(0.5, rel=1e-3)}]
+
+# END Test testDataData_InvalidPolygon
+
+
 @pytest.mark.data
 def testDataData_IndexAlertMetaFile(tmpConf, fncDir, filesDir):
     """Test the indexAlertMetaFile method."""
@@ -320,6 +1685,77 @@ def testDataData_RebuildAlertIndex(tmpConf, fncDir, filesDir):
 # END Test testDataData_RebuildAlertIndex
 
 
+@pytest.mark.data
+def testDataData_MapRegions(monkeypatch, tmpConf, fncDir):
+    """Test ingesting map regions and rebuilding their tiles."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+    monkeypatch.setattr("ma_search.data.shape.MAP_TILE_MIN_POINTS", 4)
+
+    data = Data()
+    triangle = shapely.geometry.Polygon([(0.0, 0.0), (4.0, 0.0), (0.0, 4.0), (0.0, 0.0)])
+
+    # Invalid polygon
+    assert data.ingestMapRegion({"type": "Point", "coordinates": [0.0, 0.0]}, "A", "B") is None
+
+    # The region is indexed with its tiles
+    rUUID = data.ingestMapRegion(
+        shapely.geometry.mapping(triangle), "Fylke", "test", validFrom=datetime(2020, 1, 1),
+        meta={"admName": "Triangle", "admID": "01"},
+    )
+    assert len(rUUID) == 36
+    tiles = [entry for entry in data._db.searchTiles(0.0, 0.0, 4.0, 4.0) if entry[0] == rUUID]
+    assert sorted(entry[1] for entry in tiles) == list(range(10))
+    assert data.flushIndex() is True
+
+    result = data.findOverlap("map", shapely.geometry.box(0.5, 0.5, 1.5, 1.5), fields=["admID"])
+    assert result["results"] == [{"admID": "01"}]
+    results = data.findPoints("map", [(0.5, 0.5), (3.0, 3.0)], fields=["uuid", "label"])
+    assert results == [
+        {"records": 1, "results": [{"uuid": rUUID, "label": "Fylke"}]},
+        {"records": 0, "results": []},
+    ]
+
+    # Maps indexed without tiles, and a map with no stored polygon
+    oldShape = Shape.fromGeoJSON(shapely.geometry.mapping(triangle))
+    missing = str(uuid.uuid4())
+    for mUUID, admID in [(oldShape._uuid, "02"), (missing, "03")]:
+        assert data._db.editMapRecord(
+            cmd="insert", recordUUID=mUUID, label="Old", source="test", coordSystem="WGS84",
+            west=0.0, south=0.0, east=4.0, north=4.0, area=oldShape.projected().area,
+            validTo=datetime(2021, 1, 1), meta={"admName": "Old", "admID": admID},
+        ) is True
+    tiles = [entry for entry in data._db.searchTiles(0.0, 0.0, 4.0, 4.0) if entry[0] == missing]
+    assert [entry[1] for entry in tiles] == [-1]
+
+    assert data.rebuildMapTiles() is False
+    for mUUID, numbers in [(rUUID, range(10)), (oldShape._uuid, range(10)), (missing, [-1])]:
+        tiles = [entry for entry in data._db.searchTiles(0.0, 0.0, 4.0, 4.0) if entry[0] == mUUID]
+        assert sorted(entry[1] for entry in tiles) == list(numbers)
+
+    results = data.findPoints("map", [(0.5, 0.5)], fields=["admID", "validFrom", "validTo"])
+    assert sorted(results[0]["results"], key=lambda r: r["admID"]) == [
+        {"admID": "01", "validFrom": "2020-01-01T00:00:00", "validTo": None},
+        {"admID": "02", "validFrom": None, "validTo": "2021-01-01T00:00:00"},
+    ]
+
+    # Index errors
+    with monkeypatch.context() as mp:
+        mp.setattr(data._db, "searchBounds", lambda *a: None)
+        assert data.rebuildMapTiles() is False
+    with monkeypatch.context() as mp:
+        mp.setattr(data._db, "editMapRecord", lambda *a, **k: False)
+        assert data.ingestMapRegion(shapely.geometry.mapping(triangle), "A", "B") is None
+
+    # No database
+    data._db = None
+    assert data.ingestMapRegion(shapely.geometry.mapping(triangle), "A", "B") is None
+    assert data.rebuildMapTiles() is False
+
+# END Test testDataData_MapRegions
+
+
 @pytest.mark.data
 def testDataData_Internals(monkeypatch, tmpConf, fncDir, filesDir):
     """Test internal functions."""
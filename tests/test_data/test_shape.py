@@ -19,6 +19,7 @@ limitations under the License.
 
 import os
 import json
+import math
 import pytest
 import shapely.geometry
 
@@ -26,7 +27,7 @@ from tools import writeFile
 
 import ma_search
 
-from ma_search.data.shape import Shape
+from ma_search.data.shape import SearchShape, Shape
 
 
 @pytest.mark.data
@@ -70,6 +71,13 @@ def testDataShape_FromGeoJson(fn, tmpConf, fncDir, filesDir, caplog, monkeypatch
     assert isinstance(shape, Shape)
     assert os.path.isfile(shape._path)
 
+    # the equal-area polygon is stored next to it
+    projPath = shape._path[:-8]+".laea.geojson"
+    assert os.path.isfile(projPath)
+    assert shape.projected().area == pytest.approx(
+        Shape.projectPolygon(shape.polygon()).area
+    )
+
     # returns None if not valid input
     with monkeypatch.context() as m:
         m.setattr(Shape, "polygonFromGeoJson", lambda x: None)
@@ -173,6 +181,13 @@ def testDataShape_ToGeoJson(fn, tmpConf, fncDir, filesDir):
     result = shape.toGeoJson()
     expected = {"type": "Feature", "geometry": data}
 
+    # Invalid polygons are stored repaired
+    polygon = Shape.polygonFromGeoJson(data)
+    if not polygon.is_valid:
+        assert shape.polygon().is_valid
+        assert shape.polygon().equals(Shape.repairPolygon(polygon))
+        return
+
     # TODO: Hacky comparison, but convert tuples to lists
     result = eval(result.__repr__().replace("(", "[").replace(")", "]"))
     assert result == expected
@@ -234,6 +249,267 @@ def testDataShape_PolygonFromGeoJson(fname, typ, tmpConf, fncDir, filesDir, capl
     assert "Could not read from file" in caplog.text
 
 
+@pytest.mark.data
+def testDataShape_PartBounds():
+    """Checks the bounds of each part of a polygon."""
+    polygon = shapely.geometry.box(1.0, 2.0, 3.0, 4.0)
+    assert Shape.partBounds(polygon) == [(1.0, 2.0, 3.0, 4.0)]
+
+    multi = shapely.geometry.MultiPolygon([
+        shapely.geometry.box(1.0, 2.0, 3.0, 4.0),
+        shapely.geometry.box(10.0, 20.0, 30.0, 40.0),
+    ])
+    assert Shape.partBounds(multi) == [(1.0, 2.0, 3.0, 4.0), (10.0, 20.0, 30.0, 40.0)]
+
+
+@pytest.mark.data
+def testDataShape_RepairPolygon(tmpConf, fncDir):
+    """Checks repair of invalid polygons."""
+    tmpConf.dataPath = fncDir
+
+    square = shapely.geometry.box(0.0, 0.0, 2.0, 2.0)
+    assert Shape.repairPolygon(square) is square
+
+    bowTie = shapely.geometry.Polygon([(0.0, 0.0), (2.0, 2.0), (2.0, 0.0), (0.0, 2.0)])
+    repaired = Shape.repairPolygon(bowTie)
+    assert repaired.is_valid
+    assert repaired.area == 2.0
+
+    # Nothing polygonal is left of a flat polygon
+    flat = shapely.geometry.Polygon([(0.0, 0.0), (1.0, 1.0), (2.0, 2.0)])
+    assert Shape.repairPolygon(flat) is None
+
+    # Map regions are stored repaired, also as features
+    shape = Shape.fromGeoJSON(shapely.geometry.mapping(bowTie))
+    assert shape.polygon().equals(repaired)
+    feature = {
+        "type": "Feature",
+        "properties": {"name": "bow"},
+        "geometry": shapely.geometry.mapping(bowTie),
+    }
+    shape = Shape.fromGeoJSON(feature)
+    assert shape.polygon().equals(repaired)
+    assert Shape.fromGeoJSON(shapely.geometry.mapping(flat)) is None
+
+
+@pytest.mark.data
+def testDataShape_NormalisePolygon(caplog):
+    """Checks repair and simplification of polygons."""
+    square = shapely.geometry.box(0.0, 0.0, 2.0, 2.0)
+    circle = shapely.geometry.Point(0.0, 0.0).buffer(1.0, 1000)
+    assert Shape.pointCount(square) == 5
+    assert Shape.pointCount(circle) == 4001
+    assert Shape.pointCount(shapely.geometry.MultiPolygon([
+        square, shapely.geometry.box(5.0, 5.0, 6.0, 6.0)
+    ])) == 10
+    assert Shape.pointCount(square.difference(shapely.geometry.box(0.5, 0.5, 1.0, 1.0))) == 10
+
+    # Valid polygons are unchanged without a precision
+    assert Shape.normalisePolygon(square) == (square, 0.0)
+    assert Shape.normalisePolygon(circle, precision=0.0) == (circle, 0.0)
+
+    # Invalid polygons are repaired
+    bowTie = shapely.geometry.Polygon([(0, 0), (2, 2), (2, 0), (0, 2), (0, 0)])
+    assert bowTie.is_valid is False
+    polygon, tolerance = Shape.normalisePolygon(bowTie)
+    assert polygon.is_valid is True
+    assert isinstance(polygon, shapely.geometry.MultiPolygon)
+    assert polygon.area == 2.0
+    assert tolerance == 0.0
+
+    # A repaired polygon with a dangling line keeps only the polygon
+    spike = shapely.geometry.Polygon([(0, 0), (1, 0), (1, 1), (0, 1), (0, 0), (-1, -1), (0, 0)])
+    polygon, _ = Shape.normalisePolygon(spike)
+    assert isinstance(polygon, shapely.geometry.Polygon)
+    assert polygon.area == 1.0
+
+    # Nothing is left if the polygon has no area
+    caplog.clear()
+    line = shapely.geometry.Polygon([(0, 0), (1, 1), (2, 2), (0, 0)])
+    assert Shape.normalisePolygon(line) == (None, 0.0)
+    assert "Could not repair invalid polygon" in caplog.text
+
+    # Simplification keeps the area within the precision
+    polygon, tolerance = Shape.normalisePolygon(circle, precision=0.001)
+    assert tolerance == pytest.approx(0.001 * circle.area / circle.length)
+    assert Shape.pointCount(polygon) < Shape.pointCount(circle) / 10
+    assert polygon.area == pytest.approx(circle.area, rel=0.001)
+
+    # Small polygons are not simplified
+    assert Shape.normalisePolygon(circle, precision=0.001, minPoints=5000) == (circle, 0.0)
+
+
+@pytest.mark.data
+def testDataShape_Projection(tmpConf, fncDir):
+    """Checks the equal-area projection of polygons."""
+    tmpConf.dataPath = fncDir
+
+    # Example point from the EPSG guidance note for EPSG:3035
+    east, north = Shape.projectCoords(5.0, 50.0)
+    assert east == pytest.approx(3962799.45, abs=0.01)
+    assert north == pytest.approx(2999718.85, abs=0.01)
+
+    # Boxes of one degree have the same area at the same latitude, and
+    # a smaller area further north
+    assert Shape.boxArea(0.0, 60.0, 1.0, 61.0) == pytest.approx(
+        Shape.boxArea(20.0, 60.0, 21.0, 61.0)
+    )
+    assert Shape.boxArea(0.0, 70.0, 1.0, 71.0) < 0.7*Shape.boxArea(0.0, 50.0, 1.0, 51.0)
+
+    # Long edges follow the curves of the projection
+    polygon = shapely.geometry.box(0.0, 60.0, 2.0, 62.0)
+    projected = Shape.projectPolygon(polygon)
+    assert len(projected.exterior.coords) > len(polygon.exterior.coords)
+    assert projected.area == pytest.approx(Shape.boxArea(0.0, 60.0, 2.0, 62.0), rel=1e-6)
+
+    # Holes and parts are kept
+    holed = polygon.difference(shapely.geometry.box(0.5, 60.5, 1.5, 61.5))
+    assert len(Shape.projectPolygon(holed).interiors) == 1
+    multi = shapely.geometry.MultiPolygon([polygon, shapely.geometry.box(5.0, 60.0, 6.0, 61.0)])
+    assert len(Shape.projectPolygon(multi).geoms) == 2
+    assert Shape.projectPolygon(shapely.geometry.Polygon()).is_empty
+
+    # The stored polygon of a map region
+    shape = Shape.fromGeoJSON(shapely.geometry.mapping(polygon))
+    os.remove(shape._path[:-8]+".laea.geojson")
+    assert shape.projected().area == pytest.approx(projected.area)
+    assert os.path.isfile(shape._path[:-8]+".laea.geojson")
+    assert shape.projected().area == pytest.approx(projected.area)
+
+    missing = Shape("33d0c48f-b58c-4b1a-b224-e93b03393cb3")
+    assert missing.projected() is None
+
+
+@pytest.mark.data
+def testDataShape_Tiles(monkeypatch, tmpConf, fncDir):
+    """Checks splitting of large polygons into tiles."""
+    tmpConf.dataPath = fncDir
+
+    polygon = shapely.geometry.Polygon([(0.5, 0.5), (3.5, 0.5), (0.5, 3.5), (0.5, 0.5)])
+    tiles = Shape.tilePolygon(polygon, 1.0)
+    assert len(tiles) == 10
+    assert sum(tile.area for tile in tiles) == pytest.approx(polygon.area)
+    assert shapely.geometry.box(1.0, 1.0, 2.0, 2.0) in tiles
+    assert all(tile.bounds[2] - tile.bounds[0] <= 1.0 for tile in tiles)
+    assert Shape.tilePolygon(shapely.geometry.Polygon(), 1.0) == []
+
+    # Small polygons are a single tile
+    shape = Shape.fromGeoJSON(shapely.geometry.mapping(polygon))
+    assert os.path.isfile(shape._path[:-8]+".tiles.geojson")
+    tiles = shape.tiles()
+    assert len(tiles) == 1
+    assert tiles[0]["bounds"] == polygon.bounds
+    assert tiles[0]["area"] == pytest.approx(shape.projected().area)
+
+    # Large polygons are split, and the tiles are read back from file
+    monkeypatch.setattr("ma_search.data.shape.MAP_TILE_MIN_POINTS", 4)
+    shape = Shape.fromGeoJSON(shapely.geometry.mapping(polygon))
+    tiles = shape.tiles()
+    assert len(tiles) == 10
+    assert sum(tile["area"] for tile in tiles) == pytest.approx(
+        shape.projected().area, rel=1e-6
+    )
+    assert [tile["bounds"] for tile in shape.tiles()] == [tile["bounds"] for tile in tiles]
+
+    missing = Shape("33d0c48f-b58c-4b1a-b224-e93b03393cb3")
+    assert missing.tiles() is None
+
+
+@pytest.mark.data
+def testDataShape_SearchShape():
+    """Checks the precomputed values of a search polygon."""
+    polygon = shapely.geometry.box(1.0, 2.0, 3.0, 4.0)
+    query = SearchShape(polygon)
+    assert query.polygon is polygon
+    assert query.area == query.projected.area
+    assert query.area == pytest.approx(Shape.boxArea(1.0, 2.0, 3.0, 4.0), rel=1e-3)
+    assert query.bounds == (1.0, 2.0, 3.0, 4.0)
+    assert query.prepared.contains(shapely.geometry.Point(2.0, 3.0))
+    assert not query.prepared.contains(shapely.geometry.Point(5.0, 3.0))
+
+
+@pytest.mark.data
+def testDataShape_Circle():
+    """Checks the bounds, distances and polygons of CAP circles."""
+    # The distance of a degree of latitude, and along a parallel
+    assert Shape.circleDistance(60.0, 10.0, 10.0, 61.0) == pytest.approx(111.2, rel=1e-3)
+    assert Shape.circleDistance(60.0, 10.0, [10.0, 12.0], [60.0, 60.0]) == pytest.approx(
+        [0.0, 111.1], rel=1e-3
+    )
+
+    # The bounds reach the points of the circle at the given distance
+    west, south, east, north = Shape.circleBounds(60.0, 10.0, 50.0)
+    assert Shape.circleDistance(60.0, 10.0, 10.0, north) == pytest.approx(50.0)
+    assert Shape.circleDistance(60.0, 10.0, 10.0, south) == pytest.approx(50.0)
+    assert min(Shape.circleDistance(60.0, 10.0, east, [59.9, 60.0, 60.1])) > 50.0
+    latEast = math.degrees(math.asin(math.sin(math.radians(60.0))/math.cos(50.0/6371.0072)))
+    assert Shape.circleDistance(60.0, 10.0, east, latEast) == pytest.approx(50.0)
+    assert 10.0 - west == pytest.approx(east - 10.0)
+
+    # Circles around a pole or across the antimeridian span all longitudes
+    assert Shape.circleBounds(89.9, 10.0, 50.0)[0::2] == (-180.0, 180.0)
+    assert Shape.circleBounds(89.9, 10.0, 50.0)[3] == 90.0
+    assert Shape.circleBounds(0.0, 179.9, 50.0)[0::2] == (-180.0, 180.0)
+
+    # The polygon has the area of the circle, and lies about on it
+    polygon = Shape.circlePolygon(60.0, 10.0, 50.0)
+    assert len(polygon.exterior.coords) == 65
+    assert Shape.projectPolygon(polygon).area == pytest.approx(math.pi*50e3**2, rel=1e-2)
+    lon, lat = polygon.exterior.xy
+    assert Shape.circleDistance(60.0, 10.0, lon, lat) == pytest.approx(50.0, rel=1e-3)
+
+    # A circle with radius zero is a tiny polygon around the point
+    polygon = Shape.circlePolygon(60.0, 10.0, 0.0)
+    assert polygon is not None
+    assert polygon.contains(shapely.geometry.Point(10.0, 60.0))
+    lon, lat = polygon.exterior.xy
+    assert Shape.circleDistance(60.0, 10.0, lon, lat) == pytest.approx(0.001, rel=1e-3)
+    west, south, east, north = Shape.circleBounds(60.0, 10.0, 0.0)
+    assert west < 10.0 < east and south < 60.0 < north
+
+    # A search polygon inside the circle
+    query = SearchShape(shapely.geometry.box(9.9, 59.9, 10.1, 60.1))
+    assert query.insideCircle(60.0, 10.0, 50.0) is True
+    assert query.insideCircle(60.0, 10.0, 10.0) is False
+    assert query.insideCircle(61.0, 10.0, 50.0) is False
+
+
+@pytest.mark.data
+def testDataShape_GridCoverage():
+    """Checks the grid cell keys and the coverage of a polygon."""
+    # Quadkeys
+    assert Shape.cellKey(0, 0, 1) == "0"
+    assert Shape.cellKey(1, 0, 1) == "1"
+    assert Shape.cellKey(0, 1, 1) == "2"
+    assert Shape.cellKey(5, 6, 3) == "321"
+    assert Shape.cellBounds("0") == (-180.0, 0.0, 0.0, 90.0)
+    assert Shape.cellBounds("3") == (0.0, -90.0, 180.0, 0.0)
+    assert Shape.cellBounds(Shape.cellKey(5, 6, 3)) == (45.0, -67.5, 90.0, -45.0)
+
+    # Cells fully inside the polygon have their full area
+    polygon = shapely.geometry.box(0.0, 0.0, 90.0, 45.0)
+    cells = Shape.gridCoverage(polygon, 3)
+    assert sorted(cells) == ["120", "121", "122", "123"]
+    for key, area in cells.items():
+        assert area == pytest.approx(Shape.boxArea(*Shape.cellBounds(key)))
+
+    # The cell areas add up to the polygon area
+    polygon = shapely.geometry.Polygon([(0.3, 0.3), (1.7, 0.3), (1.7, 1.3), (0.3, 0.3)])
+    cells = Shape.gridCoverage(polygon, 8)
+    assert len(cells) > 1
+    assert sum(cells.values()) == pytest.approx(
+        Shape.projectPolygon(polygon).area, rel=1e-3
+    )
+    assert Shape.gridCoverage(shapely.geometry.Polygon(), 8) == {}
+
+    # The search weights are the covered fraction of each cell
+    query = SearchShape(shapely.geometry.box(0.0, 0.0, 90.0, 45.0))
+    assert query.cellWeights(3) == {
+        key: pytest.approx(1.0) for key in ["120", "121", "122", "123"]
+    }
+    assert query.cellWeights(3) is query.cellWeights(3)
+
+
 @pytest.mark.parametrize(
     "fn", ["fylker_0.json", "kommuner_0.json", "kommuner_291.json"]
 )
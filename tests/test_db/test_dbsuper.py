@@ -27,7 +27,33 @@ def testDBSuper_Class():
     """Test the whole class."""
     theDB = Database()
 
+    with pytest.raises(NotImplementedError):
+        theDB.searchBounds(*([None]*5))
+
+    with pytest.raises(NotImplementedError):
+        theDB.searchGeocodes(None)
+
+    with pytest.raises(NotImplementedError):
+        theDB.findMapUUID(None)
+
+    with pytest.raises(NotImplementedError):
+        theDB.cellLevel()
+
+    with pytest.raises(NotImplementedError):
+        theDB.purgeMapTable()
+
+    with pytest.raises(NotImplementedError):
+        theDB.purgeAlertTable()
+
+    with pytest.raises(NotImplementedError):
+        theDB.setCellLevel(None)
+
+    assert theDB.flush() is True
+
     with pytest.raises(NotImplementedError):
         theDB.editMapRecord(*([None]*10))
 
+    with pytest.raises(NotImplementedError):
+        theDB.editAlertRecord(*([None]*13))
+
 # END Test testDBSuper_Class
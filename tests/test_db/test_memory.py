@@ -0,0 +1,1021 @@
+"""
+MetAlert Search : Memory DB Test
+================================
+
+Copyright 2021 MET Norway
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+"""
+
+import os
+import uuid
+import pytest
+import numpy as np
+
+from datetime import datetime, timedelta, timezone
+
+from tools import writeFile
+
+from ma_search.db.memory import MemoryDB
+from ma_search.db.sqlite import SQLiteDB
+
+
+@pytest.mark.db
+def testDBMemory_Snapshot(tmpConf, fncDir, caplog):
+    """Test saving and loading the snapshot file."""
+    snapFile = os.path.join(fncDir, "index.npz")
+
+    # No snapshot path
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+    assert theDB._snapFile is None
+    assert theDB.saveSnapshot() is False
+    assert theDB.loadSnapshot() is False
+    assert theDB.purgeAlertTable() is True
+    assert theDB.flush() is True
+    del theDB
+
+    # New snapshot, which is not written until there are changes
+    tmpConf.memoryPath = fncDir
+    theDB = MemoryDB()
+    assert theDB._isNew is True
+    assert theDB._isDirty is False
+    del theDB
+    assert not os.path.isfile(snapFile)
+
+    theDB = MemoryDB()
+
+    uuidOne = str(uuid.uuid4())
+    uuidTwo = str(uuid.uuid4())
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidOne, label="test label", source="test source",
+        coordSystem="WGS84", west=1, south=1, east=5, north=5, area=16,
+        meta={"admName": "test adm name"}
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidTwo, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=1, south=1, east=5, north=5, altitude=100, ceiling=200, area=16
+    ) is True
+
+    # Saved on flush, and not overwritten by an unchanged instance
+    # opened before the snapshot existed
+    otherDB = MemoryDB()
+    assert theDB._isDirty is True
+    assert theDB.flush() is True
+    assert os.path.isfile(snapFile)
+    assert theDB._isDirty is False
+    assert theDB.flush() is True
+    del theDB
+    del otherDB
+    with np.load(snapFile) as snap:
+        assert list(snap["AlertData.UUID"]) == [uuidTwo]
+
+    # Load it again
+    theDB = MemoryDB()
+    assert theDB._isNew is False
+    assert theDB._isDirty is False
+    assert theDB.searchBounds("map", 0, 0, 3, 3) == [(
+        1, uuidOne, "test label", "test source", "test adm name", None, None, None,
+        "WGS84", 1.0, 1.0, 5.0, 5.0, 16.0
+    )]
+    assert theDB.searchBounds("alert", 0, 0, 3, 3) == [(
+        1, uuidTwo, "mockAlert", mockDate.isoformat(), "mock.cap.xml", "WGS84",
+        1.0, 1.0, 5.0, 5.0, 100.0, 200.0, 16.0, 1, mockDate.isoformat(), None,
+        None, None, None, None, None
+    )]
+    assert theDB._nextID["MapData"] == 2
+    assert theDB._nextID["AlertData"] == 2
+
+    # Snapshots without the map tiles give each map a single tile
+    with np.load(snapFile) as snap:
+        arrays = {key: snap[key] for key in snap.files if not key.startswith("MapTiles.")}
+    with open(snapFile, mode="wb") as outFile:
+        np.savez(outFile, **arrays)
+    assert theDB.loadSnapshot() is True
+    assert theDB.searchTiles(0, 0, 3, 3) == [(uuidOne, -1, 1.0, 1.0, 5.0, 5.0, 16.0)]
+
+    # The grid level is saved, and snapshots without it have no known level
+    assert theDB.cellLevel() is None
+    assert theDB.setCellLevel(8) is True
+    assert theDB.flush() is True
+    assert theDB.loadSnapshot() is True
+    assert theDB.cellLevel() == 8
+    with np.load(snapFile) as snap:
+        arrays = {key: snap[key] for key in snap.files if key != "Info.GridLevel"}
+    with open(snapFile, mode="wb") as outFile:
+        np.savez(outFile, **arrays)
+    assert theDB.loadSnapshot() is True
+    assert theDB.cellLevel() is None
+
+    # Snapshots without the Valid column have all alerts valid
+    with np.load(snapFile) as snap:
+        arrays = {key: snap[key] for key in snap.files if key != "AlertData.Valid"}
+    with open(snapFile, mode="wb") as outFile:
+        np.savez(outFile, **arrays)
+    assert theDB.loadSnapshot() is True
+    assert theDB.searchBounds("alert", 0, 0, 3, 3)[0][13] == 1
+
+    # Snapshots without the vertical part columns take them from the alerts
+    with np.load(snapFile) as snap:
+        arrays = {
+            key: snap[key] for key in snap.files
+            if key not in ("AlertParts.Altitude", "AlertParts.Ceiling")
+        }
+    with open(snapFile, mode="wb") as outFile:
+        np.savez(outFile, **arrays)
+    assert theDB.loadSnapshot() is True
+    assert list(theDB._tables["AlertParts"]["Altitude"]) == [100.0]
+    assert list(theDB._tables["AlertParts"]["Ceiling"]) == [200.0]
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3, vertical=(150, 300))) == 1
+    assert theDB.searchBounds("alert", 0, 0, 3, 3, vertical=(300, 400)) == []
+
+    # Snapshots without the validity period start at the sent date
+    dropped = (
+        "AlertData.OnsetDate", "AlertData.ExpiresDate", "AlertParts.Onset", "AlertParts.Expires"
+    )
+    with np.load(snapFile) as snap:
+        arrays = {key: snap[key] for key in snap.files if key not in dropped}
+    with open(snapFile, mode="wb") as outFile:
+        np.savez(outFile, **arrays)
+    assert theDB.loadSnapshot() is True
+    assert theDB.searchBounds("alert", 0, 0, 3, 3)[0][14:16] == (mockDate.isoformat(), None)
+    assert theDB.searchBoundsAt(0, 0, 3, 3, datetime(2021, 1, 1, 11, 59, 59)) == []
+    assert len(theDB.searchBoundsAt(0, 0, 3, 3, datetime(2021, 1, 1, 12, 0, 0))) == 1
+    assert len(theDB.searchBoundsAt(0, 0, 3, 3, datetime(2031, 1, 1))) == 1
+
+    # Snapshots without the CAP fields have no values
+    with np.load(snapFile) as snap:
+        arrays = {
+            key: snap[key] for key in snap.files
+            if key not in ("AlertData.Event", "AlertData.AwarenessLevel")
+        }
+    with open(snapFile, mode="wb") as outFile:
+        np.savez(outFile, **arrays)
+    assert theDB.loadSnapshot() is True
+    assert theDB.searchBounds("alert", 0, 0, 3, 3)[0][16:] == (None, None, None, None, None)
+    assert theDB.searchBounds("alert", 0, 0, 3, 3, filters={"event": ["Kuling"]}) == []
+
+    # The snapshot is reloaded when written by another instance, but
+    # not when there are unsaved changes
+    uuidThree = str(uuid.uuid4())
+    otherDB = MemoryDB()
+    assert otherDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidThree, identifier="mockOther", sentDate=mockDate,
+        sourcePath="other.cap.xml", coordSystem="WGS84",
+        west=1, south=1, east=5, north=5, altitude=100, ceiling=200, area=16
+    ) is True
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3)) == 1
+    assert otherDB.flush() is True
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3)) == 2
+    theDB._isDirty = True
+    assert otherDB.editAlertRecord(
+        cmd="replace", recordUUID=str(uuid.uuid4()), identifier="mockOther",
+        sentDate=mockDate, sourcePath="other.cap.xml", coordSystem="WGS84",
+        west=1, south=1, east=5, north=5, altitude=100, ceiling=200, area=16
+    ) is True
+    assert otherDB.flush() is True
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3)) == 2
+    theDB._isDirty = False
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3)) == 3
+    del otherDB
+
+    # Broken snapshot, which is only reloaded once
+    writeFile(snapFile, "stuff")
+    caplog.clear()
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3)) == 3
+    assert "Could not load snapshot" in caplog.text
+    caplog.clear()
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3)) == 3
+    assert "Could not load snapshot" not in caplog.text
+    assert theDB.loadSnapshot() is False
+    assert "Could not load snapshot" in caplog.text
+
+    # Cannot write snapshot
+    os.unlink(snapFile)
+    os.mkdir(snapFile)
+    caplog.clear()
+    assert theDB.saveSnapshot() is False
+    assert "Could not write snapshot" in caplog.text
+    os.rmdir(snapFile)
+
+    del theDB
+
+# END Test testDBMemory_Snapshot
+
+
+@pytest.mark.db
+def testDBMemory_SearchBounds(tmpConf):
+    """Test searchBounds function."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+
+    # MapData Table
+    uuidOne = str(uuid.uuid4())
+    uuidTwo = str(uuid.uuid4())
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidOne, label="test label", source="test source",
+        coordSystem="WGS84", west=1, south=1, east=5, north=5, area=16,
+    ) is True
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidTwo, label="test label", source="test source",
+        coordSystem="WGS84", west=6, south=6, east=10, north=10, area=16,
+    ) is True
+
+    assert theDB.searchBounds("map", 0, 0, 3, 3)[0][1] == uuidOne
+    assert theDB.searchBounds("map", 7, 7, 9, 9)[0][1] == uuidTwo
+    assert len(theDB.searchBounds("map", 0, 0, 9, 9)) == 2
+    assert theDB.searchBounds("map", 20, 20, 30, 30) == []
+
+    # AlertData Table
+    uuidOne = str(uuid.uuid4())
+    uuidTwo = str(uuid.uuid4())
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidOne, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=1, south=1, east=5, north=5, altitude=100, ceiling=200, area=16
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidTwo, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=6, south=6, east=10, north=10, altitude=100, ceiling=200, area=16
+    ) is True
+
+    assert theDB.searchBounds("alert", 0, 0, 3, 3)[0][1] == uuidOne
+    assert theDB.searchBounds("alert", 7, 7, 9, 9)[0][1] == uuidTwo
+    assert len(theDB.searchBounds("alert", 0, 0, 9, 9)) == 2
+
+    # Multi-part alert with a gap between the parts
+    uuidThree = str(uuid.uuid4())
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidThree, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=20, south=20, east=40, north=40, altitude=100, ceiling=200, area=8,
+        parts=[(20, 20, 22, 22), (38, 38, 40, 40)]
+    ) is True
+    assert theDB.searchBounds("alert", 29, 29, 31, 31) == []
+    assert len(theDB.searchBounds("alert", 21, 21, 39, 39)) == 1
+
+    # Replacing the record also replaces the parts
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=uuidThree, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=20, south=20, east=40, north=40, altitude=100, ceiling=200, area=400
+    ) is True
+    assert theDB.searchBounds("alert", 29, 29, 31, 31)[0][1] == uuidThree
+    assert len(theDB._tables["AlertParts"]["UUID"]) == 3
+
+    # Vertical range, which must overlap the altitude and ceiling
+    assert theDB.editAlertRecord(
+        cmd="update", recordUUID=uuidTwo, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=6, south=6, east=10, north=10, altitude=3000.5, ceiling=4000.5, area=16
+    ) is True
+    assert len(theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(0, 10000))) == 2
+    assert [r[1] for r in theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(150, 250))] == [
+        uuidOne
+    ]
+    assert [r[1] for r in theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(4000, 5000))] == [
+        uuidTwo
+    ]
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(200, 3000.5)) == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(4000.5, 5000)) == []
+
+    # Validity period, where alerts without an end are in effect forever
+    uuidFour = str(uuid.uuid4())
+    utc = timezone.utc
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidFour, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=60, south=60, east=70, north=70, altitude=0, ceiling=0, area=100,
+        onsetDate=datetime(2021, 1, 2, 6, 0, 0, tzinfo=utc),
+        expiresDate=datetime(2021, 1, 2, 13, 0, 0, tzinfo=timezone(timedelta(hours=1)))
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=str(uuid.uuid4()), identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=60, south=60, east=70, north=70, altitude=0, ceiling=0, area=100,
+        onsetDate=datetime(2021, 1, 3, 0, 0, 0, tzinfo=utc)
+    ) is True
+    assert len(theDB.searchBounds("alert", 61, 61, 69, 69)) == 2
+    assert [r[1] for r in theDB.searchBoundsAt(
+        61, 61, 69, 69, datetime(2021, 1, 2, 6, 0, 0)
+    )] == [uuidFour]
+    assert theDB.searchBoundsAt(61, 61, 69, 69, datetime(2021, 1, 2, 5, 59, 59)) == []
+    assert theDB.searchBoundsAt(61, 61, 69, 69, datetime(2021, 1, 2, 12, 0, 0, tzinfo=utc)) == []
+    assert len(theDB.searchBoundsAt(61, 61, 69, 69, datetime(2031, 1, 1))) == 1
+    assert len(theDB.searchBoundsBetween(
+        61, 61, 69, 69, datetime(2021, 1, 2, 11, 0, 0), datetime(2021, 1, 3, 0, 0, 0)
+    )) == 2
+    assert theDB.searchBoundsBetween(
+        61, 61, 69, 69, datetime(2021, 1, 2, 12, 0, 0), datetime(2021, 1, 2, 23, 0, 0)
+    ) == []
+    assert [r[1] for r in theDB.searchBoundsBetween(
+        61, 61, 69, 69, datetime(2021, 1, 1), datetime(2021, 1, 2, 7), vertical=(-1, 1)
+    )] == [uuidFour]
+
+    # CAP field filters, where alerts without a value never match
+    uuidFive = str(uuid.uuid4())
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidFive, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=80, south=80, east=85, north=85, altitude=0, ceiling=0, area=25,
+        meta={"event": "Kuling", "severity": "Moderate", "awarenessLevel": 2, "stuff": 1}
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=str(uuid.uuid4()), identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=80, south=80, east=85, north=85, altitude=0, ceiling=0, area=25
+    ) is True
+    assert theDB.searchBounds("alert", 81, 81, 84, 84, filters={"event": ["Kuling"]})[0][16:] == (
+        "Kuling", None, "Moderate", None, 2
+    )
+    assert len(theDB.searchBounds("alert", 81, 81, 84, 84, filters={})) == 2
+    assert [r[1] for r in theDB.searchBounds("alert", 81, 81, 84, 84, filters={
+        "severity": ["Severe", "Moderate"], "awarenessLevel": [2, 3]
+    })] == [uuidFive]
+    assert theDB.searchBounds("alert", 81, 81, 84, 84, filters={"awarenessLevel": [3]}) == []
+    assert theDB.searchBounds("alert", 81, 81, 84, 84, filters={"urgency": ["Future"]}) == []
+    assert theDB.searchBounds("alert", 81, 81, 84, 84, filters={"stuff": ["Kuling"]}) is None
+
+    # Invalid target
+    assert theDB.searchBounds("stuff", 0, 0, 3, 3) is None
+
+    # Purge
+    assert theDB.purgeMapTable() is True
+    assert theDB.purgeAlertTable() is True
+    assert theDB.searchBounds("map", 0, 0, 9, 9) == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9) == []
+
+# END Test testDBMemory_SearchBounds
+
+
+@pytest.mark.db
+def testDBMemory_SameAsSQLite(tmpConf, fncDir):
+    """Test that the searches give the same results as the SQLite
+    provider.
+    """
+    tmpConf.memoryPath = None
+    tmpConf.sqlitePath = fncDir
+    providers = [MemoryDB(), SQLiteDB()]
+
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    uuidOne = str(uuid.uuid4())
+    for theDB in providers:
+        assert theDB.editAlertRecord(
+            cmd="insert", recordUUID=uuidOne, identifier="mockAlert", sentDate=mockDate,
+            sourcePath="mock.cap.xml", coordSystem="WGS84",
+            west=1, south=1, east=5, north=5, altitude=0, ceiling=0, area=16,
+            meta={"event": "Wind", "awarenessLevel": 2},
+        ) is True
+
+    # Filter values are not cut to the length of the stored values
+    for filters, expected in [
+        ({"event": ["Wind"]}, [uuidOne]),
+        ({"event": ["Windstorm"]}, []),
+        ({"event": ["Win"]}, []),
+        ({"awarenessLevel": [2]}, [uuidOne]),
+        ({"awarenessLevel": [2.5]}, []),
+    ]:
+        for theDB in providers:
+            result = theDB.searchBounds("alert", 0, 0, 3, 3, filters=filters)
+            assert [r[1] for r in result] == expected
+
+    # Surface alerts have no thickness, and match ranges from the ground
+    uuidTwo = str(uuid.uuid4())
+    for theDB in providers:
+        assert theDB.editAlertRecord(
+            cmd="insert", recordUUID=uuidTwo, identifier="mockAlert", sentDate=mockDate,
+            sourcePath="mock.cap.xml", coordSystem="WGS84",
+            west=1, south=1, east=5, north=5, altitude=100, ceiling=200, area=16,
+        ) is True
+    for vertical, expected in [
+        ((0, 500), [uuidOne, uuidTwo]),
+        ((-100, 0), [uuidOne]),
+        ((0, 100), [uuidOne]),
+        ((1, 150), [uuidTwo]),
+        ((200, 300), []),
+    ]:
+        for theDB in providers:
+            result = theDB.searchBounds("alert", 0, 0, 3, 3, vertical=vertical)
+            assert sorted(r[1] for r in result) == sorted(expected)
+
+    # A point on the edge of the bounds only matches if inclusive
+    uuidMap = str(uuid.uuid4())
+    for theDB in providers:
+        assert theDB.editMapRecord(
+            cmd="insert", recordUUID=uuidMap, label="test label", source="test source",
+            coordSystem="WGS84", west=1, south=1, east=5, north=5, area=16,
+        ) is True
+    for point, inclusive, expected in [
+        ((5, 3, 5, 3), False, 0),
+        ((5, 3, 5, 3), True, 1),
+        ((1, 1, 1, 1), True, 1),
+        ((5.5, 3, 5.5, 3), True, 0),
+    ]:
+        for theDB in providers:
+            assert len(theDB.searchBounds("map", *point, inclusive=inclusive)) == expected
+            assert len(theDB.searchTiles(*point, inclusive=inclusive)) == expected
+            result = theDB.searchBounds("alert", *point, inclusive=inclusive)
+            assert len(result) == 2*expected
+
+# END Test testDBMemory_SameAsSQLite
+
+
+@pytest.mark.db
+def testDBMemory_EditMapRecord(tmpConf, caplog):
+    """Test MapData table INSERT, REPLACE and UPDATE."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+
+    # Test Error Checking
+    newUUID = str(uuid.uuid4())
+
+    caplog.clear()
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID="stuff", label="test label", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272
+    ) is False
+    assert "The UUID 'stuff' is not valid" in caplog.text
+
+    caplog.clear()
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=newUUID, label="test label", source="test source",
+        coordSystem="WGS84", west=-10, south=-200, east=8, north=7, area=272
+    ) is False
+    assert "Coordinates must be in the range (-90 <= south < north <= 90)" in caplog.text
+
+    caplog.clear()
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=newUUID, label="test label", source="test source",
+        coordSystem="WGS84", west=-200, south=-9, east=8, north=7, area=272
+    ) is False
+    assert "Coordinates must be in the range (-180 <= west < east <= 180)" in caplog.text
+
+    # Insert
+    uuidOne = str(uuid.uuid4())
+    uuidTwo = str(uuid.uuid4())
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidOne, label="test label", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272,
+        validFrom=datetime(2021, 1, 1, 0, 0, 0),
+        validTo=datetime(2021, 12, 31, 23, 59, 59),
+        meta={
+            "admName": "test adm name",
+            "admID": "test adm ID"
+        }
+    ) is True
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidTwo, label="test label", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272
+    ) is True
+
+    theData = theDB.searchBounds("map", -90, -90, 90, 90)
+    assert theData[0] == (
+        1, uuidOne, "test label", "test source", "test adm name", "test adm ID",
+        "2021-01-01T00:00:00", "2021-12-31T23:59:59", "WGS84", -10.0, -9.0, 8.0, 7.0, 272.0
+    )
+    assert theData[1] == (
+        2, uuidTwo, "test label", "test source", None, None, None, None,
+        "WGS84", -10.0, -9.0, 8.0, 7.0, 272.0
+    )
+
+    # Update, with a longer label than before
+    assert theDB.editMapRecord(
+        cmd="update", recordUUID=uuidTwo, label="a much longer label", source="new source",
+        coordSystem="WGS84", west=-11, south=-10, east=7, north=6, area=272,
+        meta={"admID": "new adm ID"}
+    ) is True
+
+    theData = theDB.searchBounds("map", -90, -90, 90, 90)
+    assert theData[1] == (
+        2, uuidTwo, "a much longer label", "new source", None, "new adm ID", None, None,
+        "WGS84", -11.0, -10.0, 7.0, 6.0, 272.0
+    )
+
+    # Replace moves the record to the end with a new ID
+    assert theDB.editMapRecord(
+        cmd="replace", recordUUID=uuidOne, label="test label", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272
+    ) is True
+
+    theData = theDB.searchBounds("map", -90, -90, 90, 90)
+    assert len(theData) == 2
+    assert theData[0][:2] == (2, uuidTwo)
+    assert theData[1][:2] == (3, uuidOne)
+
+    # Insert: Non-unique UUID
+    caplog.clear()
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidTwo, label="test label", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272
+    ) is False
+    assert "UNIQUE constraint failed: MapData.UUID" in caplog.text
+
+    # Update: Set a required argument to None
+    caplog.clear()
+    assert theDB.editMapRecord(
+        cmd="update", recordUUID=uuidTwo, label=None, source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272
+    ) is False
+    assert "NOT NULL constraint failed: MapData.Label" in caplog.text
+
+    # Invalid Command
+    caplog.clear()
+    assert theDB.editMapRecord(
+        cmd="blabla", recordUUID=newUUID, label="test label", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272
+    ) is False
+    assert "Unknown command 'blabla'" in caplog.text
+
+# END Test testDBMemory_EditMapRecord
+
+
+@pytest.mark.db
+def testDBMemory_FindMapUUID(tmpConf):
+    """Test lookup of map records by administrative ID."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+
+    uuidOne = str(uuid.uuid4())
+    uuidTwo = str(uuid.uuid4())
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidOne, label="Kommune", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272,
+        meta={"admName": "Oslo", "admID": "0301"}
+    ) is True
+    assert theDB.findMapUUID("0301") == uuidOne
+    assert theDB.findMapUUID("5001") is None
+
+    # The most recently added record wins
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidTwo, label="Kommune", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272,
+        meta={"admName": "Oslo", "admID": "0301"}
+    ) is True
+    assert theDB.findMapUUID("0301") == uuidTwo
+
+    # Broken table
+    theDB._tables["MapData"] = {}
+    assert theDB.findMapUUID("0301") is None
+
+# END Test testDBMemory_FindMapUUID
+
+
+@pytest.mark.db
+def testDBMemory_EditAlertRecord(tmpConf, caplog):
+    """Test AlertData table INSERT, REPLACE and UPDATE."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+
+    # Test Error Checking
+    newUUID = str(uuid.uuid4())
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID="stuff", identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=8, north=7, altitude=100, ceiling=200, area=272
+    ) is False
+    assert "The UUID 'stuff' is not valid" in caplog.text
+
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-200, east=8, north=7, altitude=100, ceiling=200, area=272
+    ) is False
+    assert "Coordinates must be in the range (-90 <= south < north <= 90)" in caplog.text
+
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-200, south=-9, east=8, north=7, altitude=100, ceiling=200, area=272
+    ) is False
+    assert "Coordinates must be in the range (-180 <= west < east <= 180)" in caplog.text
+
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=-8, north=7, altitude=300, ceiling=200, area=272
+    ) is False
+    assert "Ceiling must be greater or equal to altitude" in caplog.text
+
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=None,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=-8, north=7, altitude=100, ceiling=200, area=272
+    ) is False
+    assert "SentDate must be a datetime object" in caplog.text
+
+    # Wrong Validity Period
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=-8, north=7, altitude=100, ceiling=200, area=272,
+        onsetDate="2021-01-01", expiresDate="2021-01-02"
+    ) is False
+    assert "OnsetDate must be a datetime object" in caplog.text
+    assert "ExpiresDate must be a datetime object or None" in caplog.text
+
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=-8, north=7, altitude=100, ceiling=200, area=272,
+        expiresDate=datetime(2020, 12, 31)
+    ) is False
+    assert "ExpiresDate must be later than OnsetDate" in caplog.text
+
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=-8, north=7, altitude=100, ceiling=200, area=272,
+        parts=[(1, 2, 3)]
+    ) is False
+    assert "Parts must be a list of (west, south, east, north) bounds" in caplog.text
+
+    # Insert
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=8, north=7, altitude=100, ceiling=200, area=272
+    ) is True
+
+    theData = theDB.searchBounds("alert", -90, -90, 90, 90)
+    assert theData[0] == (
+        1, newUUID, "mockAlert", mockDate.isoformat(), "mock.cap.xml", "WGS84",
+        -10.0, -9.0, 8.0, 7.0, 100.0, 200.0, 272.0, 1, mockDate.isoformat(), None,
+        None, None, None, None, None
+    )
+
+    # Update
+    assert theDB.editAlertRecord(
+        cmd="update", recordUUID=newUUID, identifier="mockAlert2", sentDate=mockDate,
+        sourcePath="mock2.cap.xml", coordSystem="WGS84",
+        west=-11, south=-10, east=7, north=6, altitude=50, ceiling=150, area=272,
+        valid=False
+    ) is True
+
+    theData = theDB.searchBounds("alert", -90, -90, 90, 90)
+    assert theData[0] == (
+        1, newUUID, "mockAlert2", mockDate.isoformat(), "mock2.cap.xml", "WGS84",
+        -11.0, -10.0, 7.0, 6.0, 50.0, 150.0, 272.0, 0, mockDate.isoformat(), None,
+        None, None, None, None, None
+    )
+
+    # Replace
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=newUUID, identifier="mockAlert3", sentDate=mockDate,
+        sourcePath="mock3.cap.xml", coordSystem="WGS84",
+        west=-11, south=-10, east=7, north=6, altitude=50, ceiling=150, area=272,
+        valid=False
+    ) is True
+
+    theData = theDB.searchBounds("alert", -90, -90, 90, 90)
+    assert len(theData) == 1
+    assert theData[0][:3] == (2, newUUID, "mockAlert3")
+
+    # Insert: Non-unique UUID
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=8, north=7, altitude=100, ceiling=200, area=272
+    ) is False
+    assert "UNIQUE constraint failed: AlertData.UUID" in caplog.text
+
+    # Update: Set a required argument to None
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="update", recordUUID=newUUID, identifier=None, sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=8, north=7, altitude=100, ceiling=200, area=272
+    ) is False
+    assert "NOT NULL constraint failed: AlertData.Identifier" in caplog.text
+
+    # Invalid Command
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="blabla", recordUUID=str(uuid.uuid4()), identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=8, north=7, altitude=100, ceiling=200, area=272
+    ) is False
+    assert "Unknown command 'blabla'" in caplog.text
+
+# END Test testDBMemory_EditAlertRecord
+
+
+@pytest.mark.db
+def testDBMemory_BufferedEdits(tmpConf):
+    """Test that edits are buffered and applied once before a search."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    uuids = [str(uuid.uuid4()) for _ in range(100)]
+
+    def editAlert(cmd, alertUUID, west, identifier="mockAlert"):
+        return theDB.editAlertRecord(
+            cmd=cmd, recordUUID=alertUUID, identifier=identifier, sentDate=mockDate,
+            sourcePath="mock.cap.xml", coordSystem="WGS84",
+            west=west, south=0, east=west + 1, north=1, altitude=0, ceiling=1, area=1,
+            cells={"120": 1.0}, geocodes=[("kommune", "0301")], areaDesc={"no": identifier}
+        )
+
+    # Inserts are buffered, and duplicates are caught before they are applied
+    for west in range(100):
+        assert editAlert("insert", uuids[west], west) is True
+    assert editAlert("insert", uuids[0], 0) is False
+    assert len(theDB._tables["AlertData"]["UUID"]) == 0
+    assert len(theDB._pending["AlertData"]) == 100
+
+    # Replacing a buffered record replaces its buffered rows
+    assert editAlert("replace", uuids[0], 50, identifier="replaced") is True
+    assert editAlert("update", uuids[1], 60, identifier="updated") is True
+
+    assert len(theDB.searchBounds("alert", -180, -90, 180, 90)) == 100
+    assert theDB._pending["AlertData"] == {}
+    assert len(theDB._tables["AlertParts"]["UUID"]) == 100
+    assert len(theDB._tables["AlertCells"]["UUID"]) == 100
+    assert sorted(row[2] for row in theDB.searchBounds("alert", 50.2, 0.2, 50.8, 0.8)) == [
+        "mockAlert", "replaced"
+    ]
+    assert sorted(row[2] for row in theDB.searchBounds("alert", 60.2, 0.2, 60.8, 0.8)) == [
+        "mockAlert", "updated"
+    ]
+    assert theDB.searchBounds("alert", 0.2, 0.2, 1.8, 0.8) == []
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 99, 1, text="replaced")] == [
+        "replaced"
+    ]
+
+    # Replacing an applied record removes its old rows from every table
+    assert editAlert("replace", uuids[2], 70) is True
+    assert len(theDB.searchGeocodes([("kommune", "0301")])) == 100
+    assert len(theDB._tables["AlertData"]["UUID"]) == 100
+    assert len(theDB._tables["AlertGeocodes"]["UUID"]) == 100
+    assert len(theDB._tables["AlertText"]["UUID"]) == 100
+    assert theDB.searchBounds("alert", 2.2, 0.2, 2.8, 0.8) == []
+
+# END Test testDBMemory_BufferedEdits
+
+
+@pytest.mark.db
+def testDBMemory_OverlapCells(tmpConf, caplog):
+    """Test the grid cell coverage of alerts."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    uuidA = str(uuid.uuid4())
+    uuidB = str(uuid.uuid4())
+
+    # Cells must be a dictionary
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4, cells=["0"]
+    ) is False
+    assert "Cells must be a dictionary of areas by quadkey" in caplog.text
+
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        cells={"01": 2.0, "02": 2.0}
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidB, identifier="mockB", sentDate=mockDate,
+        sourcePath="b.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=1,
+        cells={"02": 1.0}
+    ) is True
+
+    assert sorted(theDB.overlapCells({"01": 0.5, "02": 1.0, "03": 1.0})) == sorted([
+        (uuidA, 3.0), (uuidB, 1.0)
+    ])
+    assert theDB.overlapCells({"03": 1.0}) == []
+
+    # Look up by cell
+    assert sorted(row[2] for row in theDB.searchCells(["01", "02"])) == ["mockA", "mockB"]
+    assert [row[2] for row in theDB.searchCells(["01", "03"])] == ["mockA"]
+    assert theDB.searchCells(["03"]) == []
+    assert theDB.searchCells([]) == []
+
+    # Replacing the record replaces its cells
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        cells={"03": 4.0}
+    ) is True
+    assert theDB.overlapCells({"01": 1.0, "03": 0.5}) == [(uuidA, 2.0)]
+    assert [row[2] for row in theDB.searchCells(["01", "03"])] == ["mockA"]
+    assert theDB.searchCells(["01"]) == []
+
+# END Test testDBMemory_OverlapCells
+
+
+@pytest.mark.db
+def testDBMemory_SearchGeocodes(tmpConf, caplog):
+    """Test the geocode lookup of alerts."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    uuidA = str(uuid.uuid4())
+    uuidB = str(uuid.uuid4())
+
+    # Geocodes must be a list of pairs of strings
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        geocodes=[("kommune", 301)]
+    ) is False
+    assert "Geocodes must be a list of (valueName, value) pairs" in caplog.text
+
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        geocodes=[("kommune", "0301"), ("MET_areaID", "area1")]
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidB, identifier="mockB", sentDate=mockDate,
+        sourcePath="b.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=1000, ceiling=2000, area=4,
+        geocodes=[("kommune", "3005")], meta={"severity": "Severe"}
+    ) is True
+
+    # Look up by geocode, where both the value name and value must match
+    assert [row[2] for row in theDB.searchGeocodes([("kommune", "0301")])] == ["mockA"]
+    assert [row[2] for row in theDB.searchGeocodes([("MET_areaID", "0301")])] == []
+    assert sorted(row[2] for row in theDB.searchGeocodes([
+        ("kommune", "3005"), ("MET_areaID", "area1")
+    ])) == ["mockA", "mockB"]
+    assert theDB.searchGeocodes([]) == []
+
+    # The vertical range and filters are applied
+    geocodes = [("kommune", "0301"), ("kommune", "3005")]
+    assert [row[2] for row in theDB.searchGeocodes(geocodes, vertical=(0, 500))] == ["mockA"]
+    assert [row[2] for row in theDB.searchGeocodes(
+        geocodes, filters={"severity": ["Severe"]}
+    )] == ["mockB"]
+    assert theDB.searchGeocodes(geocodes, period=(datetime(2020, 1, 1), None)) != []
+    assert theDB.searchGeocodes(geocodes, period=(None, datetime(2020, 1, 1))) == []
+
+    # Replacing the record replaces its geocodes
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        geocodes=[("kommune", "0302")]
+    ) is True
+    assert theDB.searchGeocodes([("kommune", "0301")]) == []
+    assert [row[2] for row in theDB.searchGeocodes([("kommune", "0302")])] == ["mockA"]
+
+# END Test testDBMemory_SearchGeocodes
+
+
+@pytest.mark.db
+def testDBMemory_SearchText(tmpConf, caplog):
+    """Test the text search of alerts."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    uuidA = str(uuid.uuid4())
+    uuidB = str(uuid.uuid4())
+
+    # The area description must be a dictionary of strings
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        areaDesc="Måløy - Svinøy"
+    ) is False
+    assert "AreaDesc must be a dictionary of descriptions by language" in caplog.text
+
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        areaDesc={"no": "Måløy - Svinøy", "en-GB": "Maaloey - Svinoey"}
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidB, identifier="mockB", sentDate=mockDate,
+        sourcePath="b.cap.xml", coordSystem="WGS84",
+        west=4, south=4, east=6, north=6, altitude=0, ceiling=1, area=4,
+        areaDesc={"no": "Sogn og Fjordane", "en-GB": "Sogn and Fjordane"},
+        meta={"severity": "Severe"}
+    ) is True
+
+    # Words are matched in any language, ignoring case and diacritics
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="måløy")] == ["mockA"]
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="MALØY")] == ["mockA"]
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="maaloey")] == ["mockA"]
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="Sogn")] == ["mockB"]
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Måløy Fjordane") == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Mål") == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text=" - ") == []
+
+    # All words must be found in the description of one language
+    assert [row[2] for row in theDB.searchBounds(
+        "alert", 0, 0, 9, 9, text="Sogn og Fjordane"
+    )] == ["mockB"]
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="og and") == []
+
+    # Words that are operators in FTS5 are matched as words
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Sogn AND NOT") == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text='"Sogn" * (og)') != []
+
+    # The text is combined with the other filters
+    assert theDB.searchBounds("alert", 0, 0, 3, 3, text="Sogn") == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Sogn", vertical=(5, 9)) == []
+    assert theDB.searchBounds(
+        "alert", 0, 0, 9, 9, text="Sogn", filters={"severity": ["Minor"]}
+    ) == []
+    assert theDB.searchCells([], text="Sogn") == []
+    assert theDB.searchGeocodes([], text="Sogn") == []
+
+    # Replacing the record replaces its descriptions
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        areaDesc={"no": "Florø"}
+    ) is True
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Måløy") == []
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="florø")] == ["mockA"]
+
+# END Test testDBMemory_SearchText
+
+
+@pytest.mark.db
+def testDBMemory_SearchTiles(tmpConf, caplog):
+    """Test the tiles of map records."""
+    tmpConf.memoryPath = None
+    theDB = MemoryDB()
+    uuidA = str(uuid.uuid4())
+    uuidB = str(uuid.uuid4())
+
+    # Tiles must have bounds and an area
+    caplog.clear()
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidA, label="mockA", source="test", coordSystem="WGS84",
+        west=0, south=0, east=2, north=1, area=2, tiles=[(0, 0, 1, 1)]
+    ) is False
+    assert "Tiles must be a list of (west, south, east, north, area) tuples" in caplog.text
+
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidA, label="mockA", source="test", coordSystem="WGS84",
+        west=0, south=0, east=2, north=1, area=2, tiles=[(0, 0, 1, 1, 1.5), (1, 0, 2, 1, 0.5)]
+    ) is True
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidB, label="mockB", source="test", coordSystem="WGS84",
+        west=5, south=5, east=6, north=6, area=1
+    ) is True
+
+    # Records without tiles are a single tile numbered -1
+    assert sorted(theDB.searchTiles(0.5, 0.5, 5.5, 5.5)) == sorted([
+        (uuidA, 0, 0.0, 0.0, 1.0, 1.0, 1.5),
+        (uuidA, 1, 1.0, 0.0, 2.0, 1.0, 0.5),
+        (uuidB, -1, 5.0, 5.0, 6.0, 6.0, 1.0),
+    ])
+    assert theDB.searchTiles(1.5, 0.5, 2.5, 0.8) == [(uuidA, 1, 1.0, 0.0, 2.0, 1.0, 0.5)]
+    assert theDB.searchTiles(3.0, 3.0, 4.0, 4.0) == []
+
+    # Updating the record replaces its tiles
+    assert theDB.editMapRecord(
+        cmd="update", recordUUID=uuidA, label="mockA", source="test", coordSystem="WGS84",
+        west=0, south=0, east=2, north=1, area=2
+    ) is True
+    assert theDB.searchTiles(0.5, 0.5, 1.5, 0.8) == [(uuidA, -1, 0.0, 0.0, 2.0, 1.0, 2.0)]
+
+    # Purging the maps also removes the tiles
+    assert theDB.purgeMapTable() is True
+    assert theDB.searchTiles(-180.0, -90.0, 180.0, 90.0) == []
+
+# END Test testDBMemory_SearchTiles
@@ -21,13 +21,13 @@ import os
 import uuid
 import pytest
 
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
 from ma_search.db.sqlite import SQLiteDB
 
 
 @pytest.mark.db
-def testDBSQLite_Init(tmpConf, tmpDir):
+def testDBSQLite_Init(tmpConf, tmpDir, caplog):
     """Test class initialisation and creation of default DB.
 
     Should check that the tables are created, but the create functions
@@ -50,6 +50,7 @@ def testDBSQLite_Init(tmpConf, tmpDir):
     cursor.close()
     assert ("MapData",) in tables
     assert ("AlertData",) in tables
+    assert ("AlertParts",) in tables
 
     # Close and delete object
     del theDB
@@ -59,6 +60,136 @@ def testDBSQLite_Init(tmpConf, tmpDir):
     assert os.path.isfile(dbFile)
     assert theDB._isNew is False
 
+    # Re-open a DB without the AlertParts table
+    theDB._conn.execute("DROP TABLE AlertParts;")
+    del theDB
+    caplog.clear()
+    theDB = SQLiteDB()
+    assert "The alert index is outdated and must be rebuilt" in caplog.text
+    cursor = theDB._conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+    assert ("AlertParts",) in cursor.fetchall()
+    cursor.close()
+
+    # Re-open a DB without the Valid column
+    theDB._conn.execute("ALTER TABLE AlertData DROP COLUMN Valid;")
+    del theDB
+    caplog.clear()
+    theDB = SQLiteDB()
+    assert "Adding the Valid column to the alert index" in caplog.text
+    cursor = theDB._conn.execute("PRAGMA table_info('AlertData');")
+    assert "Valid" in [column[1] for column in cursor.fetchall()]
+    cursor.close()
+
+    # Re-open a DB with AlertParts without altitude and ceiling
+    aUUID = str(uuid.uuid4())
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=aUUID, identifier="mockAlert",
+        sentDate=datetime(2021, 1, 1, 12, 0, 0), sourcePath="mock.cap.xml",
+        coordSystem="WGS84", west=1, south=1, east=5, north=5, altitude=100, ceiling=200,
+        area=16, parts=[(1, 1, 2, 2), (4, 4, 5, 5)]
+    ) is True
+    theDB._conn.execute("DROP TABLE AlertParts;")
+    theDB._conn.execute(
+        "CREATE VIRTUAL TABLE AlertParts USING rtree("
+        "ID, BoundWest, BoundEast, BoundSouth, BoundNorth, +UUID TEXT);"
+    )
+    theDB._conn.executemany(
+        "INSERT INTO AlertParts (BoundWest, BoundSouth, BoundEast, BoundNorth, UUID) "
+        "VALUES (?, ?, ?, ?, ?);", [(1, 1, 2, 2, aUUID), (4, 4, 5, 5, aUUID)]
+    )
+    theDB._conn.commit()
+    del theDB
+    caplog.clear()
+    theDB = SQLiteDB()
+    assert "Adding altitude and ceiling to the alert parts index" in caplog.text
+    cursor = theDB._conn.execute(
+        "SELECT BoundWest, Altitude, Ceiling, UUID FROM AlertParts ORDER BY BoundWest;"
+    )
+    assert cursor.fetchall() == [(1.0, 100.0, 200.0, aUUID), (4.0, 100.0, 200.0, aUUID)]
+    cursor.close()
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3, vertical=(150, 300))) == 1
+
+    # Re-open a DB without the onset and expires dates
+    theDB._conn.execute("ALTER TABLE AlertData DROP COLUMN OnsetDate;")
+    theDB._conn.execute("ALTER TABLE AlertData DROP COLUMN ExpiresDate;")
+    theDB._conn.execute("DROP TABLE AlertParts;")
+    theDB._conn.execute(
+        "CREATE VIRTUAL TABLE AlertParts USING rtree("
+        "ID, BoundWest, BoundEast, BoundSouth, BoundNorth, Altitude, Ceiling, +UUID TEXT);"
+    )
+    theDB._conn.execute(
+        "INSERT INTO AlertParts (BoundWest, BoundSouth, BoundEast, BoundNorth, "
+        "Altitude, Ceiling, UUID) VALUES (1, 1, 5, 5, 100, 200, ?);", (aUUID,)
+    )
+    theDB._conn.commit()
+    del theDB
+    caplog.clear()
+    theDB = SQLiteDB()
+    assert "Adding the onset and expires columns to the alert index" in caplog.text
+    assert "Adding onset and expires to the alert parts index" in caplog.text
+    cursor = theDB._conn.execute("SELECT SentDate, OnsetDate, ExpiresDate FROM AlertData;")
+    assert cursor.fetchall() == [("2021-01-01T12:00:00", "2021-01-01T12:00:00", None)]
+    cursor.close()
+    assert theDB.searchBoundsAt(0, 0, 3, 3, datetime(2021, 1, 1, 11, 59, 59)) == []
+    assert len(theDB.searchBoundsAt(0, 0, 3, 3, datetime(2021, 1, 1, 12, 0, 0))) == 1
+    assert len(theDB.searchBoundsAt(0, 0, 3, 3, datetime(2031, 1, 1))) == 1
+
+    # Re-open a DB without the CAP field columns
+    for column in ("Event", "Urgency", "Severity", "Certainty", "AwarenessLevel"):
+        theDB._conn.execute(f"DROP INDEX AlertData{column};")
+        theDB._conn.execute(f"ALTER TABLE AlertData DROP COLUMN {column};")
+    theDB._conn.commit()
+    del theDB
+    caplog.clear()
+    theDB = SQLiteDB()
+    assert "Adding the CAP field columns to the alert index" in caplog.text
+    assert theDB.searchBounds("alert", 0, 0, 3, 3)[0][16:] == (None, None, None, None, None)
+    assert theDB.searchBounds("alert", 0, 0, 3, 3, filters={"event": ["Kuling"]}) == []
+
+    # Re-open a DB without the geocode table
+    theDB._conn.execute("DROP TABLE AlertGeocodes;")
+    theDB._conn.commit()
+    del theDB
+    caplog.clear()
+    theDB = SQLiteDB()
+    assert "Adding the geocode table to the alert index" in caplog.text
+    assert theDB.searchGeocodes([("kommune", "0301")]) == []
+
+    # Re-open a DB without the text table
+    theDB._conn.execute("DROP TABLE AlertText;")
+    theDB._conn.commit()
+    del theDB
+    caplog.clear()
+    theDB = SQLiteDB()
+    assert "Adding the text table to the alert index" in caplog.text
+    assert theDB.searchBounds("alert", 0, 0, 3, 3, text="Oslo") == []
+
+    # Re-open a DB without the map tiles table, which gives each map a single tile
+    mUUID = str(uuid.uuid4())
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=mUUID, label="test label", source="test source",
+        coordSystem="WGS84", west=1, south=1, east=5, north=5, area=16
+    ) is True
+    theDB._conn.execute("DROP TABLE MapTiles;")
+    theDB._conn.commit()
+    del theDB
+    caplog.clear()
+    theDB = SQLiteDB()
+    assert "Adding the tiles table to the map index" in caplog.text
+    assert theDB.searchTiles(0, 0, 3, 3) == [(mUUID, -1, 1.0, 1.0, 5.0, 5.0, 16.0)]
+
+    # Re-open a DB without the index info table, which has no known grid level
+    assert theDB.setCellLevel(8) is True
+    assert theDB.cellLevel() == 8
+    theDB._conn.execute("DROP TABLE IndexInfo;")
+    theDB._conn.commit()
+    del theDB
+    theDB = SQLiteDB()
+    assert theDB.cellLevel() is None
+    assert theDB.purgeAlertTable() is True
+    assert theDB.cellLevel() == tmpConf.searchGridLevel
+    del theDB
+
     # Cleanup
     os.unlink(dbFile)
     assert not os.path.isfile(dbFile)
@@ -242,6 +373,105 @@ def testDBSQLite_SearchBounds(tmpConf, fncDir):
     assert theDB.searchBounds("alert", 7, 7, 9, 9)[0][1] == uuidTwo
     assert len(theDB.searchBounds("alert", 0, 0, 9, 9)) == 2
 
+    # Multi-part alert with a gap between the parts
+    uuidThree = str(uuid.uuid4())
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidThree, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=20, south=20, east=40, north=40, altitude=100, ceiling=200, area=8,
+        parts=[(20, 20, 22, 22), (38, 38, 40, 40)]
+    ) is True
+    assert theDB.searchBounds("alert", 29, 29, 31, 31) == []
+    assert theDB.searchBounds("alert", 21, 21, 39, 39)[0][1] == uuidThree
+    assert len(theDB.searchBounds("alert", 21, 21, 39, 39)) == 1
+
+    # Replacing the record also replaces the parts
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=uuidThree, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=20, south=20, east=40, north=40, altitude=100, ceiling=200, area=400
+    ) is True
+    assert theDB.searchBounds("alert", 29, 29, 31, 31)[0][1] == uuidThree
+    cursor = theDB._conn.execute("SELECT ID FROM AlertParts;")
+    assert len(cursor.fetchall()) == 3
+    cursor.close()
+
+    # Vertical range, which must overlap the altitude and ceiling
+    assert theDB.editAlertRecord(
+        cmd="update", recordUUID=uuidTwo, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=6, south=6, east=10, north=10, altitude=3000.5, ceiling=4000.5, area=16
+    ) is True
+    assert len(theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(0, 10000))) == 2
+    assert [r[1] for r in theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(150, 250))] == [
+        uuidOne
+    ]
+    assert [r[1] for r in theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(4000, 5000))] == [
+        uuidTwo
+    ]
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(200, 3000.5)) == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, vertical=(4000.5, 5000)) == []
+
+    # Validity period, where alerts without an end are in effect forever
+    uuidFour = str(uuid.uuid4())
+    utc = timezone.utc
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidFour, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=60, south=60, east=70, north=70, altitude=0, ceiling=0, area=100,
+        onsetDate=datetime(2021, 1, 2, 6, 0, 0, tzinfo=utc),
+        expiresDate=datetime(2021, 1, 2, 13, 0, 0, tzinfo=timezone(timedelta(hours=1)))
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=str(uuid.uuid4()), identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=60, south=60, east=70, north=70, altitude=0, ceiling=0, area=100,
+        onsetDate=datetime(2021, 1, 3, 0, 0, 0, tzinfo=utc)
+    ) is True
+    assert len(theDB.searchBounds("alert", 61, 61, 69, 69)) == 2
+    assert [r[1] for r in theDB.searchBoundsAt(
+        61, 61, 69, 69, datetime(2021, 1, 2, 6, 0, 0)
+    )] == [uuidFour]
+    assert theDB.searchBoundsAt(61, 61, 69, 69, datetime(2021, 1, 2, 5, 59, 59)) == []
+    assert theDB.searchBoundsAt(61, 61, 69, 69, datetime(2021, 1, 2, 12, 0, 0, tzinfo=utc)) == []
+    assert len(theDB.searchBoundsAt(61, 61, 69, 69, datetime(2031, 1, 1))) == 1
+    assert len(theDB.searchBoundsBetween(
+        61, 61, 69, 69, datetime(2021, 1, 2, 11, 0, 0), datetime(2021, 1, 3, 0, 0, 0)
+    )) == 2
+    assert theDB.searchBoundsBetween(
+        61, 61, 69, 69, datetime(2021, 1, 2, 12, 0, 0), datetime(2021, 1, 2, 23, 0, 0)
+    ) == []
+    assert [r[1] for r in theDB.searchBoundsBetween(
+        61, 61, 69, 69, datetime(2021, 1, 1), datetime(2021, 1, 2, 7), vertical=(-1, 1)
+    )] == [uuidFour]
+
+    # CAP field filters, where alerts without a value never match
+    uuidFive = str(uuid.uuid4())
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidFive, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=80, south=80, east=85, north=85, altitude=0, ceiling=0, area=25,
+        meta={"event": "Kuling", "severity": "Moderate", "awarenessLevel": 2, "stuff": 1}
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=str(uuid.uuid4()), identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=80, south=80, east=85, north=85, altitude=0, ceiling=0, area=25
+    ) is True
+    assert theDB.searchBounds("alert", 81, 81, 84, 84, filters={"event": ["Kuling"]})[0][16:] == (
+        "Kuling", None, "Moderate", None, 2
+    )
+    assert len(theDB.searchBounds("alert", 81, 81, 84, 84, filters={})) == 2
+    assert [r[1] for r in theDB.searchBounds("alert", 81, 81, 84, 84, filters={
+        "severity": ["Severe", "Moderate"], "awarenessLevel": [2, 3]
+    })] == [uuidFive]
+    assert theDB.searchBounds("alert", 81, 81, 84, 84, filters={"awarenessLevel": [3]}) == []
+    assert theDB.searchBounds("alert", 81, 81, 84, 84, filters={"urgency": ["Future"]}) == []
+    assert theDB.searchBounds("alert", 81, 81, 84, 84, filters={"stuff": ["Kuling"]}) is None
+
+    # Unknown target
+    assert theDB.searchBounds("stuff", 0, 0, 3, 3) is None
+
     # Test Error
     theConn = theDB._conn
     theDB._conn = None
@@ -405,6 +635,38 @@ def testDBSQLite_EditMapRecord(tmpConf, fncDir, caplog):
 # END Test testDBSQLite_EditMapRecord
 
 
+@pytest.mark.db
+def testDBSQLite_FindMapUUID(tmpConf, fncDir):
+    """Test lookup of map records by administrative ID."""
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+    theDB = SQLiteDB()
+
+    uuidOne = str(uuid.uuid4())
+    uuidTwo = str(uuid.uuid4())
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidOne, label="Kommune", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272,
+        meta={"admName": "Oslo", "admID": "0301"}
+    ) is True
+    assert theDB.findMapUUID("0301") == uuidOne
+    assert theDB.findMapUUID("5001") is None
+
+    # The most recently added record wins
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidTwo, label="Kommune", source="test source",
+        coordSystem="WGS84", west=-10, south=-9, east=8, north=7, area=272,
+        meta={"admName": "Oslo", "admID": "0301"}
+    ) is True
+    assert theDB.findMapUUID("0301") == uuidTwo
+
+    # No connection
+    theDB._conn = None
+    assert theDB.findMapUUID("0301") is None
+
+# END Test testDBSQLite_FindMapUUID
+
+
 @pytest.mark.db
 def testDBSQLite_EditAlertRecord(tmpConf, fncDir, caplog):
     """Test MapAlert table INSERT and UPDATE."""
@@ -485,6 +747,36 @@ def testDBSQLite_EditAlertRecord(tmpConf, fncDir, caplog):
     ) is False
     assert "SentDate must be a datetime object" in caplog.text
 
+    # Wrong Validity Period
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=-8, north=7, altitude=100, ceiling=200, area=272,
+        onsetDate="2021-01-01", expiresDate="2021-01-02"
+    ) is False
+    assert "OnsetDate must be a datetime object" in caplog.text
+    assert "ExpiresDate must be a datetime object or None" in caplog.text
+
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=-8, north=7, altitude=100, ceiling=200, area=272,
+        expiresDate=datetime(2020, 12, 31)
+    ) is False
+    assert "ExpiresDate must be later than OnsetDate" in caplog.text
+
+    # Invalid Parts
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=newUUID, identifier="mockAlert", sentDate=mockDate,
+        sourcePath="mock.cap.xml", coordSystem="WGS84",
+        west=-10, south=-9, east=-8, north=7, altitude=100, ceiling=200, area=272,
+        parts=[(1, 2, 3)]
+    ) is False
+    assert "Parts must be a list of (west, south, east, north) bounds" in caplog.text
+
     # Database Insert
     # ===============
     newUUID = str(uuid.uuid4())
@@ -500,7 +792,8 @@ def testDBSQLite_EditAlertRecord(tmpConf, fncDir, caplog):
     theData = cursor.fetchall()
     assert theData[0] == (
         1, newUUID, "mockAlert", mockDate.isoformat(), "mock.cap.xml", "WGS84",
-        -10.0, -9.0, 8.0, 7.0, 100.0, 200.0, 272.0
+        -10.0, -9.0, 8.0, 7.0, 100.0, 200.0, 272.0, 1, mockDate.isoformat(), None,
+        None, None, None, None, None
     )
 
     # Database Update
@@ -508,14 +801,16 @@ def testDBSQLite_EditAlertRecord(tmpConf, fncDir, caplog):
     assert theDB.editAlertRecord(
         cmd="update", recordUUID=newUUID, identifier="mockAlert2", sentDate=mockDate,
         sourcePath="mock2.cap.xml", coordSystem="WGS84",
-        west=-11, south=-10, east=7, north=6, altitude=50, ceiling=150, area=272
+        west=-11, south=-10, east=7, north=6, altitude=50, ceiling=150, area=272,
+        valid=False
     ) is True
 
     cursor = theDB._conn.execute("SELECT * FROM AlertData;")
     theData = cursor.fetchall()
     assert theData[0] == (
         1, newUUID, "mockAlert2", mockDate.isoformat(), "mock2.cap.xml", "WGS84",
-        -11.0, -10.0, 7.0, 6.0, 50.0, 150.0, 272.0
+        -11.0, -10.0, 7.0, 6.0, 50.0, 150.0, 272.0, 0, mockDate.isoformat(), None,
+        None, None, None, None, None
     )
 
     # SQL Error
@@ -553,3 +848,252 @@ def testDBSQLite_EditAlertRecord(tmpConf, fncDir, caplog):
     assert "Unknown command 'blabla'" in caplog.text
 
 # END Test testDBSQLite_AlertMapRecord
+
+
+@pytest.mark.db
+def testDBSQLite_OverlapCells(tmpConf, fncDir, caplog):
+    """Test the grid cell coverage of alerts."""
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    theDB = SQLiteDB()
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    uuidA = str(uuid.uuid4())
+    uuidB = str(uuid.uuid4())
+
+    # Cells must be a dictionary
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4, cells=["0"]
+    ) is False
+    assert "Cells must be a dictionary of areas by quadkey" in caplog.text
+
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        cells={"01": 2.0, "02": 2.0}
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidB, identifier="mockB", sentDate=mockDate,
+        sourcePath="b.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=1,
+        cells={"02": 1.0}
+    ) is True
+
+    assert sorted(theDB.overlapCells({"01": 0.5, "02": 1.0, "03": 1.0})) == sorted([
+        (uuidA, 3.0), (uuidB, 1.0)
+    ])
+    assert theDB.overlapCells({"03": 1.0}) == []
+
+    # Look up by cell
+    assert sorted(row[2] for row in theDB.searchCells(["01", "02"])) == ["mockA", "mockB"]
+    assert [row[2] for row in theDB.searchCells(["01", "03"])] == ["mockA"]
+    assert theDB.searchCells(["03"]) == []
+    assert theDB.searchCells([]) == []
+
+    # Replacing the record replaces its cells
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        cells={"03": 4.0}
+    ) is True
+    assert theDB.overlapCells({"01": 1.0, "03": 0.5}) == [(uuidA, 2.0)]
+    assert [row[2] for row in theDB.searchCells(["01", "03"])] == ["mockA"]
+    assert theDB.searchCells(["01"]) == []
+
+# END Test testDBSQLite_OverlapCells
+
+
+@pytest.mark.db
+def testDBSQLite_SearchGeocodes(tmpConf, fncDir, caplog):
+    """Test the geocode lookup of alerts."""
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    theDB = SQLiteDB()
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    uuidA = str(uuid.uuid4())
+    uuidB = str(uuid.uuid4())
+
+    # Geocodes must be a list of pairs of strings
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        geocodes=[("kommune", 301)]
+    ) is False
+    assert "Geocodes must be a list of (valueName, value) pairs" in caplog.text
+
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        geocodes=[("kommune", "0301"), ("MET_areaID", "area1")]
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidB, identifier="mockB", sentDate=mockDate,
+        sourcePath="b.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=1000, ceiling=2000, area=4,
+        geocodes=[("kommune", "3005")], meta={"severity": "Severe"}
+    ) is True
+
+    # Look up by geocode, where both the value name and value must match
+    assert [row[2] for row in theDB.searchGeocodes([("kommune", "0301")])] == ["mockA"]
+    assert [row[2] for row in theDB.searchGeocodes([("MET_areaID", "0301")])] == []
+    assert sorted(row[2] for row in theDB.searchGeocodes([
+        ("kommune", "3005"), ("MET_areaID", "area1")
+    ])) == ["mockA", "mockB"]
+    assert theDB.searchGeocodes([]) == []
+
+    # The vertical range and filters are applied
+    geocodes = [("kommune", "0301"), ("kommune", "3005")]
+    assert [row[2] for row in theDB.searchGeocodes(geocodes, vertical=(0, 500))] == ["mockA"]
+    assert [row[2] for row in theDB.searchGeocodes(
+        geocodes, filters={"severity": ["Severe"]}
+    )] == ["mockB"]
+    assert theDB.searchGeocodes(geocodes, period=(datetime(2020, 1, 1), None)) != []
+    assert theDB.searchGeocodes(geocodes, period=(None, datetime(2020, 1, 1))) == []
+
+    # Replacing the record replaces its geocodes
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        geocodes=[("kommune", "0302")]
+    ) is True
+    assert theDB.searchGeocodes([("kommune", "0301")]) == []
+    assert [row[2] for row in theDB.searchGeocodes([("kommune", "0302")])] == ["mockA"]
+
+# END Test testDBSQLite_SearchGeocodes
+
+
+@pytest.mark.db
+def testDBSQLite_SearchText(tmpConf, fncDir, caplog):
+    """Test the text search of alerts."""
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    theDB = SQLiteDB()
+
+    mockDate = datetime(2021, 1, 1, 12, 0, 0)
+    uuidA = str(uuid.uuid4())
+    uuidB = str(uuid.uuid4())
+
+    # The area description must be a dictionary of strings
+    caplog.clear()
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        areaDesc="Måløy - Svinøy"
+    ) is False
+    assert "AreaDesc must be a dictionary of descriptions by language" in caplog.text
+
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        areaDesc={"no": "Måløy - Svinøy", "en-GB": "Maaloey - Svinoey"}
+    ) is True
+    assert theDB.editAlertRecord(
+        cmd="insert", recordUUID=uuidB, identifier="mockB", sentDate=mockDate,
+        sourcePath="b.cap.xml", coordSystem="WGS84",
+        west=4, south=4, east=6, north=6, altitude=0, ceiling=1, area=4,
+        areaDesc={"no": "Sogn og Fjordane", "en-GB": "Sogn and Fjordane"},
+        meta={"severity": "Severe"}
+    ) is True
+
+    # Words are matched in any language, ignoring case and diacritics
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="måløy")] == ["mockA"]
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="MALØY")] == ["mockA"]
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="maaloey")] == ["mockA"]
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="Sogn")] == ["mockB"]
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Måløy Fjordane") == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Mål") == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text=" - ") == []
+
+    # All words must be found in the description of one language
+    assert [row[2] for row in theDB.searchBounds(
+        "alert", 0, 0, 9, 9, text="Sogn og Fjordane"
+    )] == ["mockB"]
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="og and") == []
+
+    # Words that are operators in FTS5 are matched as words
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Sogn AND NOT") == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text='"Sogn" * (og)') != []
+
+    # The text is combined with the other filters
+    assert theDB.searchBounds("alert", 0, 0, 3, 3, text="Sogn") == []
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Sogn", vertical=(5, 9)) == []
+    assert theDB.searchBounds(
+        "alert", 0, 0, 9, 9, text="Sogn", filters={"severity": ["Minor"]}
+    ) == []
+    assert theDB.searchCells([], text="Sogn") == []
+    assert theDB.searchGeocodes([], text="Sogn") == []
+
+    # Replacing the record replaces its descriptions
+    assert theDB.editAlertRecord(
+        cmd="replace", recordUUID=uuidA, identifier="mockA", sentDate=mockDate,
+        sourcePath="a.cap.xml", coordSystem="WGS84",
+        west=0, south=0, east=2, north=2, altitude=0, ceiling=1, area=4,
+        areaDesc={"no": "Florø"}
+    ) is True
+    assert theDB.searchBounds("alert", 0, 0, 9, 9, text="Måløy") == []
+    assert [row[2] for row in theDB.searchBounds("alert", 0, 0, 9, 9, text="florø")] == ["mockA"]
+
+# END Test testDBSQLite_SearchText
+
+
+@pytest.mark.db
+def testDBSQLite_SearchTiles(tmpConf, fncDir, caplog):
+    """Test the tiles of map records."""
+    tmpConf.dbProvider = "sqlite"
+    tmpConf.sqlitePath = fncDir
+
+    theDB = SQLiteDB()
+    uuidA = str(uuid.uuid4())
+    uuidB = str(uuid.uuid4())
+
+    # Tiles must have bounds and an area
+    caplog.clear()
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidA, label="mockA", source="test", coordSystem="WGS84",
+        west=0, south=0, east=2, north=1, area=2, tiles=[(0, 0, 1, 1)]
+    ) is False
+    assert "Tiles must be a list of (west, south, east, north, area) tuples" in caplog.text
+
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidA, label="mockA", source="test", coordSystem="WGS84",
+        west=0, south=0, east=2, north=1, area=2, tiles=[(0, 0, 1, 1, 1.5), (1, 0, 2, 1, 0.5)]
+    ) is True
+    assert theDB.editMapRecord(
+        cmd="insert", recordUUID=uuidB, label="mockB", source="test", coordSystem="WGS84",
+        west=5, south=5, east=6, north=6, area=1
+    ) is True
+
+    # Records without tiles are a single tile numbered -1
+    assert sorted(theDB.searchTiles(0.5, 0.5, 5.5, 5.5)) == sorted([
+        (uuidA, 0, 0.0, 0.0, 1.0, 1.0, 1.5),
+        (uuidA, 1, 1.0, 0.0, 2.0, 1.0, 0.5),
+        (uuidB, -1, 5.0, 5.0, 6.0, 6.0, 1.0),
+    ])
+    assert theDB.searchTiles(1.5, 0.5, 2.5, 0.8) == [(uuidA, 1, 1.0, 0.0, 2.0, 1.0, 0.5)]
+    assert theDB.searchTiles(3.0, 3.0, 4.0, 4.0) == []
+
+    # Updating the record replaces its tiles
+    assert theDB.editMapRecord(
+        cmd="update", recordUUID=uuidA, label="mockA", source="test", coordSystem="WGS84",
+        west=0, south=0, east=2, north=1, area=2
+    ) is True
+    assert theDB.searchTiles(0.5, 0.5, 1.5, 0.8) == [(uuidA, -1, 0.0, 0.0, 2.0, 1.0, 2.0)]
+
+    # Purging the maps also removes the tiles
+    assert theDB.purgeMapTable() is True
+    assert theDB.searchTiles(-180.0, -90.0, 180.0, 90.0) == []
+
+# END Test testDBSQLite_SearchTiles
@@ -24,6 +24,8 @@ import pytest
 
 from tools import writeFile
 
+from ma_search.data import Shape
+from ma_search.db.memory import MemoryDB
 from ma_search.utils import ingestCap
 from ma_search.common import preparePath
 
@@ -62,7 +64,7 @@ class MockCap:
         ]]
         assert jsonData["altitude"] == 0.0
         assert jsonData["ceiling"] == 1.0
-        assert jsonData["area"] == 1.0
+        assert jsonData["area"] == pytest.approx(Shape.boxArea(1.0, 1.0, 2.0, 2.0), rel=1e-3)
         assert jsonData["bounds"]["east"] == 2.0
         assert jsonData["bounds"]["west"] == 1.0
         assert jsonData["bounds"]["north"] == 2.0
@@ -143,3 +145,30 @@ def testUtil_IngestCap(filesDir, fncDir, tmpConf, caplog):
 
     # Path to file that does not exist
     ingestCap([os.path.join(filesDir, "nonExistentFile.xml")])
+
+
+@pytest.mark.utils
+def testUtil_IngestCapMemory(fncDir, tmpConf):
+    """Tests that ingestCap writes the memory index snapshot when done."""
+    tmpConf.dataPath = fncDir
+    tmpConf.dbProvider = "memory"
+    tmpConf.memoryPath = fncDir
+
+    testCap = os.path.join(fncDir, "good.cap.xml")
+    writeFile(testCap, (
+        "<alert>"
+        "<identifier>mockAlert</identifier>"
+        "<sent>2021-09-27T16:00:00Z</sent>"
+        "<info>"
+        "<area>"
+        "<polygon>1,1 1,2 2,2 2,1 1,1</polygon>"
+        "</area>"
+        "</info>"
+        "</alert>"
+    ))
+    ingestCap([testCap])
+
+    snapFile = os.path.join(fncDir, "index.npz")
+    assert os.path.isfile(snapFile)
+    theDB = MemoryDB()
+    assert len(theDB.searchBounds("alert", 0, 0, 3, 3)) == 1